@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+collect.py の収集関数のベンチマーク
+
+bench/fixtures.py の合成フィクスチャを倍率ごとに生成し、各ソースの収集関数を計測して
+結果を JSON Lines で追記する。計測の前に、チェックポイントの有無で出力が変わらないことを確かめる。同じファイルに別のコミットの結果を追記していけば比較できる。
+結果はリポジトリの外（collect.py のキャッシュディレクトリの bench-results.jsonl）に書く。
+
+使い方:
+    python bench/collectors.py                              # 1x / 10x / 100x
+    python bench/collectors.py --scales 1,10 --repeat 5
+    python bench/collectors.py --label after-change --results /tmp/bench-results.jsonl
+"""
+
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import collect  # noqa: E402
+from fixtures import generate, use_fixture_env  # noqa: E402
+
+
+def collectors(cutoff_ms: int | None, checkpoints: collect.CheckpointStore | None = None) -> list:
+    """(ソース名, 収集関数) の一覧。checkpoints を省略するとチェックポイントは使わず毎回全量を解析する"""
+    if checkpoints is None:
+        checkpoints = collect.CheckpointStore(None)
+    return [
+        ("Claude Code", lambda: collect.iter_claude_code(cutoff_ms, None, checkpoints)),
+        ("GitHub Copilot Chat", lambda: collect.iter_copilot_chat(cutoff_ms, None)),
+        ("Cline", lambda: collect.iter_cline(cutoff_ms)),
+        ("Roo Code", lambda: collect.iter_roo_code(cutoff_ms)),
+        ("Windsurf", lambda: collect.iter_windsurf(cutoff_ms, checkpoints=checkpoints)),
+        ("Google Antigravity", lambda: collect.iter_antigravity(cutoff_ms, checkpoints=checkpoints)),
+        ("OpenAI Codex", lambda: collect.iter_codex(cutoff_ms, None, checkpoints)),
+        ("OpenCode", lambda: collect.iter_opencode(cutoff_ms, None)),
+    ]
+
+
+def check_cache(cutoff_ms: int | None, workdir: Path) -> list[str]:
+    """チェックポイントなし・初回（キャッシュなし）・2回目（キャッシュあり）の出力を比べ、一致しないソース名を返す"""
+    def collect_all(checkpoints):
+        results = {source: [m.to_dict() for m in stream()] for source, stream in collectors(cutoff_ms, checkpoints)}
+        if checkpoints is not None:
+            checkpoints.save()
+        return results
+
+    with tempfile.TemporaryDirectory(dir=workdir) as cache_dir:
+        path = Path(cache_dir) / "checkpoints.sqlite3"
+        expected = collect_all(None)
+        cold = collect_all(collect.CheckpointStore(path))
+        warm = collect_all(collect.CheckpointStore(path))
+    return [source for source in expected if not expected[source] == cold[source] == warm[source]]
+
+
+def git_revision() -> str | None:
+    try:
+        result = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=Path(__file__).parent,
+                                capture_output=True, text=True, timeout=5)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return result.stdout.strip() or None
+
+
+def measure(stream, repeat: int) -> tuple[float, int]:
+    """最速の実行時間（秒）と収集件数"""
+    best = None
+    count = 0
+    for _ in range(repeat):
+        started = time.perf_counter()
+        count = sum(1 for _ in stream())
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="collect.py の収集関数のベンチマーク")
+    parser.add_argument("--scales", type=str, default="1,10,100", help="フィクスチャの倍率（カンマ区切り、デフォルト: 1,10,100）")
+    parser.add_argument("--workdir", type=Path, default=Path(tempfile.gettempdir()) / "prompt-review-bench",
+                        help="フィクスチャの置き場所（倍率ごとのサブディレクトリを作り、次回以降も使い回す）")
+    parser.add_argument("--results", type=Path, default=collect.get_cache_dir() / "bench-results.jsonl",
+                        help="結果を追記するファイル（JSON Lines、デフォルト: キャッシュディレクトリの bench-results.jsonl）")
+    parser.add_argument("--repeat", type=int, default=3, help="計測回数（最速値を採用）")
+    parser.add_argument("--days", type=int, default=0, help="collect.py の --days 相当（デフォルト: 0 = 全期間）")
+    parser.add_argument("--source", action="append", default=None, help="計測するソース名（複数指定可、デフォルト: 全ソース）")
+    parser.add_argument("--label", type=str, default=None, help="結果に付けるラベル（比較用）")
+    args = parser.parse_args()
+
+    run = {
+        "run_at": datetime.now(tz=timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+        "label": args.label,
+        "git": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "repeat": args.repeat,
+        "days": args.days,
+    }
+    scales = [int(s) for s in args.scales.split(",") if s.strip()]
+    print(f"{'scale':>5}  {'source':<20} {'files':>6} {'MB':>8} {'msgs':>7} {'sec':>8} {'MB/s':>8} {'msgs/s':>9}")
+    args.results.parent.mkdir(parents=True, exist_ok=True)
+    with open(args.results, "a", encoding="utf-8") as out:
+        for scale in scales:
+            root = args.workdir / f"scale-{scale}"
+            manifest = generate(root, scale)
+            with use_fixture_env(root):
+                mismatches = check_cache(collect.compute_cutoff_ms(args.days), args.workdir)
+                if mismatches:
+                    print(f"キャッシュの有無で出力が一致しません: {', '.join(mismatches)}", file=sys.stderr)
+                    sys.exit(1)
+                for source, stream in collectors(collect.compute_cutoff_ms(args.days)):
+                    if args.source and source not in args.source:
+                        continue
+                    seconds, messages = measure(stream, args.repeat)
+                    size = manifest["sources"].get(source, {"files": 0, "bytes": 0})
+                    result = {
+                        **run,
+                        "scale": scale,
+                        "source": source,
+                        "files": size["files"],
+                        "bytes": size["bytes"],
+                        "messages": messages,
+                        "seconds": round(seconds, 6),
+                        "mb_per_s": round(size["bytes"] / 1e6 / seconds, 3) if seconds else None,
+                        "messages_per_s": round(messages / seconds, 1) if seconds else None,
+                    }
+                    out.write(json.dumps(result, ensure_ascii=False) + "\n")
+                    out.flush()
+                    print(f"{scale:>5}  {source:<20} {size['files']:>6} {size['bytes'] / 1e6:>8.1f} {messages:>7} "
+                          f"{seconds:>8.3f} {result['mb_per_s'] or 0:>8.1f} {result['messages_per_s'] or 0:>9.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+"""
+collect.py 用の合成フィクスチャ生成
+
+実在の対話履歴を使わずに性能を測れるよう、collect.py が読む全ソースの偽データを
+ホームディレクトリ相当のツリーとして書き出す。乱数は seed で固定され、同じ引数なら同じ内容になる。
+
+使い方:
+    python bench/fixtures.py /tmp/prompt-review-fixture            # 1倍
+    python bench/fixtures.py /tmp/prompt-review-fixture --scale 10
+    HOME=/tmp/prompt-review-fixture python collect.py --days 0      # 生成したツリーで収集（Linux）
+"""
+
+import argparse
+import base64
+import contextlib
+import json
+import os
+import random
+import sqlite3
+import sys
+import time
+import uuid
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import collect  # noqa: E402
+
+DAY_MS = 86400000
+# 生成データの期間（現在から遡る日数）
+SPAN_DAYS = 60
+# セッションJSONLの行数と行の間隔
+SESSION_LINES = 60
+SESSION_STEP_MS = 30000
+
+PROMPTS = [
+    "このエラーを直して", "テストを追加して", "refactor the parser into smaller functions",
+    "docker compose up が失敗する。ログを見て原因を教えて", "型エラーを修正して", "README を更新して",
+    "この関数の計算量は？", "async/await で書き直して", "CI が落ちているので確認して", "y", "続けて",
+    "Why does this query do a full table scan?", "ログイン画面のバリデーションを追加",
+    "APIキーは sk-" + "a" * 32 + " です", "DATABASE_URL=postgres://app:secret@db:5432/app",
+    "このPRのレビューコメントに対応して", "add retries with exponential backoff", "/clear", "/help",
+    "src/app/main.py", "パフォーマンスを改善したい。プロファイル結果を貼る\n" + "  1.2s parse_rows\n" * 5,
+]
+PROJECTS = ["yonshogen", "dotfiles", "webapp", "infra", "ml-pipeline", "blog", "cli-tool", "mobile"]
+
+
+def fixture_env(root: Path) -> dict:
+    """root をホームディレクトリとして collect.py に読ませるための環境変数"""
+    return {
+        "HOME": str(root),
+        "USERPROFILE": str(root),
+        "APPDATA": str(root / "AppData" / "Roaming"),
+        "XDG_DATA_HOME": str(root / ".local" / "share"),
+        "XDG_CACHE_HOME": str(root / ".cache"),
+        "CODEX_HOME": str(root / ".codex"),
+    }
+
+
+@contextlib.contextmanager
+def use_fixture_env(root: Path):
+    """fixture_env を os.environ に一時的に適用する"""
+    saved = {key: os.environ.get(key) for key in fixture_env(root)}
+    os.environ.update(fixture_env(root))
+    try:
+        yield
+    finally:
+        for key, value in saved.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+
+
+class FixtureWriter:
+    def __init__(self, root: Path, scale: int, seed: int, now_ms: int):
+        self.root = root
+        self.scale = scale
+        self.rnd = random.Random(seed)
+        self.now_ms = now_ms
+        self.sizes = {}
+
+    def prompt(self) -> str:
+        return " ".join(self.rnd.choice(PROMPTS) for _ in range(self.rnd.randint(1, 3)))
+
+    def timestamp_ms(self) -> int:
+        return self.now_ms - self.rnd.randint(0, SPAN_DAYS * DAY_MS)
+
+    def uuid(self) -> str:
+        return str(uuid.UUID(int=self.rnd.getrandbits(128)))
+
+    def record(self, source: str, path: Path):
+        files, size = self.sizes.get(source, (0, 0))
+        self.sizes[source] = (files + 1, size + path.stat().st_size)
+
+    def touch(self, path: Path, ts_ms: int):
+        os.utime(path, (ts_ms / 1000, ts_ms / 1000))
+
+    @staticmethod
+    def iso(ts_ms: int) -> str:
+        return time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(ts_ms / 1000)) + f".{ts_ms % 1000:03d}Z"
+
+    def claude(self):
+        """history.jsonl とプロジェクト別セッションJSONL
+
+        一部のセッションは history.jsonl と sessionId を共有し、その履歴行の時刻はセッションの期間内に置く。
+        """
+        claude_dir = collect.get_claude_dir()
+        claude_dir.mkdir(parents=True, exist_ok=True)
+        sessions = []
+        for project in PROJECTS:
+            for n in range(5 * self.scale):
+                sessions.append((project, self.uuid(), self.timestamp_ms(), n % 4 == 0))
+
+        history = []
+        for _ in range(1000 * self.scale):
+            history.append((self.timestamp_ms(), self.uuid(), self.rnd.choice(PROJECTS)))
+        for project, session_id, start, shared in sessions:
+            if shared:
+                history.append((start + self.rnd.randint(0, SESSION_LINES * SESSION_STEP_MS), session_id, project))
+        history.sort()
+        history_path = claude_dir / "history.jsonl"
+        with open(history_path, "w", encoding="utf-8") as f:
+            for ts, session_id, project in history:
+                f.write(json.dumps({"display": self.prompt(), "pastedContents": {}, "timestamp": ts,
+                                    "project": f"/home/dev/src/{project}", "sessionId": session_id}, ensure_ascii=False) + "\n")
+        self.record("Claude Code", history_path)
+
+        for project, session_id, start, _ in sessions:
+            project_dir = claude_dir / "projects" / f"-home-dev-src-{project}"
+            project_dir.mkdir(parents=True, exist_ok=True)
+            path = project_dir / f"{session_id}.jsonl"
+            with open(path, "w", encoding="utf-8") as f:
+                for k in range(SESSION_LINES):
+                    ts = start + k * SESSION_STEP_MS
+                    entry = {"type": "user", "timestamp": self.iso(ts), "cwd": f"/home/dev/src/{project}", "sessionId": session_id}
+                    if k % 3 == 0:
+                        entry["message"] = {"role": "user", "content": [{"type": "text", "text": self.prompt()}]}
+                    elif k % 3 == 1:
+                        entry["type"] = "assistant"
+                        entry["message"] = {"role": "assistant", "content": [{"type": "text", "text": "了解しました。" + "x" * 1500}]}
+                    else:
+                        entry["message"] = {"role": "user", "content": [{"type": "tool_result", "tool_use_id": self.uuid(), "content": "line\n" * 600}]}
+                    if k == 1:
+                        entry = {"type": "user", "isMeta": True, "timestamp": self.iso(ts), "message": {"role": "user", "content": "<command-name>/clear</command-name>"}}
+                    f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            self.touch(path, start + SESSION_LINES * SESSION_STEP_MS)
+            self.record("Claude Code", path)
+
+    def copilot(self):
+        workspace_storage = collect.get_appdata_path() / "Code" / "User" / "workspaceStorage"
+        for _ in range(10 * self.scale):
+            workspace = workspace_storage / f"{self.rnd.getrandbits(128):032x}"
+            workspace.mkdir(parents=True, exist_ok=True)
+            path = workspace / "state.vscdb"
+            conn = sqlite3.connect(path)
+            conn.execute("CREATE TABLE ItemTable (key TEXT UNIQUE ON CONFLICT REPLACE, value BLOB)")
+            history = {"history": {"panel": [{"text": self.prompt()} for _ in range(self.rnd.randint(0, 20))],
+                                   "editor": [{"text": self.prompt()} for _ in range(self.rnd.randint(0, 5))]}}
+            conn.execute("INSERT INTO ItemTable VALUES (?, ?)", ("memento/interactive-session", json.dumps(history, ensure_ascii=False)))
+            for k in range(50):
+                conn.execute("INSERT INTO ItemTable VALUES (?, ?)", (f"workbench.state.{k}", "v" * 200))
+            conn.commit()
+            conn.close()
+            self.touch(path, self.timestamp_ms())
+            self.record("GitHub Copilot Chat", path)
+
+    def task_histories(self, source: str, extension_id: str):
+        """Cline / Roo Code の tasks/<id>/api_conversation_history.json（base64画像・ツール結果を含む）"""
+        tasks_dir = collect.get_appdata_path() / "Code" / "User" / "globalStorage" / extension_id / "tasks"
+        image = base64.b64encode(self.rnd.randbytes(30000)).decode()
+        for t in range(5 * self.scale):
+            task_dir = tasks_dir / str(self.now_ms - t * 1000)
+            task_dir.mkdir(parents=True, exist_ok=True)
+            messages = []
+            for k in range(30):
+                messages.append({"role": "user", "content": [
+                    {"type": "text", "text": self.prompt()},
+                    {"type": "image", "source": {"type": "base64", "media_type": "image/png", "data": image}} if k % 10 == 0
+                    else {"type": "tool_result", "tool_use_id": self.uuid(), "content": "out\n" * 300},
+                ]})
+                messages.append({"role": "assistant", "content": [{"type": "text", "text": "z" * 1200},
+                                                                  {"type": "tool_use", "id": self.uuid(), "name": "write_to_file",
+                                                                   "input": {"path": "src/a.py", "content": "print(\"hi\")\n" * 100}}]})
+            path = task_dir / "api_conversation_history.json"
+            path.write_text(json.dumps(messages, ensure_ascii=False), encoding="utf-8")
+            self.touch(path, self.timestamp_ms())
+            self.record(source, path)
+
+    def windsurf(self):
+        memories_dir = Path.home() / ".codeium" / "windsurf" / "memories"
+        for m in range(10 * self.scale):
+            project_dir = memories_dir / self.rnd.choice(PROJECTS)
+            project_dir.mkdir(parents=True, exist_ok=True)
+            path = project_dir / f"memory-{m}.md"
+            path.write_text("# メモリ\n" + "ユーザーは型安全なコードを好む。\n" * 40, encoding="utf-8")
+            self.touch(path, self.timestamp_ms())
+            self.record("Windsurf", path)
+
+    def antigravity(self):
+        brain_dir = Path.home() / ".gemini" / "antigravity" / "brain"
+        for c in range(3 * self.scale):
+            log_dir = brain_dir / self.uuid() / ".system_generated" / "logs"
+            log_dir.mkdir(parents=True, exist_ok=True)
+            for n in range(8):
+                path = log_dir / (f"step-{n}.pb" if n == 7 else f"step-{n}.txt")
+                path.write_text("USER: " + self.prompt() + "\n" + "AGENT: ok\n" * 200, encoding="utf-8")
+                self.touch(path, self.timestamp_ms())
+                self.record("Google Antigravity", path)
+
+    def codex(self):
+        sessions_dir = Path(os.environ["CODEX_HOME"]) / "sessions"
+        for r in range(20 * self.scale):
+            start = self.timestamp_ms()
+            day_dir = sessions_dir / time.strftime("%Y/%m/%d", time.gmtime(start / 1000))
+            day_dir.mkdir(parents=True, exist_ok=True)
+            path = day_dir / f"rollout-{time.strftime('%Y-%m-%dT%H-%M-%S', time.gmtime(start / 1000))}-{self.uuid()}.jsonl"
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(json.dumps({"timestamp": self.iso(start), "type": "session_meta",
+                                    "payload": {}, "session_meta": {"cwd": f"/home/dev/src/{self.rnd.choice(PROJECTS)}"}}) + "\n")
+                for k in range(80):
+                    ts = start + k * 5000
+                    if k % 4 == 0:
+                        item = {"type": "message", "role": "user", "content": [{"type": "input_text", "text": self.prompt()}]}
+                    elif k % 4 == 1:
+                        item = {"type": "message", "role": "assistant", "content": [{"type": "output_text", "text": "y" * 800}]}
+                    else:
+                        item = {"type": "function_call_output", "call_id": self.uuid(), "output": "result\n" * 200}
+                    f.write(json.dumps({"timestamp": self.iso(ts), "type": "response_item", "response_item": item}, ensure_ascii=False) + "\n")
+            self.touch(path, start + 80 * 5000)
+            self.record("OpenAI Codex", path)
+
+    def opencode(self):
+        opencode_dir = Path(os.environ["XDG_DATA_HOME"]) / "opencode"
+        opencode_dir.mkdir(parents=True, exist_ok=True)
+        path = opencode_dir / "opencode.db"
+        conn = sqlite3.connect(path)
+        conn.executescript("""
+            CREATE TABLE project (id TEXT PRIMARY KEY, worktree TEXT);
+            CREATE TABLE session (id TEXT PRIMARY KEY, project_id TEXT, parent_id TEXT, directory TEXT);
+            CREATE TABLE message (id TEXT PRIMARY KEY, session_id TEXT, time_created INTEGER, data TEXT);
+            CREATE TABLE part (id TEXT PRIMARY KEY, message_id TEXT, session_id TEXT, time_created INTEGER, data TEXT);
+            CREATE INDEX message_session_idx ON message(session_id);
+            CREATE INDEX part_message_idx ON part(message_id);
+        """)
+        for p, project in enumerate(PROJECTS):
+            conn.execute("INSERT INTO project VALUES (?, ?)", (f"p{p}", f"/home/dev/src/{project}"))
+        sessions = []
+        for s in range(20 * self.scale):
+            parent = sessions[-1] if sessions and s % 5 == 0 else None
+            conn.execute("INSERT INTO session VALUES (?, ?, ?, ?)", (f"s{s}", f"p{s % len(PROJECTS)}", parent, f"/home/dev/src/{PROJECTS[s % len(PROJECTS)]}"))
+            sessions.append(f"s{s}")
+        for m in range(500 * self.scale):
+            ts = self.timestamp_ms()
+            session_id = self.rnd.choice(sessions)
+            role = "user" if m % 2 == 0 else "assistant"
+            conn.execute("INSERT INTO message VALUES (?, ?, ?, ?)", (f"m{m}", session_id, ts, json.dumps({"role": role})))
+            parts = [{"type": "text", "text": self.prompt() if role == "user" else "w" * 600},
+                     {"type": "text", "text": "<system-reminder>", "synthetic": True},
+                     {"type": "tool", "tool": "bash", "state": {"output": "o\n" * 300}}]
+            for k, part in enumerate(parts):
+                conn.execute("INSERT INTO part VALUES (?, ?, ?, ?, ?)", (f"m{m}p{k}", f"m{m}", session_id, ts + k, json.dumps(part, ensure_ascii=False)))
+        conn.commit()
+        conn.close()
+        self.record("OpenCode", path)
+
+    def write_all(self) -> dict:
+        self.claude()
+        self.copilot()
+        self.task_histories("Cline", "saoudrizwan.claude-dev")
+        self.task_histories("Roo Code", "RooVeterinaryInc.roo-cline")
+        self.windsurf()
+        self.antigravity()
+        self.codex()
+        self.opencode()
+        return {source: {"files": files, "bytes": size} for source, (files, size) in self.sizes.items()}
+
+
+MANIFEST = "fixture.json"
+# 生成内容を変えたら上げる（古いフィクスチャを使い回さないため）
+FIXTURE_VERSION = 2
+
+
+def generate(root: Path, scale: int = 1, seed: int = 0) -> dict:
+    """root に合成フィクスチャを書き出し、ソース別のファイル数・バイト数を含むマニフェストを返す
+
+    同じ scale / seed / バージョンで生成済みならそのまま使う。
+    """
+    manifest_path = root / MANIFEST
+    try:
+        manifest = json.loads(manifest_path.read_text(encoding="utf-8"))
+        if (manifest.get("version"), manifest.get("scale"), manifest.get("seed")) == (FIXTURE_VERSION, scale, seed):
+            return manifest
+    except (OSError, ValueError):
+        pass
+    if root.exists() and any(root.iterdir()):
+        raise SystemExit(f"{root} は空ではありません（別の条件で生成済みなら削除してください）")
+
+    root.mkdir(parents=True, exist_ok=True)
+    now_ms = int(time.time() * 1000)
+    with use_fixture_env(root):
+        sources = FixtureWriter(root, scale, seed, now_ms).write_all()
+    manifest = {"version": FIXTURE_VERSION, "scale": scale, "seed": seed, "generated_at_ms": now_ms, "sources": sources}
+    manifest_path.write_text(json.dumps(manifest, ensure_ascii=False, indent=2), encoding="utf-8")
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description="collect.py 用の合成フィクスチャを生成する")
+    parser.add_argument("root", type=Path, help="出力先（ホームディレクトリとして使う）")
+    parser.add_argument("--scale", type=int, default=1, help="データ量の倍率（デフォルト: 1）")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    manifest = generate(args.root, args.scale, args.seed)
+    json.dump(manifest, sys.stdout, ensure_ascii=False, indent=2)
+    print()
+    for key, value in fixture_env(args.root).items():
+        print(f"{key}={value}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+メッセージ1件あたりのメモリ使用量のベンチマーク
+
+従来の dict（text, timestamp, timestamp_ms, project）と現在の collect.Message を、収集関数と同じく
+project をファイルパスから1件ごとに切り出して作り、tracemalloc で保持しているメモリを比較する。
+本文は両方で共有するので、差はレコード本体・表示用タイムスタンプ・プロジェクト名の分。
+
+使い方:
+    python bench/memory.py                     # 50万件
+    python bench/memory.py --messages 1000000 --projects 200
+"""
+
+import argparse
+import gc
+import random
+import sys
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import collect  # noqa: E402
+
+BASE_MS = 1_735_689_600_000  # 2025-01-01 UTC
+
+
+def make_inputs(n: int, projects: int, seed: int) -> list[tuple[str, int, str]]:
+    """(本文, epochミリ秒, プロジェクトのパス) の一覧"""
+    rnd = random.Random(seed)
+    paths = [f"/home/dev/src/project-{i:04d}" for i in range(projects)]
+    texts = [f"プロンプト {i} " + "x" * rnd.randint(10, 200) for i in range(1000)]
+    return [(rnd.choice(texts), BASE_MS + rnd.randrange(365 * 86_400_000), rnd.choice(paths)) for _ in range(n)]
+
+
+def as_dicts(inputs):
+    return [{
+        "text": text,
+        "timestamp": collect.ts_to_iso(ts_ms),
+        "timestamp_ms": ts_ms,
+        "project": Path(path).name,
+    } for text, ts_ms, path in inputs]
+
+
+def as_messages(inputs):
+    return [collect.Message(text, ts_ms, Path(path).name) for text, ts_ms, path in inputs]
+
+
+def measure(build, inputs) -> int:
+    """build(inputs) の結果が保持しているバイト数"""
+    gc.collect()
+    tracemalloc.start()
+    records = build(inputs)
+    gc.collect()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del records
+    return current
+
+
+def main():
+    parser = argparse.ArgumentParser(description="メッセージ1件あたりのメモリ使用量のベンチマーク")
+    parser.add_argument("--messages", type=int, default=500_000, help="メッセージ数（デフォルト: 500000）")
+    parser.add_argument("--projects", type=int, default=50, help="プロジェクト数")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    inputs = make_inputs(args.messages, args.projects, args.seed)
+    mismatches = sum(1 for d, m in zip(as_dicts(inputs[:10_000]), as_messages(inputs[:10_000])) if d != m.to_dict())
+    if mismatches:
+        print(f"出力が {mismatches} 件で一致しません", file=sys.stderr)
+        sys.exit(1)
+
+    baseline = measure(as_dicts, inputs)
+    current = measure(as_messages, inputs)
+    print(f"messages:      {len(inputs)}")
+    print(f"dict:          {baseline / 1e6:.1f} MB ({baseline / len(inputs):.0f} B/msg)")
+    print(f"Message:       {current / 1e6:.1f} MB ({current / len(inputs):.0f} B/msg)")
+    print(f"reduction:     {baseline / current:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
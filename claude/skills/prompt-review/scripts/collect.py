@@ -9,19 +9,57 @@ prompt-review スキル用データ収集スクリプト
     python collect.py --days 30                # 過去30日分
     python collect.py --project yonshogen      # 特定プロジェクト
     python collect.py --project yonshogen --days 30
+    python collect.py --no-cache               # チェックポイントを使わず全量を再解析
+    python collect.py --jobs 8 --timeout 60    # 各ソースを並行収集（ソースごとに60秒で打ち切り）
+    python collect.py --parse-workers 1        # セッションJSONLの並列解析を無効化
+    python collect.py --days 0 --index         # 収集結果をSQLiteインデックスにも追加
+    python collect.py query "docker" --days 30 # インデックスを全文検索
+    python collect.py query --emit-json --days 7  # インデックスから通常と同じ形のJSONを出力
+    python collect.py query --rollup week --days 180  # 週×プロジェクト×ツールの件数推移をインデックスから出力
+    python collect.py --format ndjson          # 1行1レコードで逐次出力（集計は末尾のレコード）
+    python collect.py --near-dup collapse      # ツールをまたいだ近似重複を1件にまとめる
+    python collect.py --profile 20             # summary.perf にソース別の計測値と遅いファイル上位20件を出す
+    python collect.py --budget-ms 2000         # 件数の上限なしで新しい順に走査し、2秒で打ち切る
+    python collect.py watch                    # 履歴を監視してインデックスを更新し続ける（通常の実行はインデックスから即答）
+    python collect.py --days 365 --export prompts.parquet  # メッセージを Parquet に書き出す（pyarrow が必要）
+    python collect.py --days 7 --no-partition-prune  # Codex の古い日付ディレクトリも走査する（再開したセッションの追記を拾う）
+    python collect.py --root /backup/laptop --root /backup/desktop  # 複数のホームのバックアップをまとめて収集
+    python collect.py --days 30 --timeline     # 全ソースを時刻の古い順に1本にした NDJSON を出力
+    python collect.py --days 30 --max-messages 500  # ツール×プロジェクトごとに偏りなく500件に間引く
 """
 
 import argparse
+import codecs
+import ctypes
+import ctypes.util
+import fnmatch
+import hashlib
+import heapq
+import io
 import json
+import mmap
+import multiprocessing
 import os
 import platform
+import queue
+import random
 import re
+import select
+import signal
 import sqlite3
+import struct
 import subprocess
 import sys
+import threading
 import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from datetime import datetime, timedelta, timezone
+from functools import partial
+from itertools import groupby, pairwise
 from pathlib import Path
+from typing import Callable, Iterator, NamedTuple
 
 
 # クレデンシャル・シークレット検出パターン
@@ -44,12 +82,73 @@ SECRET_PATTERNS = [
 ]
 _compiled_patterns = [(re.compile(p), label) for p, label in SECRET_PATTERNS]
 
+# 各パターンのマッチの先頭に必ず現れるリテラル（casefold したテキストから探す）。
+# SECRET_PATTERNS にパターンを追加するときは、ここにも先頭のリテラルを登録する
+SECRET_ANCHORS = {
+    "API Key": ["api"],
+    "Secret/Token/Password": ["secret", "token", "passw", "pwd"],
+    "Access Key": ["access", "secret"],
+    "Bearer Token": ["bearer"],
+    "OpenAI API Key": ["sk-"],
+    "Anthropic API Key": ["sk-"],
+    "GitHub Personal Access Token": ["ghp_"],
+    "GitHub OAuth Token": ["gho_"],
+    "Google API Key": ["AIza"],
+    "AWS Key": ["aws"],
+    "Slack Token": ["xox"],
+    "Private Key": ["-----BEGIN"],
+    "MongoDB Connection String": ["mongodb"],
+    "PostgreSQL Connection String": ["postgres"],
+    "MySQL Connection String": ["mysql"],
+}
+
+
+def _compile_anchors() -> list[tuple[str, list[int]]]:
+    """アンカー → それを含み得るパターン番号 の一覧を作る"""
+    targets = {}
+    for i, (_, label) in enumerate(SECRET_PATTERNS):
+        for anchor in SECRET_ANCHORS[label]:
+            targets.setdefault(anchor.casefold(), []).append(i)
+    return list(targets.items())
+
+
+_secret_anchors = _compile_anchors()
+
+# 分析対象外のコマンド入力
+SKIP_PATTERNS = ["/clear", "/help"]
+
 
 def scan_secrets(text: str) -> list[dict]:
-    """テキスト内のクレデンシャル・シークレットを検出する"""
+    """テキスト内のクレデンシャル・シークレットを検出する
+
+    まずアンカー（リテラル）の出現位置を調べ、見つかったアンカーで始まり得るパターンだけを、
+    その位置から照合する。どのパターンのマッチも対応するアンカーで始まるので、
+    結果は全パターンを順に finditer した場合と同じ。
+    """
+    folded = text.casefold()
+    if "ı" in folded:
+        # (?i) の正規表現では dotless i も "i" に一致するが、casefold では変換されない
+        folded = folded.replace("ı", "i")
+    candidates = {}
+    for anchor, targets in _secret_anchors:
+        pos = folded.find(anchor)
+        while pos != -1:
+            for i in targets:
+                candidates.setdefault(i, []).append(pos)
+            pos = folded.find(anchor, pos + 1)
+    if not candidates:
+        return []
+
+    # casefold で文字数が変わった場合（ß など）は位置が対応しないので、候補パターンを先頭から照合する
+    aligned = len(folded) == len(text)
     findings = []
-    for pattern, label in _compiled_patterns:
-        for match in pattern.finditer(text):
+    for i in sorted(candidates):
+        pattern, label = _compiled_patterns[i]
+        if aligned:
+            matches = _match_at(pattern, text, sorted(set(candidates[i])))
+        else:
+            matches = pattern.finditer(text)
+        for match in matches:
             matched = match.group()
             # マスク処理: 先頭8文字 + *** + 末尾4文字（短い場合は全体マスク）
             if len(matched) > 16:
@@ -63,6 +162,18 @@ def scan_secrets(text: str) -> list[dict]:
     return findings
 
 
+def _match_at(pattern: re.Pattern, text: str, positions: list[int]):
+    """マッチの開始位置の候補だけを試す finditer（重ならない左端優先のマッチを同じ順に返す）"""
+    end = 0
+    for pos in positions:
+        if pos < end:
+            continue
+        match = pattern.match(text, pos)
+        if match:
+            yield match
+            end = match.end()
+
+
 def get_appdata_path() -> Path:
     """OSに応じたAppDataパスを返す"""
     system = platform.system()
@@ -78,6 +189,145 @@ def get_claude_dir() -> Path:
     return Path.home() / ".claude"
 
 
+def get_cache_dir() -> Path:
+    """チェックポイント等のキャッシュ保存先を返す"""
+    return Path(os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache")) / "prompt-review"
+
+
+class FileEntry(NamedTuple):
+    """ディレクトリ走査で見つけたファイル・ディレクトリ（stat はエントリごとに1回だけ）"""
+    path: Path
+    mtime: float
+    size: int
+
+    @property
+    def mtime_ms(self) -> int:
+        return int(self.mtime * 1000)
+
+
+def _entry(entry: os.DirEntry) -> FileEntry | None:
+    try:
+        st = entry.stat()
+    except OSError:
+        return None
+    return FileEntry(Path(entry.path), st.st_mtime, st.st_size)
+
+
+def scan_dir(directory: Path, pattern: str | None = None, dirs: bool = False) -> list[FileEntry]:
+    """directory 直下のファイル（dirs=True ならディレクトリ）を os.scandir で列挙する
+
+    pattern は fnmatch 形式（pathlib の glob と同じく Windows では大文字小文字を区別しない）。
+    """
+    found = []
+    try:
+        it = os.scandir(directory)
+    except OSError:
+        return found
+    with it:
+        for entry in it:
+            if pattern and not fnmatch.fnmatch(entry.name, pattern):
+                continue
+            try:
+                if (entry.is_dir() if dirs else entry.is_file()):
+                    item = _entry(entry)
+                    if item:
+                        found.append(item)
+            except OSError:
+                continue
+    return found
+
+
+def walk_files(root: Path, pattern: str | None = None, prune_before_ms: int | None = None) -> list[FileEntry]:
+    """root 以下のファイルを再帰的に os.scandir で列挙する（rglob と同じく、各ディレクトリのファイルの後にサブディレクトリを辿る）
+
+    prune_before_ms を指定すると、更新日時がそれより前のサブディレクトリには降りない。
+    ディレクトリの更新日時はファイルの追加・削除でしか変わらないため、古いディレクトリ内の既存ファイルへの追記は見落とす。
+    シンボリックリンクのディレクトリは辿らない。
+    """
+    found = []
+
+    def walk(directory):
+        subdirs = []
+        try:
+            it = os.scandir(directory)
+        except OSError:
+            return
+        with it:
+            for entry in it:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        if prune_before_ms:
+                            item = _entry(entry)
+                            if item is None or item.mtime_ms < prune_before_ms:
+                                continue
+                        subdirs.append(entry.path)
+                    elif (not pattern or fnmatch.fnmatch(entry.name, pattern)) and entry.is_file():
+                        item = _entry(entry)
+                        if item:
+                            found.append(item)
+                except OSError:
+                    continue
+        for subdir in subdirs:
+            walk(subdir)
+
+    walk(root)
+    return found
+
+
+# 日付ディレクトリの名前はローカル日付のことがあるため、UTC のカットオフより1日前までは残す
+PARTITION_SLACK_MS = 24 * 60 * 60 * 1000
+
+
+def iter_partitioned_files(root: Path, pattern: str, cutoff_ms: int | None, prune_before_ms: int | None = None) -> Iterator[FileEntry]:
+    """root/YYYY/MM/DD/ 以下のファイルを日付ディレクトリの新しい順に返す（同じ日の中は更新日時の新しい順）
+
+    cutoff_ms より前の年・月・日のディレクトリには、名前だけで判断して降りない（中を列挙も stat もしない）。
+    ディレクトリの日付は作成時のものなので、古い日付のファイルへの後からの追記は見落とす。
+    日付の形でないファイル・ディレクトリ（古いバージョンの平置きなど）は、最後に walk_files でまとめて返す。
+    """
+    cutoff = None
+    if cutoff_ms:
+        cutoff = datetime.fromtimestamp((cutoff_ms - PARTITION_SLACK_MS) / 1000, tz=timezone.utc).date()
+        cutoff = (cutoff.year, cutoff.month, cutoff.day)
+
+    def partitions(directory: Path, digits: int) -> list[tuple[int, Path]]:
+        """名前が digits 桁の数字のサブディレクトリを (数値, パス) で新しい順に返す"""
+        found = []
+        for entry in scan_dir(directory, dirs=True):
+            name = entry.path.name
+            if len(name) != digits or not name.isdigit():
+                continue
+            if prune_before_ms and entry.mtime_ms < prune_before_ms:
+                continue
+            found.append((int(name), entry.path))
+        return sorted(found, reverse=True)
+
+    for year, year_dir in partitions(root, 4):
+        if cutoff and year < cutoff[0]:
+            break
+        for month, month_dir in partitions(year_dir, 2):
+            if cutoff and (year, month) < cutoff[:2]:
+                break
+            for day, day_dir in partitions(month_dir, 2):
+                if cutoff and (year, month, day) < cutoff:
+                    break
+                yield from newest_first(scan_dir(day_dir, pattern))
+
+    yield from newest_first(scan_dir(root, pattern))
+    for entry in scan_dir(root, dirs=True):
+        name = entry.path.name
+        if len(name) == 4 and name.isdigit():
+            continue
+        if prune_before_ms and entry.mtime_ms < prune_before_ms:
+            continue
+        yield from newest_first(walk_files(entry.path, pattern, prune_before_ms))
+
+
+def newest_first(entries: list[FileEntry], limit: int | None = None) -> list[FileEntry]:
+    """更新日時の新しい順に並べ、先頭 limit 件を返す"""
+    return sorted(entries, key=lambda e: e.mtime, reverse=True)[:limit]
+
+
 def ts_to_iso(ts_ms: int) -> str:
     """Unix epoch ミリ秒をISO 8601文字列に変換"""
     try:
@@ -86,6 +336,67 @@ def ts_to_iso(ts_ms: int) -> str:
         return "unknown"
 
 
+class Message:
+    """収集した1件のプロンプト
+
+    件数が数十万になると1件ごとの dict が重いため __slots__ で持つ。project は sys.intern で共有し、
+    表示用の timestamp は出力するときに timestamp_ms から作る。ツール名は1件ごとには持たない（ソース・イベント単位）。
+    container は件数の上限がかかる取り込み元の (グループ, ファイル・タスク)。同じファイルのメッセージで1つのタプルを共有する。
+    """
+
+    __slots__ = ("text", "timestamp_ms", "project", "note", "near_dup_of", "container")
+
+    def __init__(self, text: str, timestamp_ms: int, project: str = "unknown", note: str | None = None, near_dup_of: int | None = None, container: tuple[str, str] | None = None):
+        self.text = text
+        self.timestamp_ms = timestamp_ms or 0
+        self.project = sys.intern(project)
+        self.note = note
+        self.near_dup_of = near_dup_of
+        self.container = container
+
+    @property
+    def timestamp(self) -> str:
+        return ts_to_iso(self.timestamp_ms) if self.timestamp_ms else "unknown"
+
+    def annotated(self, near_dup_of: int) -> "Message":
+        """near_dup_of を付けたコピー"""
+        return Message(self.text, self.timestamp_ms, self.project, self.note, near_dup_of, self.container)
+
+    def to_dict(self) -> dict:
+        """出力用の dict（note, near_dup_of は値があるときだけ）"""
+        d = {"text": self.text, "timestamp": self.timestamp, "timestamp_ms": self.timestamp_ms, "project": self.project}
+        if self.note is not None:
+            d["note"] = self.note
+        if self.near_dup_of is not None:
+            d["near_dup_of"] = self.near_dup_of
+        return d
+
+
+def _json_default(obj):
+    """json.dump の default（Message を出力するときに dict にする）"""
+    if isinstance(obj, Message):
+        return obj.to_dict()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def merge_by_time(runs: list) -> Iterator[Message]:
+    """それぞれ時刻の古い順に並んだメッセージ列（ファイルごとのイテレータなど）を、時刻の古い順にマージする
+
+    heapq.merge は各列から1件ずつしか先読みしないので、列がメッセージを遅延して作るなら溜まるのは列の数だけ。
+    """
+    return heapq.merge(*runs, key=lambda msg: msg.timestamp_ms)
+
+
+def time_sorted_records(records: list) -> list:
+    """先頭要素が時刻（epochミリ秒、不明は None / 0）のレコード列を時刻順にする
+
+    追記型のログはほぼ時刻順なので、順序が前後しているファイルだけ並べ替えたコピーを返す。
+    """
+    if all((a[0] or 0) <= (b[0] or 0) for a, b in pairwise(records)):
+        return records
+    return sorted(records, key=lambda record: record[0] or 0)
+
+
 def iso_to_ms(iso_str: str) -> int | None:
     """ISO 8601タイムスタンプをUnix epoch ミリ秒に変換"""
     try:
@@ -124,74 +435,844 @@ def extract_user_text(content) -> str:
     return ""
 
 
-def collect_claude_code(cutoff_ms: int | None, project_filter: str | None) -> dict:
-    """Claude Code の history.jsonl およびプロジェクト別セッションファイルからユーザープロンプトを収集"""
-    result = {"tool": "Claude Code", "status": "未検出", "messages": [], "period": ""}
-    claude_dir = get_claude_dir()
+class CheckpointStore:
+    """追記型ファイルの解析位置と解析済みレコードを永続化するストア（SQLite）
+
+    ファイルごとに inode・サイズ・mtime・解析済みバイトオフセットを記録し、
+    次回実行時は追記された末尾だけを解析できるようにする。
+    解析済みレコードはファイルのバイト範囲ごとのチャンク（chunks テーブル）として追記だけで持ち、
+    読むときは必要な位置より後ろのチャンクだけを読む。追記後の保存で書くのは新しいチャンクとファイルの位置情報だけ。
+    シークで途中から解析した場合、レコードは start 以降の行だけを表す。
+    追記型でないテキストファイルは、先頭テキストをサイズ・mtime と組で heads に持つ。
+    history.jsonl の sessionId 走査の位置と結果は scans に持つ。
+    エントリは (種類, パス) ごとの行で、参照したものだけを読み込み、save() では変更したものだけを書き込む。
+    path が None の場合は永続化せず、チャンクもメモリに持つ（--no-cache）。
+    """
+
+    VERSION = 5
+    # オフセット直前のバイト列の署名長（ファイル書き換えの検出用）
+    SIG_BYTES = 256
+    # 消えたファイルのエントリを掃除する間隔（秒）
+    PRUNE_INTERVAL_SECONDS = 24 * 3600
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS entries (
+            kind TEXT NOT NULL,
+            path TEXT NOT NULL,
+            data TEXT NOT NULL,
+            PRIMARY KEY (kind, path)
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS chunks (
+            path TEXT NOT NULL,
+            start INTEGER NOT NULL,
+            end INTEGER NOT NULL,
+            records TEXT NOT NULL,
+            PRIMARY KEY (path, start)
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        );
+    """
+
+    def __init__(self, path: Path | None):
+        self.path = path
+        self.files = {}
+        self.heads = {}
+        self.scans = {}
+        self._caches = {"file": self.files, "head": self.heads, "scan": self.scans}
+        self._changed = set()
+        # 保存していないチャンク: パス → (保存済みのチャンクを捨てるか, [(start, end, records), ...])
+        self._pending = {}
+        # 並行実行時に複数の収集関数から参照・更新されるため（接続もこのロックの下でだけ使う）
+        self._lock = threading.Lock()
+        self.conn = self._connect(path) if path else None
+
+    def _connect(self, path: Path) -> sqlite3.Connection | None:
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True, mode=0o700)
+            # ほかのユーザーから読めないよう、SQLite が作る前に 0600 で作っておく
+            os.close(os.open(path, os.O_WRONLY | os.O_CREAT, 0o600))
+            conn = sqlite3.connect(str(path), timeout=10, check_same_thread=False)
+            if conn.execute("PRAGMA user_version").fetchone()[0] != self.VERSION:
+                conn.executescript("DROP TABLE IF EXISTS entries; DROP TABLE IF EXISTS chunks; DROP TABLE IF EXISTS meta;" + self.SCHEMA)
+                conn.execute(f"PRAGMA user_version = {self.VERSION}")
+                conn.commit()
+                # JSON 1ファイルだった以前の形式は使わない
+                path.with_name("checkpoints.json").unlink(missing_ok=True)
+            return conn
+        except (OSError, sqlite3.Error):
+            return None
+
+    def _get(self, kind: str, key: str):
+        cache = self._caches[kind]
+        with self._lock:
+            if key not in cache:
+                entry = None
+                if self.conn is not None:
+                    try:
+                        row = self.conn.execute("SELECT data FROM entries WHERE kind = ? AND path = ?", (kind, key)).fetchone()
+                        entry = json.loads(row[0]) if row else None
+                    except (sqlite3.Error, ValueError):
+                        entry = None
+                cache[key] = entry
+            return cache[key]
+
+    def _set(self, kind: str, key: str, entry):
+        with self._lock:
+            self._caches[kind][key] = entry
+            self._changed.add((kind, key))
+
+    def lookup(self, path: Path, st: os.stat_result) -> dict | None:
+        """有効なチェックポイントを返す。ファイルが置き換え・切り詰め・書き換えされていれば None"""
+        entry = self._get("file", str(path))
+        if not entry:
+            return None
+        if entry["inode"] != st.st_ino or st.st_size < entry["offset"]:
+            return None
+        # 追記ならサイズが変わる。サイズが同じまま mtime だけ変わったのはその場での書き換え
+        if st.st_size == entry["size"] and st.st_mtime_ns != entry["mtime_ns"]:
+            return None
+        if entry["sig"] != _tail_signature(path, entry["offset"]):
+            return None
+        return entry
+
+    def records(self, path: Path, since: int = 0) -> list:
+        """解析済みレコードを先頭から順に返す。since を指定すると、それより後ろで終わるチャンクだけを読む"""
+        key = str(path)
+        with self._lock:
+            reset, chunks = self._pending.get(key, (False, []))
+            chunks = list(chunks)
+            if self.conn is not None and not reset:
+                try:
+                    rows = self.conn.execute(
+                        "SELECT start, end, records FROM chunks WHERE path = ? AND end > ?", (key, since)
+                    ).fetchall()
+                except sqlite3.Error:
+                    rows = []
+                chunks += [(start, end, json.loads(data)) for start, end, data in rows]
+        chunks.sort(key=lambda chunk: chunk[0])
+        return [record for _, end, records in chunks if end > since for record in records]
+
+    def update(self, path: Path, st: os.stat_result, offset: int, state: dict, chunks: list, start: int = 0, reset: bool = False):
+        """解析位置を更新し、新しく解析したチャンクを追記する。reset なら前回までのチャンクを捨てる"""
+        key = str(path)
+        self._set("file", key, {
+            "inode": st.st_ino,
+            "size": st.st_size,
+            "mtime_ns": st.st_mtime_ns,
+            "start": start,
+            "offset": offset,
+            "sig": _tail_signature(path, offset),
+            "state": state,
+        })
+        with self._lock:
+            pending_reset, pending = self._pending.get(key, (False, []))
+            if reset:
+                pending_reset, pending = True, []
+            self._pending[key] = (pending_reset, pending + [chunk for chunk in chunks if chunk[2]])
+
+    def scan(self, path: Path, st: os.stat_result) -> dict | None:
+        """history_session_ids の走査済みの範囲と ID。ファイルが置き換え・切り詰めされていれば None"""
+        entry = self._get("scan", str(path))
+        if not entry or entry["inode"] != st.st_ino or st.st_size < entry["end"]:
+            return None
+        if entry["sig"] != _tail_signature(path, entry["end"]):
+            return None
+        return entry
+
+    def set_scan(self, path: Path, st: os.stat_result, start: int, end: int, ids: dict[str, int]):
+        self._set("scan", str(path), {"inode": st.st_ino, "start": start, "end": end, "sig": _tail_signature(path, end), "ids": sorted(ids.items())})
+
+    def head(self, entry: FileEntry) -> str | None:
+        """キャッシュ済みの先頭テキストを返す。サイズか mtime が変わっていれば None"""
+        cached = self._get("head", str(entry.path))
+        if cached and cached[0] == entry.size and cached[1] == entry.mtime:
+            return cached[2]
+        return None
 
-    messages = []
-    seen_texts = set()  # 重複排除用
-    skip_patterns = ["/clear", "/help"]
+    def set_head(self, entry: FileEntry, text: str):
+        self._set("head", str(entry.path), [entry.size, entry.mtime, text])
+
+    def save(self):
+        """変更したエントリと新しいチャンクだけを書き込み、PRUNE_INTERVAL_SECONDS ごとに消えたファイルのエントリを消す"""
+        if self.conn is None:
+            return
+        with self._lock:
+            rows = [(kind, key, json.dumps(self._caches[kind][key], ensure_ascii=False)) for kind, key in self._changed]
+            pending = self._pending
+            self._changed = set()
+            self._pending = {}
+            try:
+                with self.conn:
+                    self.conn.executemany("DELETE FROM chunks WHERE path = ?", [(key,) for key, (reset, _) in pending.items() if reset])
+                    self.conn.executemany(
+                        "INSERT OR REPLACE INTO chunks (path, start, end, records) VALUES (?, ?, ?, ?)",
+                        [(key, start, end, json.dumps(records, ensure_ascii=False))
+                         for key, (_, chunks) in pending.items() for start, end, records in chunks],
+                    )
+                    self.conn.executemany("INSERT OR REPLACE INTO entries (kind, path, data) VALUES (?, ?, ?)", rows)
+                    self._prune()
+            except sqlite3.Error:
+                pass
+
+    def _prune(self):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = 'pruned_at'").fetchone()
+        now = time.time()
+        if row and now - float(row[0]) < self.PRUNE_INTERVAL_SECONDS:
+            return
+        gone = [(kind, path) for kind, path in self.conn.execute("SELECT kind, path FROM entries") if not os.path.exists(path)]
+        self.conn.executemany("DELETE FROM entries WHERE kind = ? AND path = ?", gone)
+        self.conn.executemany("DELETE FROM chunks WHERE path = ?", [(path,) for kind, path in gone if kind == "file"])
+        self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('pruned_at', ?)", (str(now),))
+
+
+def _tail_signature(path: Path, offset: int) -> int:
+    """offset直前のバイト列のCRC32（オフセット以前が書き換えられていないかの確認用）"""
+    start = max(0, offset - CheckpointStore.SIG_BYTES)
+    try:
+        with open(path, "rb") as f:
+            f.seek(start)
+            return zlib.crc32(f.read(offset - start))
+    except OSError:
+        return -1
+
+
+class JsonlFormat(NamedTuple):
+    """JSONLソースごとの行パーサー定義
+
+    prefilter(raw_line: bytes) は json.loads の前に生バイト列で呼ばれ、
+    対象になり得ない行（assistant応答など）を False で弾く。誤って弾かないよう保守的に判定すること。
+    """
+    name: str
+    parse_line: Callable[[bytes, dict], list | None]
+    prefilter: Callable[[bytes], bool] | None = None
+    initial_state: dict | None = None
+    # 行のタイムスタンプ（epochミリ秒）を返す関数。時刻順に追記されるファイルでのみ指定し、
+    # 指定されていればカットオフ位置への二分探索シークを使う（state を持たない形式に限る）
+    timestamp_of: Callable[[bytes], int | None] | None = None
+
+
+class ScanStats:
+    """JSONL解析の行数カウンタ（ソース別。lines=解析した行、skipped=プレフィルタで除外、decoded=json.loads した行）
+
+    SQLiteのソースは note() で読んだ行数やインデックスの有無を記録する。
+    """
+
+    def __init__(self):
+        self.counts = {}
+        self._lock = threading.Lock()
+
+    def add(self, name: str, counts: dict):
+        with self._lock:
+            total = self.counts.setdefault(name, {"lines": 0, "skipped": 0, "decoded": 0})
+            for key, value in counts.items():
+                total[key] += value
+
+    def note(self, name: str, key: str, value):
+        with self._lock:
+            self.counts.setdefault(name, {})[key] = value
+
+
+class SourceProfile:
+    """1ソース分の計測値（--profile）
+
+    収集関数は perf=None のとき何も記録しない。計測するときだけ呼び出し側が渡す。
+    bytes は JSONL なら解析したバイト数、それ以外は読んだファイルのサイズ。
+    lines は JSONL の行数と SQLite の行数。
+    """
+
+    def __init__(self, top_n: int):
+        self.top_n = top_n
+        self.seconds = 0.0
+        self.files = 0
+        self.bytes = 0
+        self.lines = 0
+        self.messages = 0
+        self.skipped = {}
+        self.files_skipped = {}
+        self._slowest = []  # (秒, 通し番号, パス, バイト数) の最小ヒープ
+        self._lock = threading.Lock()  # Copilot の state.vscdb はスレッドプールから記録される
+
+    def file(self, path: Path, seconds: float, nbytes: int):
+        with self._lock:
+            self.files += 1
+            self.bytes += nbytes
+            item = (seconds, self.files, str(path), nbytes)
+            if len(self._slowest) < self.top_n:
+                heapq.heappush(self._slowest, item)
+            elif self._slowest and item > self._slowest[0]:
+                heapq.heapreplace(self._slowest, item)
+
+    def timed(self, read, path: Path, nbytes: int):
+        """read(path) を実行し、所要時間をファイル単位で記録する"""
+        started = time.perf_counter()
+        try:
+            return read(path)
+        finally:
+            self.file(path, time.perf_counter() - started, nbytes)
+
+    def skip(self, reason: str, n: int = 1):
+        """フィルタで除外したレコード数"""
+        if n:
+            self.skipped[reason] = self.skipped.get(reason, 0) + n
+
+    def skip_file(self, reason: str):
+        """読まずに除外したファイル数"""
+        self.files_skipped[reason] = self.files_skipped.get(reason, 0) + 1
+
+    def parsed(self, counts: dict, produced: int):
+        """_parse_jsonl_tail の行数カウンタと、そこから得たレコード数を加える"""
+        self.lines += counts["lines"]
+        self.skip("prefilter", counts["skipped"])
+        self.skip("parse", counts["decoded"] - produced)
+
+    def wrap(self, stream: Callable[[], Iterator[Message]]) -> Callable[[], Iterator[Message]]:
+        """収集関数の中で費やした時間（消費側の処理を除く）と返したメッセージ数を数える"""
+        def timed_stream():
+            clock = time.perf_counter
+            messages = iter(stream())
+            while True:
+                started = clock()
+                try:
+                    msg = next(messages)
+                except StopIteration:
+                    return
+                finally:
+                    self.seconds += clock() - started
+                self.messages += 1
+                yield msg
+        return timed_stream
+
+    def report(self) -> dict:
+        return {
+            "wall_ms": round(self.seconds * 1000, 1),
+            "files": self.files,
+            "bytes_read": self.bytes,
+            "lines": self.lines,
+            "skipped": dict(sorted(self.skipped.items())),
+            "files_skipped": dict(sorted(self.files_skipped.items())),
+            "messages": self.messages,
+            "slowest_files": [
+                {"path": path, "ms": round(seconds * 1000, 2), "bytes": nbytes}
+                for seconds, _, path, nbytes in sorted(self._slowest, reverse=True)
+            ],
+        }
+
+
+class Profiler:
+    """--profile: ソースごとの SourceProfile と全体の経過時間"""
+
+    def __init__(self, top_n: int):
+        self.top_n = top_n
+        self.started = time.perf_counter()
+        self.sources = {}
+        # --root: ルートごとにワーカープロセスで計測した report()
+        self.roots = {}
+
+    def source(self, tool: str) -> SourceProfile:
+        if tool not in self.sources:
+            self.sources[tool] = SourceProfile(self.top_n)
+        return self.sources[tool]
+
+    def report(self) -> dict:
+        report = {
+            "wall_ms": round((time.perf_counter() - self.started) * 1000, 1),
+            "sources": {tool: self.sources[tool].report() for tool in SOURCE_TOOLS if tool in self.sources},
+        }
+        if self.roots:
+            report["roots"] = self.roots
+        return report
+
+
+class Budget:
+    """--budget-ms: 全ソース共通の締め切り（budget_ms が None なら締め切りなしで、件数の上限だけをなくす）"""
+
+    def __init__(self, budget_ms: int | None):
+        self.deadline = float("inf") if budget_ms is None else time.monotonic() + budget_ms / 1000
+        self.sources = {}
+
+    def expired(self) -> bool:
+        return time.monotonic() >= self.deadline
+
+    def source(self, tool: str) -> "SourceBudget":
+        if tool not in self.sources:
+            self.sources[tool] = SourceBudget(self)
+        return self.sources[tool]
+
+
+class SourceBudget:
+    """1ソース分の締め切りの判定と、打ち切ったかどうか
+
+    収集関数は budget を渡されると件数の上限をなくして新しい順に走査し、
+    ファイルなどの区切りごとに exhausted() を確認して、締め切りを過ぎていれば残りを読まずに終える。
+    """
+
+    def __init__(self, budget: Budget):
+        self.budget = budget
+        self.truncated = False
+
+    def exhausted(self) -> bool:
+        if self.budget.expired():
+            self.truncated = True
+        return self.truncated
+
+
+# 解析済みレコードをチェックポイントに保存する単位（解析したバイト数）。シークしたときは
+# シーク位置より後ろのチャンクだけを読むので、余分に読むのはチャンク1つ分まで
+CHECKPOINT_CHUNK_BYTES = 1024 * 1024
+
+
+def _parse_jsonl_tail(path: str, offset: int, fmt: JsonlFormat, state: dict, end: int | None = None) -> tuple[list, int, dict, list, dict]:
+    """offset以降の完結した行を解析し (chunks, 新offset, state, 末尾の未完行のrecords, 行数カウンタ) を返す
+
+    chunks は解析した範囲を CHECKPOINT_CHUNK_BYTES ごとに区切った (先頭オフセット, 末尾オフセット, records) のリスト。
+    end を指定した場合は end（行頭であること）の手前までを解析する。
+    プロセスプールのワーカーからも呼ばれるため、引数・戻り値はpickle可能な値に限る。
+    """
+    parse_line, prefilter = fmt.parse_line, fmt.prefilter
+    chunks = []
+    chunk_start = offset
+    records = []
+    tail_fragment = None
+    lines = skipped = 0
+    with open(path, "rb") as f:
+        f.seek(offset)
+        for raw in f:
+            if end is not None and offset >= end:
+                break
+            if not raw.endswith(b"\n"):
+                tail_fragment = raw
+                break
+            if offset - chunk_start >= CHECKPOINT_CHUNK_BYTES:
+                chunks.append((chunk_start, offset, records))
+                chunk_start, records = offset, []
+            offset += len(raw)
+            lines += 1
+            if prefilter is not None and not prefilter(raw):
+                skipped += 1
+                continue
+            record = parse_line(raw, state)
+            if record is not None:
+                records.append(record)
+    if offset > chunk_start:
+        chunks.append((chunk_start, offset, records))
+
+    partial_records = []
+    if tail_fragment is not None:
+        lines += 1
+        if prefilter is not None and not prefilter(tail_fragment):
+            skipped += 1
+        else:
+            record = parse_line(tail_fragment, json.loads(json.dumps(state)))
+            if record is not None:
+                partial_records.append(record)
+    counts = {"lines": lines, "skipped": skipped, "decoded": lines - skipped}
+    return chunks, offset, state, partial_records, counts
+
+
+def _parse_jsonl_tail_worker(path: str, offset: int, fmt: JsonlFormat, state: dict):
+    """プロセスプール用: (_parse_jsonl_tail の結果, 所要秒数) を返す。読み込みエラーは None で返す"""
+    started = time.perf_counter()
+    try:
+        return _parse_jsonl_tail(path, offset, fmt, state), time.perf_counter() - started
+    except OSError:
+        return None
 
-    # --- ソース1: history.jsonl（CLI使用時のログ） ---
-    history_path = claude_dir / "history.jsonl"
-    collected_session_ids = set()
 
-    if history_path.exists():
-        with open(history_path, "r", encoding="utf-8") as f:
-            for line in f:
-                line = line.strip()
-                if not line:
-                    continue
-                try:
-                    entry = json.loads(line)
-                except json.JSONDecodeError:
-                    continue
+def _checkpoint_base(path: Path, st: os.stat_result, checkpoints: CheckpointStore | None, fmt: JsonlFormat, since: int = 0) -> tuple[int, int, dict, list]:
+    """チェックポイントから (records の先頭オフセット, 解析再開オフセット, state, 解析済みrecords) を返す
 
-                display = entry.get("display", "").strip()
-                timestamp = entry.get("timestamp")
-                project = entry.get("project", "")
-                session_id = entry.get("sessionId", "")
+    since を指定すると、それより前で終わるチャンクのレコードは読まない。
+    """
+    entry = checkpoints.lookup(path, st) if checkpoints else None
+    if entry:
+        return entry["start"], entry["offset"], entry["state"], checkpoints.records(path, since)
+    return 0, 0, dict(fmt.initial_state or {}), []
 
-                if session_id:
-                    collected_session_ids.add(session_id)
 
-                # フィルタ: 空、/clear等、パスのみ
-                if not display:
-                    continue
-                if any(display.startswith(p) for p in skip_patterns):
-                    continue
-                # 1行でパスっぽいものだけをスキップ
-                if display.count("\n") == 0 and len(display) < 300:
-                    stripped = display.replace("\\", "/")
-                    if stripped.startswith(("/", "C:", "D:", "c:", "d:")) and " " not in stripped and len(stripped.split("/")) > 2:
-                        continue
+def _chunk_records(chunks: list) -> list:
+    return [record for _, _, records in chunks for record in records]
 
-                # タイムスタンプフィルタ
-                if cutoff_ms and timestamp and timestamp < cutoff_ms:
-                    continue
 
-                # プロジェクトフィルタ
-                if project_filter:
-                    project_name = Path(project).name.lower() if project else ""
-                    if project_filter.lower() not in project_name:
-                        continue
+# 追記順と timestamp が多少前後していても取りこぼさないよう、シーク位置を余分に手前へ取る
+SEEK_SLACK_MS = 24 * 60 * 60 * 1000
 
-                dedup_key = f"{timestamp}:{display[:100]}"
-                seen_texts.add(dedup_key)
 
-                messages.append({
-                    "text": display[:500],
-                    "timestamp": ts_to_iso(timestamp) if timestamp else "unknown",
-                    "timestamp_ms": timestamp or 0,
-                    "project": Path(project).name if project else "unknown",
-                })
+def seek_jsonl_timestamp(path: Path, cutoff_ms: int, timestamp_of, size: int) -> int:
+    """時刻順に追記されたJSONLで timestamp >= cutoff_ms となる最初の行の先頭オフセットを二分探索で返す
+
+    任意のバイト位置から次の改行まで読み捨てて行頭に再同期する。
+    タイムスタンプを読めない行は「カットオフ以降」とみなし、手前側に倒す（取りこぼさない）。
+    """
+    with open(path, "rb") as f:
+        def line_at(pos: int) -> tuple[int, bytes]:
+            """pos 以降の最初の行頭と、その行を返す"""
+            if pos > 0:
+                f.seek(pos - 1)
+                f.readline()
+            else:
+                f.seek(0)
+            start = f.tell()
+            return start, f.readline()
+
+        lo, hi = 0, size  # lo より前の行はすべてカットオフ前、hi は行頭またはEOF
+        while lo < hi:
+            mid = (lo + hi) // 2
+            start, raw = line_at(mid)
+            if start >= hi or not raw.endswith(b"\n"):
+                break
+            ts = timestamp_of(raw)
+            if ts is not None and ts < cutoff_ms:
+                lo = start + len(raw)
+            else:
+                hi = start
+
+        # 残りの区間（数行程度）は先頭から線形に確認する
+        f.seek(lo)
+        pos = lo
+        while pos < hi:
+            raw = f.readline()
+            if not raw:
+                break
+            ts = timestamp_of(raw)
+            if ts is None or ts >= cutoff_ms:
+                return pos
+            pos += len(raw)
+        return min(pos, hi)
+
+
+def read_jsonl_records(path: Path, fmt: JsonlFormat, checkpoints: CheckpointStore | None, stats: ScanStats | None = None, cutoff_ms: int | None = None, perf: SourceProfile | None = None) -> tuple[list, dict]:
+    """JSONLファイルを解析し (records, state) を返す
+
+    fmt.parse_line(raw_line: bytes, state: dict) は1行をレコードに変換する（不要な行は None）。
+    チェックポイントがあれば前回の解析位置以降の追記分だけを解析する。
+    書き込み途中の末尾行は今回の結果には含めるが、チェックポイントは進めない。
+    fmt.timestamp_of があり cutoff_ms が指定されていれば、カットオフ位置まで二分探索でシークし、
+    それより前の行は読まない（戻り値にもカットオフより十分前の行は含まれないことがある）。
+    """
+    started = time.perf_counter()
+    st = path.stat()
+    nbytes = 0
+
+    # 解析を始めるべき位置（シークなしなら先頭）
+    head = 0
+    if cutoff_ms and fmt.timestamp_of:
+        head = seek_jsonl_timestamp(path, cutoff_ms - SEEK_SLACK_MS, fmt.timestamp_of, st.st_size)
+    start, offset, state, records = _checkpoint_base(path, st, checkpoints, fmt, head)
+    fresh = offset == 0
+    new_chunks = []
+    if fresh:
+        start = offset = head
+    elif head < start:
+        # キャッシュ済み範囲より前が必要になった: [head, start) を解析して前に足す
+        head_chunks, end, _, _, counts = _parse_jsonl_tail(str(path), head, fmt, dict(fmt.initial_state or {}), end=start)
+        head_records = _chunk_records(head_chunks)
+        records = head_records + records
+        new_chunks += head_chunks
+        nbytes += end - head
+        start = head
+        if stats:
+            stats.add(fmt.name, counts)
+        if perf:
+            perf.parsed(counts, len(head_records))
+
+    partial_records = []
+    if offset < st.st_size:
+        # 末尾の未完行まで読むので、読んだ量は stat 時点のファイル末尾まで
+        nbytes += st.st_size - offset
+        tail_chunks, offset, state, partial_records, counts = _parse_jsonl_tail(str(path), offset, fmt, state)
+        new_records = _chunk_records(tail_chunks)
+        records.extend(new_records)
+        new_chunks += tail_chunks
+        if stats:
+            stats.add(fmt.name, counts)
+        if perf:
+            perf.parsed(counts, len(new_records) + len(partial_records))
+    if checkpoints and nbytes:
+        checkpoints.update(path, st, offset, state, new_chunks, start, reset=fresh)
+    if perf:
+        perf.file(path, time.perf_counter() - started, nbytes)
+    return records + partial_records, state
+
+
+# 並列解析で1プロセスに割り当てる未解析バイト数の下限。spawn したワーカーの起動（collect.py の import）と
+# 結果の受け渡しは1プロセスあたり0.1〜0.2秒かかり、逐次解析（約50MB/s）でこれを上回る量がないと遅くなる
+PARALLEL_MIN_BYTES_PER_WORKER = 16 * 1024 * 1024
+
+
+def read_jsonl_files(paths: list[Path], fmt: JsonlFormat, checkpoints: CheckpointStore | None, workers: int = 1, stats: ScanStats | None = None, perf: SourceProfile | None = None) -> list[list | None]:
+    """複数のJSONLファイルを解析し、paths と同じ順序で records のリストを返す（読めないファイルは None）
+
+    workers > 1 のときは追記分の解析をプロセスプールで並列化する。プロセス数は、未解析のバイト数を
+    PARALLEL_MIN_BYTES_PER_WORKER ずつ割り当てられる数までに減らし、2未満なら逐次解析する。
+    チェックポイントの参照・更新は親プロセスだけが行う。
+    """
+    results = [None] * len(paths)
+    jobs = []
+    for i, path in enumerate(paths):
+        try:
+            st = path.stat()
+        except OSError:
+            continue
+        _, offset, state, records = _checkpoint_base(path, st, checkpoints, fmt)
+        if offset == st.st_size:
+            results[i] = records
+            if perf:
+                perf.file(path, 0.0, 0)
+        else:
+            jobs.append((i, path, st, offset, state, records))
+
+    tails = None
+    pending_bytes = sum(st.st_size - offset for _, _, st, offset, _, _ in jobs)
+    workers = min(workers, len(jobs), pending_bytes // PARALLEL_MIN_BYTES_PER_WORKER)
+    if workers > 1:
+        try:
+            # fork はスレッド（--jobs）と併用すると安全でないため spawn を使う
+            with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+                tails = list(executor.map(
+                    _parse_jsonl_tail_worker,
+                    [str(job[1]) for job in jobs],
+                    [job[3] for job in jobs],
+                    [fmt] * len(jobs),
+                    [job[4] for job in jobs],
+                    chunksize=max(1, len(jobs) // (workers * 4)),
+                ))
+        except (OSError, NotImplementedError, BrokenProcessPool):
+            tails = None
+    if tails is None:
+        tails = [_parse_jsonl_tail_worker(str(job[1]), job[3], fmt, job[4]) for job in jobs]
+
+    for (i, path, st, resumed, _, records), tail in zip(jobs, tails):
+        if tail is None:
+            continue
+        (chunks, offset, state, partial_records, counts), seconds = tail
+        new_records = _chunk_records(chunks)
+        records.extend(new_records)
+        if checkpoints:
+            checkpoints.update(path, st, offset, state, chunks, reset=resumed == 0)
+        if stats:
+            stats.add(fmt.name, counts)
+        if perf:
+            perf.parsed(counts, len(new_records) + len(partial_records))
+            perf.file(path, seconds, st.st_size - resumed)
+        results[i] = records + partial_records
+    return results
+
+
+def _parse_history_line(raw: bytes, state: dict) -> list | None:
+    """history.jsonl の1行を [timestamp, display, project] に変換する（sessionId は history_session_ids が集める）"""
+    raw = raw.strip()
+    if not raw:
+        return None
+    try:
+        entry = json.loads(raw)
+    except ValueError:
+        return None
+
+    display = entry.get("display", "").strip()
+    timestamp = entry.get("timestamp")
+    project = entry.get("project", "")
+
+    # フィルタ: 空、/clear等、パスのみ
+    if not display or any(display.startswith(p) for p in SKIP_PATTERNS):
+        return None
+    # 1行でパスっぽいものだけをスキップ
+    if display.count("\n") == 0 and len(display) < 300:
+        stripped = display.replace("\\", "/")
+        if stripped.startswith(("/", "C:", "D:", "c:", "d:")) and " " not in stripped and len(stripped.split("/")) > 2:
+            return None
+
+    return [timestamp, display[:500], project]
+
+
+def _parse_session_line(raw: bytes, state: dict) -> list | None:
+    """プロジェクト別セッションJSONLの1行を [timestamp_ms, text, cwd名] に変換する"""
+    raw = raw.strip()
+    if not raw:
+        return None
+    try:
+        entry = json.loads(raw)
+    except ValueError:
+        return None
+
+    # ユーザーメッセージのみ抽出
+    if entry.get("type") != "user":
+        return None
+    # メタメッセージ（システム注入）はスキップ
+    if entry.get("isMeta"):
+        return None
+
+    message = entry.get("message", {})
+    content = message.get("content", "")
+    text = extract_user_text(content)
+
+    if not text:
+        return None
+    if any(text.startswith(p) for p in SKIP_PATTERNS):
+        return None
+
+    # タイムスタンプ処理（ISO 8601形式）
+    ts_str = entry.get("timestamp", "")
+    ts_ms = iso_to_ms(ts_str) if ts_str else None
 
-    # --- ソース2: プロジェクト別セッションJSONL（VS Code拡張機能のログ） ---
+    # cwdからプロジェクト名を取得
+    cwd = entry.get("cwd", "")
+    return [ts_ms, text[:500], Path(cwd).name if cwd else None]
+
+
+def _parse_rollout_line(raw: bytes, state: dict) -> list | None:
+    """Codex rollout JSONLの1行を [timestamp_ms, text] に変換する（SessionMetaのcwdはstateに保持）"""
+    raw = raw.strip()
+    if not raw:
+        return None
+    try:
+        entry = json.loads(raw)
+    except ValueError:
+        return None
+
+    timestamp_str = entry.get("timestamp", "")
+
+    # SessionMeta からプロジェクト情報を取得
+    session_meta = entry.get("SessionMeta") or entry.get("session_meta")
+    if session_meta:
+        state["cwd"] = session_meta.get("cwd", "") or session_meta.get("working_directory", "")
+        return None
+
+    # ResponseItem からユーザーメッセージを抽出
+    response_item = entry.get("ResponseItem") or entry.get("response_item")
+    if not response_item:
+        return None
+
+    item_type = response_item.get("type", "")
+    role = response_item.get("role", "")
+    if item_type != "message" or role != "user":
+        return None
+
+    # コンテンツからテキストを抽出
+    content = response_item.get("content", [])
+    texts = []
+    if isinstance(content, list):
+        for part in content:
+            if isinstance(part, dict):
+                part_type = part.get("type", "")
+                if part_type in ("input_text", "text"):
+                    text = part.get("text", "").strip()
+                    if text:
+                        texts.append(text)
+    elif isinstance(content, str):
+        texts.append(content.strip())
+
+    text = sanitize_text(" ".join(texts).strip())
+    if not text:
+        return None
+
+    ts_ms = iso_to_ms(timestamp_str) if timestamp_str else None
+    return [ts_ms, text[:500]]
+
+
+# json.loads 前のバイト列プレフィルタ。
+# JSON文字列中の引用符は \" にエスケープされるため、b'"user"' が現れるのは
+# 実際のキー・値としての "user" だけ（本文中の "user" という語では一致しない）。
+def _session_line_may_match(raw: bytes) -> bool:
+    """type=user かつ isMeta でない行だけを通す（assistant応答・summary等は "user" トークンを含まない）"""
+    return b'"user"' in raw and b'"isMeta":true' not in raw
+
+
+def _rollout_line_may_match(raw: bytes) -> bool:
+    """SessionMeta 行と、role=user を含む ResponseItem 行だけを通す"""
+    if b"session_meta" in raw or b"SessionMeta" in raw:
+        return True
+    return b'"user"' in raw and (b"response_item" in raw or b"ResponseItem" in raw)
+
+
+def _history_line_timestamp(raw: bytes) -> int | None:
+    """history.jsonl の行の timestamp（シーク判定用）"""
+    try:
+        timestamp = json.loads(raw).get("timestamp")
+    except (ValueError, AttributeError):
+        return None
+    return timestamp if isinstance(timestamp, (int, float)) else None
+
+
+HISTORY_FORMAT = JsonlFormat("claude_history", _parse_history_line, timestamp_of=_history_line_timestamp)
+SESSION_FORMAT = JsonlFormat("claude_sessions", _parse_session_line, _session_line_may_match)
+ROLLOUT_FORMAT = JsonlFormat("codex_rollouts", _parse_rollout_line, _rollout_line_may_match, {"cwd": ""})
+
+
+_SESSION_ID_RE = re.compile(rb'"sessionId":\s*"([^"\\]+)"')
+# sessionId の走査で1回に読むバイト数
+SESSION_ID_SCAN_BYTES = 1 << 20
+
+
+def _scan_session_ids(f, start: int, stop: int | None, last: dict[str, int]) -> tuple[int, bytes]:
+    """f の [start, stop) にある完結した行の sessionId と、その行の位置を last に記録する
+
+    last には ID ごとに最後に出てきた位置を持つ。走査を終えた行末の位置と、改行で終わっていない末尾を返す。
+    """
+    end = start
+    pending = b""
+    f.seek(start)
+    while stop is None or end + len(pending) < stop:
+        size = SESSION_ID_SCAN_BYTES if stop is None else min(SESSION_ID_SCAN_BYTES, stop - end - len(pending))
+        chunk = f.read(size)
+        if not chunk:
+            break
+        data = pending + chunk
+        cut = data.rfind(b"\n") + 1
+        for m in _SESSION_ID_RE.finditer(data, 0, cut):
+            session_id = m.group(1).decode("utf-8", errors="replace")
+            pos = end + m.start()
+            if last.get(session_id, -1) < pos:
+                last[session_id] = pos
+        end += cut
+        pending = data[cut:]
+    return end, pending
+
+
+def history_session_ids(path: Path, checkpoints: CheckpointStore | None, cutoff_ms: int | None = None) -> set[str]:
+    """history.jsonl に出てくる sessionId を返す
+
+    cutoff_ms を渡すと read_jsonl_records と同じシーク位置以降の行だけを見る（それより前の行にしか
+    出てこないセッションのファイルは、カットオフ後の追記があれば収集対象になる）。
+    JSON として解析せず、生のバイト列を正規表現で走査する。走査した範囲と ID ごとの最後の位置はチェックポイントに持ち、
+    次回からは追記された分と、前回より手前に広がった分だけを走査する（書き込み途中の末尾行の ID は今回の結果にだけ含める）。
+    """
+    st = path.stat()
+    head = 0
+    if cutoff_ms:
+        head = seek_jsonl_timestamp(path, cutoff_ms - SEEK_SLACK_MS, HISTORY_FORMAT.timestamp_of, st.st_size)
+    cached = checkpoints.scan(path, st) if checkpoints else None
+    start, end, last = (cached["start"], cached["end"], dict(cached["ids"])) if cached else (head, head, {})
+    with open(path, "rb") as f:
+        if head < start:
+            _scan_session_ids(f, head, start, last)
+        scanned, pending = _scan_session_ids(f, end, None, last)
+    start = min(start, head)
+    if checkpoints and (scanned != end or not cached or start != cached["start"]):
+        checkpoints.set_scan(path, st, start, scanned, last)
+    tail = {m.group(1).decode("utf-8", errors="replace") for m in _SESSION_ID_RE.finditer(pending)}
+    return {session_id for session_id, pos in last.items() if pos >= head} | tail
+
+
+def iter_claude_code(cutoff_ms: int | None, project_filter: str | None, checkpoints: CheckpointStore | None = None, parse_workers: int = 1, stats: ScanStats | None = None, seek: bool = True, prune_dirs: bool = False, perf: SourceProfile | None = None, budget: SourceBudget | None = None, ordered: bool = False) -> Iterator[Message]:
+    """Claude Code の history.jsonl およびプロジェクト別セッションファイルからユーザープロンプトを収集
+
+    budget を渡すとセッションファイル数・メッセージ数の上限をなくし、プロジェクトをまたいで新しい順に解析する。
+    ordered なら時刻の古い順に返す。重複排除と上限で残すレコードはファイルの走査順に選んでおき、
+    history.jsonl とセッションファイルごとの列を merge_by_time でマージする（メッセージは取り出すときに作る）。
+    """
+    claude_dir = get_claude_dir()
+
+    seen_texts = set()  # 重複排除用
+
+    # --- ソース2の候補: プロジェクト別セッションJSONL（VS Code拡張機能のログ） ---
     projects_dir = claude_dir / "projects"
+    session_candidates = []  # (ディレクトリ由来のプロジェクト名, セッションファイルの FileEntry)
     if projects_dir.exists():
-        for project_dir in projects_dir.iterdir():
-            if not project_dir.is_dir():
+        for project in scan_dir(projects_dir, dirs=True):
+            project_dir = project.path
+            # --prune-dirs: セッションファイルが追加されていないプロジェクトは見ない
+            if prune_dirs and cutoff_ms and project.mtime_ms < cutoff_ms:
                 continue
 
             # プロジェクトフィルタ: ディレクトリ名からプロジェクト名を復元
@@ -203,685 +1284,2354 @@ def collect_claude_code(cutoff_ms: int | None, project_filter: str | None) -> di
                 if project_filter.lower().replace(" ", "-") not in dir_name.lower():
                     continue
 
-            # セッションJSONLファイルを走査（最新5件に制限）
-            session_files = sorted(
-                [f for f in project_dir.glob("*.jsonl") if f.is_file()],
-                key=lambda p: p.stat().st_mtime,
-                reverse=True,
-            )[:50]
-
-            for session_file in session_files:
-                session_id = session_file.stem
-                # history.jsonlで既に収集済みのセッションはスキップ
-                if session_id in collected_session_ids:
-                    continue
-
+            # セッションJSONLファイルを走査（最新50件に制限）
+            for session in newest_first(scan_dir(project_dir, "*.jsonl"), None if budget else 50):
                 # カットオフフィルタ: ファイル更新日時で粗くフィルタ
-                if cutoff_ms:
-                    file_mtime_ms = int(session_file.stat().st_mtime * 1000)
-                    if file_mtime_ms < cutoff_ms:
-                        continue
-
-                try:
-                    msg_count = 0
-                    with open(session_file, "r", encoding="utf-8") as f:
-                        for line in f:
-                            line = line.strip()
-                            if not line:
-                                continue
-                            try:
-                                entry = json.loads(line)
-                            except json.JSONDecodeError:
-                                continue
-
-                            # ユーザーメッセージのみ抽出
-                            if entry.get("type") != "user":
-                                continue
-                            # メタメッセージ（システム注入）はスキップ
-                            if entry.get("isMeta"):
-                                continue
+                if cutoff_ms and session.mtime_ms < cutoff_ms:
+                    if perf:
+                        perf.skip_file("mtime")
+                    continue
 
-                            message = entry.get("message", {})
-                            content = message.get("content", "")
-                            text = extract_user_text(content)
+                session_candidates.append((project_name_from_dir, session))
+    if budget:
+        session_candidates.sort(key=lambda candidate: candidate[1].mtime, reverse=True)
 
-                            if not text:
-                                continue
-                            if any(text.startswith(p) for p in skip_patterns):
-                                continue
-
-                            # タイムスタンプ処理（ISO 8601形式）
-                            ts_str = entry.get("timestamp", "")
-                            ts_ms = iso_to_ms(ts_str) if ts_str else None
-                            if cutoff_ms and ts_ms and ts_ms < cutoff_ms:
-                                continue
+    # --- ソース1: history.jsonl（CLI使用時のログ） ---
+    history_path = claude_dir / "history.jsonl"
+    collected_session_ids = set()
 
-                            ts_display = ts_to_iso(ts_ms) if ts_ms else "unknown"
+    history_kept = []
+    if history_path.exists():
+        # メッセージも収集済みセッションの判定に使う sessionId も、カットオフ位置から読む
+        try:
+            records, _ = read_jsonl_records(history_path, HISTORY_FORMAT, checkpoints, stats, cutoff_ms if seek else None, perf)
+            collected_session_ids = history_session_ids(history_path, checkpoints, cutoff_ms if seek else None)
+        except OSError:
+            records = []
+        for record in records:
+            timestamp, display, project = record
+
+            # タイムスタンプフィルタ
+            if cutoff_ms and timestamp and timestamp < cutoff_ms:
+                if perf:
+                    perf.skip("cutoff")
+                continue
 
-                            # 重複排除
-                            dedup_key = f"{ts_ms}:{text[:100]}"
-                            if dedup_key in seen_texts:
-                                continue
-                            seen_texts.add(dedup_key)
-
-                            # cwdからプロジェクト名を取得
-                            cwd = entry.get("cwd", "")
-                            proj_name = Path(cwd).name if cwd else project_name_from_dir
-
-                            messages.append({
-                                "text": text[:500],
-                                "timestamp": ts_display,
-                                "timestamp_ms": ts_ms or 0,
-                                "project": proj_name,
-                            })
-                            msg_count += 1
-                            if msg_count >= 100:
-                                break
-                except (OSError, UnicodeDecodeError):
+            # プロジェクトフィルタ
+            if project_filter:
+                project_name = Path(project).name.lower() if project else ""
+                if project_filter.lower() not in project_name:
+                    if perf:
+                        perf.skip("project")
                     continue
 
-    if messages:
-        result["status"] = "検出"
-        result["messages"] = messages
-        timestamps = [m["timestamp"] for m in messages if m["timestamp"] != "unknown"]
-        if timestamps:
-            result["period"] = f"{min(timestamps)} 〜 {max(timestamps)}"
-
-    return result
-
-
-def collect_copilot_chat(cutoff_ms: int | None, project_filter: str | None) -> dict:
-    """GitHub Copilot Chat の state.vscdb からプロンプトを収集"""
-    result = {"tool": "GitHub Copilot Chat", "status": "未検出", "messages": [], "period": ""}
+            dedup_key = f"{timestamp}:{display[:100]}"
+            seen_texts.add(dedup_key)
+            history_kept.append(record)
 
-    appdata = get_appdata_path()
-    workspace_storage = appdata / "Code" / "User" / "workspaceStorage"
-    if not workspace_storage.exists():
-        return result
+    def history_messages(kept):
+        for timestamp, display, project in kept:
+            yield Message(display[:500], timestamp, Path(project).name if project else "unknown")
 
-    all_prompts = []
+    def session_messages(kept, project_name_from_dir, container):
+        for ts_ms, text, cwd_name in kept:
+            yield Message(text[:500], ts_ms, cwd_name or project_name_from_dir, container=container)
 
-    for vscdb_path in workspace_storage.glob("*/state.vscdb"):
-        try:
-            conn = sqlite3.connect(str(vscdb_path))
-            cursor = conn.cursor()
-
-            # memento/interactive-session にプロンプト履歴がある
-            cursor.execute(
-                "SELECT value FROM ItemTable WHERE key = 'memento/interactive-session'"
-            )
-            row = cursor.fetchone()
-            if row and row[0]:
+    runs = []
+    if ordered:
+        runs.append(history_messages(time_sorted_records(history_kept)))
+    else:
+        yield from history_messages(history_kept)
+
+    # --- ソース2: プロジェクト別セッションJSONL ---
+    # history.jsonlで既に収集済みのセッションはスキップ
+    session_tasks = [(name, s.path) for name, s in session_candidates if s.path.stem not in collected_session_ids]
+    if perf:
+        for _ in range(len(session_candidates) - len(session_tasks)):
+            perf.skip_file("in_history")
+
+    if budget:
+        # 締め切りで止められるよう、プロセスプールを使わず1ファイルずつ解析する
+        def read_sessions():
+            for _, f in session_tasks:
+                if budget.exhausted():
+                    return
                 try:
-                    data = json.loads(row[0])
-                    history = data.get("history", {})
-                    for mode_key, entries in history.items():
-                        if isinstance(entries, list):
-                            for entry in entries:
-                                text = entry.get("text", "").strip()
-                                if text:
-                                    # Copilot Chat にはタイムスタンプがないため、vscdbの更新日時を代用
-                                    file_mtime_ms = int(vscdb_path.stat().st_mtime * 1000)
-                                    if cutoff_ms and file_mtime_ms < cutoff_ms:
-                                        continue
-                                    all_prompts.append({
-                                        "text": text[:500],
-                                        "timestamp": ts_to_iso(file_mtime_ms),
-                                        "timestamp_ms": file_mtime_ms,
-                                        "project": vscdb_path.parent.name[:12],
-                                    })
-                except (json.JSONDecodeError, AttributeError):
-                    pass
-
-            conn.close()
-        except sqlite3.Error:
+                    yield read_jsonl_records(f, SESSION_FORMAT, checkpoints, stats, perf=perf)[0]
+                except OSError:
+                    yield None
+        session_records = read_sessions()
+    else:
+        # 解析はワーカープロセスに分散し、重複排除は走査順に親プロセスで行う（結果は逐次実行と同一）
+        session_records = read_jsonl_files([f for _, f in session_tasks], SESSION_FORMAT, checkpoints, parse_workers, stats, perf)
+    for (project_name_from_dir, session_path), records in zip(session_tasks, session_records):
+        if records is None:
             continue
 
-    if all_prompts:
-        result["status"] = "検出"
-        result["messages"] = all_prompts
-        timestamps = [m["timestamp"] for m in all_prompts if m["timestamp"] != "unknown"]
-        if timestamps:
-            result["period"] = f"{min(timestamps)} 〜 {max(timestamps)}"
+        kept = []
+        for i, record in enumerate(records):
+            ts_ms, text, _ = record
+            if cutoff_ms and ts_ms and ts_ms < cutoff_ms:
+                if perf:
+                    perf.skip("cutoff")
+                continue
 
-    return result
+            # 重複排除
+            dedup_key = f"{ts_ms}:{text[:100]}"
+            if dedup_key in seen_texts:
+                if perf:
+                    perf.skip("duplicate")
+                continue
+            seen_texts.add(dedup_key)
 
+            kept.append(record)
+            if len(kept) >= 100 and budget is None:
+                if perf:
+                    perf.skip("session_cap", len(records) - i - 1)
+                break
 
-def collect_cline(cutoff_ms: int | None) -> dict:
-    """Cline の api_conversation_history.json からプロンプトを収集"""
-    result = {"tool": "Cline", "status": "未検出", "messages": [], "period": ""}
+        container = (str(session_path.parent), str(session_path))
+        if ordered:
+            runs.append(session_messages(time_sorted_records(kept), project_name_from_dir, container))
+        else:
+            yield from session_messages(kept, project_name_from_dir, container)
 
-    appdata = get_appdata_path()
-    tasks_dir = appdata / "Code" / "User" / "globalStorage" / "saoudrizwan.claude-dev" / "tasks"
-    if not tasks_dir.exists():
-        return result
+    if ordered:
+        yield from merge_by_time(runs)
 
-    all_prompts = []
-    task_dirs = sorted(tasks_dir.iterdir(), key=lambda p: p.stat().st_mtime, reverse=True)[:20]
 
-    for task_dir in task_dirs:
-        history_file = task_dir / "api_conversation_history.json"
-        if not history_file.exists():
-            continue
+# state.vscdb を並行して読むスレッド数（sqlite3 はクエリ中に GIL を解放する）
+VSCDB_READ_WORKERS = 8
 
-        if cutoff_ms:
-            file_mtime_ms = int(history_file.stat().st_mtime * 1000)
-            if file_mtime_ms < cutoff_ms:
-                continue
 
+def read_copilot_history(vscdb_path: Path) -> list[str]:
+    """state.vscdb の memento/interactive-session からプロンプトを読む
+
+    起動中の VS Code のロックと競合しないよう、読み取り専用・immutable で開く。
+    """
+    try:
+        conn = sqlite3.connect(f"{vscdb_path.as_uri()}?mode=ro&immutable=1", uri=True)
         try:
-            with open(history_file, "r", encoding="utf-8") as f:
-                data = json.load(f)
-            for msg in data:
-                if msg.get("role") == "user":
-                    content = msg.get("content", "")
-                    if isinstance(content, list):
-                        text = " ".join(
-                            c.get("text", "") for c in content if c.get("type") == "text"
-                        )
-                    else:
-                        text = str(content)
-                    text = text.strip()
-                    if text:
-                        file_mtime_ms = int(history_file.stat().st_mtime * 1000)
-                        all_prompts.append({
-                            "text": text[:500],
-                            "timestamp": ts_to_iso(file_mtime_ms),
-                            "timestamp_ms": file_mtime_ms,
-                            "project": task_dir.name[:12],
-                        })
-        except (json.JSONDecodeError, OSError):
-            continue
+            row = conn.execute("SELECT value FROM ItemTable WHERE key = 'memento/interactive-session'").fetchone()
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        return []
 
-    if all_prompts:
-        result["status"] = "検出"
-        result["messages"] = all_prompts
-        timestamps = [m["timestamp"] for m in all_prompts if m["timestamp"] != "unknown"]
-        if timestamps:
-            result["period"] = f"{min(timestamps)} 〜 {max(timestamps)}"
+    texts = []
+    if row and row[0]:
+        try:
+            data = json.loads(row[0])
+            history = data.get("history", {})
+            for mode_key, entries in history.items():
+                if isinstance(entries, list):
+                    for entry in entries:
+                        text = entry.get("text", "").strip()
+                        if text:
+                            texts.append(text)
+        except (json.JSONDecodeError, AttributeError):
+            pass
+    return texts
+
+
+def iter_copilot_chat(cutoff_ms: int | None, project_filter: str | None, perf: SourceProfile | None = None, budget: SourceBudget | None = None, ordered: bool = False) -> Iterator[Message]:
+    """GitHub Copilot Chat の state.vscdb からプロンプトを収集
+
+    budget を渡すと新しい順に VSCDB_READ_WORKERS 件ずつ読み、締め切りを過ぎたら残りを読まない。
+    ordered なら時刻（DBの更新日時）の古い順に返す。
+    """
 
-    return result
+    appdata = get_appdata_path()
+    workspace_storage = appdata / "Code" / "User" / "workspaceStorage"
+    if not workspace_storage.exists():
+        return
 
+    # Copilot Chat にはタイムスタンプがないため、vscdbの更新日時を代用（stat はDBごとに1回）
+    targets = []
+    for workspace in scan_dir(workspace_storage, dirs=True):
+        vscdb_path = workspace.path / "state.vscdb"
+        try:
+            st = vscdb_path.stat()
+        except OSError:
+            continue
+        file_mtime_ms = int(st.st_mtime * 1000)
+        if cutoff_ms and file_mtime_ms < cutoff_ms:
+            if perf:
+                perf.skip_file("mtime")
+            continue
+        targets.append((vscdb_path, file_mtime_ms, st.st_size))
+    if not targets:
+        return
 
-def collect_roo_code(cutoff_ms: int | None) -> dict:
-    """Roo Code の会話履歴を収集（Clineと同じ構造）"""
-    result = {"tool": "Roo Code", "status": "未検出", "messages": [], "period": ""}
+    if perf:
+        def read(target):
+            return perf.timed(read_copilot_history, target[0], target[2])
+    else:
+        def read(target):
+            return read_copilot_history(target[0])
+
+    batch = len(targets)
+    if budget:
+        targets.sort(key=lambda target: target[1], reverse=True)
+        batch = VSCDB_READ_WORKERS
+    elif ordered:
+        targets.sort(key=lambda target: target[1])
+
+    with ThreadPoolExecutor(max_workers=min(VSCDB_READ_WORKERS, len(targets))) as pool:
+        for start in range(0, len(targets), batch):
+            if budget and budget.exhausted():
+                return
+            chunk = targets[start:start + batch]
+            for (vscdb_path, file_mtime_ms, _), texts in zip(chunk, pool.map(read, chunk)):
+                project = vscdb_path.parent.name[:12]
+                for text in texts:
+                    yield Message(text[:500], file_mtime_ms, project)
+
+
+_JSON_WS_RE = re.compile(rb"[ \t\r\n]*")
+_JSON_STRUCTURE_RE = re.compile(rb'["\[\]{}]')
+_JSON_SCALAR_RE = re.compile(rb"[^,\]}\s]+")
+
+
+class JsonScanner:
+    """bytes / mmap 上の JSON を先頭から走査する最小限のパーサ
+
+    配列・オブジェクトの要素を1つずつ辿り、必要な値だけを json.loads でデコードする。
+    不要な値は文字列の終端や括弧の対応だけを見て読み飛ばすので、巨大な値もメモリに載せない。
+    構文エラーは ValueError を送出する（不要な値の中身までは検証しない）。
+    """
+
+    def __init__(self, buf):
+        self.buf = buf
+        self.pos = 0
+
+    def error(self, message: str):
+        raise ValueError(f"{message} (offset {self.pos})")
+
+    def skip_ws(self):
+        self.pos = _JSON_WS_RE.match(self.buf, self.pos).end()
+
+    def peek(self) -> bytes:
+        return self.buf[self.pos:self.pos + 1]
+
+    def expect(self, token: bytes):
+        self.skip_ws()
+        if self.peek() != token:
+            self.error(f"{token.decode()} expected")
+        self.pos += 1
+
+    def at_end(self) -> bool:
+        self.skip_ws()
+        return self.pos >= len(self.buf)
+
+    def _string_end(self, start: int) -> int:
+        """start の '"' から始まる文字列の終端の次の位置"""
+        buf = self.buf
+        end = start + 1
+        while True:
+            end = buf.find(b'"', end)
+            if end < 0:
+                self.pos = start
+                self.error("unterminated string")
+            # 直前のバックスラッシュが偶数個なら終端の引用符
+            k = end - 1
+            while buf[k] == 0x5C:
+                k -= 1
+            if (end - 1 - k) % 2 == 0:
+                return end + 1
+            end += 1
+
+    def skip_value(self) -> tuple[int, int]:
+        """現在位置の値を読み飛ばし、その範囲 (start, end) を返す"""
+        self.skip_ws()
+        buf = self.buf
+        start = self.pos
+        head = self.peek()
+        if head == b'"':
+            self.pos = self._string_end(start)
+        elif head in (b"{", b"["):
+            depth = 0
+            pos = start
+            while True:
+                m = _JSON_STRUCTURE_RE.search(buf, pos)
+                if not m:
+                    self.error("unterminated container")
+                c = buf[m.start()]
+                if c == 0x22:
+                    pos = self._string_end(m.start())
+                    continue
+                depth += 1 if c in (0x5B, 0x7B) else -1
+                pos = m.end()
+                if depth == 0:
+                    break
+            self.pos = pos
+        else:
+            m = _JSON_SCALAR_RE.match(buf, start)
+            if not m:
+                self.error("value expected")
+            self.pos = m.end()
+        return start, self.pos
+
+    def decode(self, span: tuple[int, int]):
+        return json.loads(self.buf[span[0]:span[1]])
+
+    def array_items(self) -> Iterator[None]:
+        """配列の要素ごとに、その要素の先頭で止まる。呼び出し側は要素を読み進めてから次へ進む"""
+        self.expect(b"[")
+        self.skip_ws()
+        if self.peek() == b"]":
+            self.pos += 1
+            return
+        while True:
+            self.skip_ws()
+            yield
+            self.skip_ws()
+            token = self.peek()
+            self.pos += 1
+            if token == b"]":
+                return
+            if token != b",":
+                self.pos -= 1
+                self.error("',' or ']' expected")
+
+    def object_items(self) -> Iterator[str]:
+        """オブジェクトのキーごとに、その値の先頭で止まってキーを返す。呼び出し側は値を読み進めてから次へ進む"""
+        self.expect(b"{")
+        self.skip_ws()
+        if self.peek() == b"}":
+            self.pos += 1
+            return
+        while True:
+            self.skip_ws()
+            if self.peek() != b'"':
+                self.error("key expected")
+            key = self.decode(self.skip_value())
+            self.expect(b":")
+            self.skip_ws()
+            yield key
+            self.skip_ws()
+            token = self.peek()
+            self.pos += 1
+            if token == b"}":
+                return
+            if token != b",":
+                self.pos -= 1
+                self.error("',' or '}' expected")
+
+    def object_spans(self, keys: set[str]) -> dict[str, tuple[int, int]]:
+        """オブジェクトを読み飛ばし、keys に含まれるキーの値の範囲を返す（重複キーは後勝ち）"""
+        spans = {}
+        for key in self.object_items():
+            span = self.skip_value()
+            if key in keys:
+                spans[key] = span
+        return spans
+
+
+def _task_message_text(scanner: JsonScanner) -> str | None:
+    """api_conversation_history.json の1メッセージを読み、ユーザーのテキストを返す（ユーザー以外は None）"""
+    if scanner.peek() != b"{":
+        scanner.skip_value()
+        return None
+    # role が content の後に来ても判定できるよう、先に範囲だけ記録する
+    spans = scanner.object_spans({"role", "content"})
+    if "role" not in spans or scanner.decode(spans["role"]) != "user":
+        return None
+    if "content" not in spans:
+        return ""
 
-    appdata = get_appdata_path()
-    tasks_dir = appdata / "Code" / "User" / "globalStorage" / "RooVeterinaryInc.roo-cline" / "tasks"
+    end = scanner.pos
+    start = spans["content"][0]
+    try:
+        if scanner.buf[start:start + 1] != b"[":
+            return str(scanner.decode(spans["content"]))
+        texts = []
+        scanner.pos = start
+        for _ in scanner.array_items():
+            if scanner.peek() != b"{":
+                scanner.skip_value()
+                continue
+            block = scanner.object_spans({"type", "text"})
+            if "type" in block and scanner.decode(block["type"]) == "text":
+                text = scanner.decode(block["text"]) if "text" in block else ""
+                if isinstance(text, str):
+                    texts.append(text)
+        return " ".join(texts)
+    finally:
+        scanner.pos = end
+
+
+def read_task_history(history_file: Path) -> list[str]:
+    """Cline / Roo Code の api_conversation_history.json からユーザーのテキストを読む
+
+    ツール結果や base64 画像で数百MBになることがあるため、json.load せずに mmap 上を走査し、
+    アシスタントのメッセージやテキスト以外のブロックは中身を読まずに飛ばす。
+    ファイル全体が JSON として読めない場合は ValueError を送出する（途中までの結果も返さない）。
+    """
+    texts = []
+    with open(history_file, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+        scanner = JsonScanner(buf)
+        for _ in scanner.array_items():
+            text = _task_message_text(scanner)
+            if text is not None:
+                texts.append(text.strip())
+        if not scanner.at_end():
+            scanner.error("extra data")
+    return [text for text in texts if text]
+
+
+def iter_task_histories(tasks_dir: Path, cutoff_ms: int | None, perf: SourceProfile | None = None, budget: SourceBudget | None = None, ordered: bool = False) -> Iterator[Message]:
+    """Cline 系拡張の tasks/ 以下から、更新日時の新しい20タスク（budget があれば締め切りまで）のプロンプトを収集
+
+    ordered なら時刻の古い順に返す。タスクはディレクトリの更新日時で選ぶが、時刻は履歴ファイルの更新日時なので、
+    選んだタスクを履歴ファイルの更新日時の順に読む。
+    """
     if not tasks_dir.exists():
-        return result
-
-    # Clineと同じ処理
-    all_prompts = []
-    task_dirs = sorted(tasks_dir.iterdir(), key=lambda p: p.stat().st_mtime, reverse=True)[:20]
-
-    for task_dir in task_dirs:
-        history_file = task_dir / "api_conversation_history.json"
-        if not history_file.exists():
-            continue
+        return
 
-        if cutoff_ms:
-            file_mtime_ms = int(history_file.stat().st_mtime * 1000)
-            if file_mtime_ms < cutoff_ms:
+    def history_files():
+        for task in newest_first(scan_dir(tasks_dir, dirs=True), None if budget else 20):
+            history_file = task.path / "api_conversation_history.json"
+            # タイムスタンプはファイルの更新日時を代用
+            try:
+                st = history_file.stat()
+            except OSError:
                 continue
+            yield task.path, history_file, st
+
+    targets = history_files()
+    if ordered:
+        targets = sorted(targets, key=lambda target: int(target[2].st_mtime * 1000))
+    for task_dir, history_file, st in targets:
+        if budget and budget.exhausted():
+            return
+        file_mtime_ms = int(st.st_mtime * 1000)
+        if cutoff_ms and file_mtime_ms < cutoff_ms:
+            if perf:
+                perf.skip_file("mtime")
+            continue
 
         try:
-            with open(history_file, "r", encoding="utf-8") as f:
-                data = json.load(f)
-            for msg in data:
-                if msg.get("role") == "user":
-                    content = msg.get("content", "")
-                    if isinstance(content, list):
-                        text = " ".join(
-                            c.get("text", "") for c in content if c.get("type") == "text"
-                        )
-                    else:
-                        text = str(content)
-                    text = text.strip()
-                    if text:
-                        file_mtime_ms = int(history_file.stat().st_mtime * 1000)
-                        all_prompts.append({
-                            "text": text[:500],
-                            "timestamp": ts_to_iso(file_mtime_ms),
-                            "timestamp_ms": file_mtime_ms,
-                            "project": task_dir.name[:12],
-                        })
-        except (json.JSONDecodeError, OSError):
+            texts = read_task_history(history_file) if perf is None else perf.timed(read_task_history, history_file, st.st_size)
+        except (ValueError, OSError):
+            if perf:
+                perf.skip_file("unreadable")
             continue
+        project = task_dir.name[:12]
+        container = ("", str(task_dir))
+        for text in texts:
+            yield Message(text[:500], file_mtime_ms, project, container=container)
 
-    if all_prompts:
-        result["status"] = "検出"
-        result["messages"] = all_prompts
-        timestamps = [m["timestamp"] for m in all_prompts if m["timestamp"] != "unknown"]
-        if timestamps:
-            result["period"] = f"{min(timestamps)} 〜 {max(timestamps)}"
 
-    return result
+def iter_cline(cutoff_ms: int | None, perf: SourceProfile | None = None, budget: SourceBudget | None = None, ordered: bool = False) -> Iterator[Message]:
+    """Cline の api_conversation_history.json からプロンプトを収集"""
 
+    appdata = get_appdata_path()
+    tasks_dir = appdata / "Code" / "User" / "globalStorage" / "saoudrizwan.claude-dev" / "tasks"
+    yield from iter_task_histories(tasks_dir, cutoff_ms, perf, budget, ordered)
 
-def collect_windsurf(cutoff_ms: int | None) -> dict:
-    """Windsurf のメモリファイルを収集"""
-    result = {"tool": "Windsurf", "status": "未検出", "messages": [], "period": ""}
+
+def iter_roo_code(cutoff_ms: int | None, perf: SourceProfile | None = None, budget: SourceBudget | None = None, ordered: bool = False) -> Iterator[Message]:
+    """Roo Code の会話履歴を収集（Clineと同じ構造）"""
+
+    appdata = get_appdata_path()
+    tasks_dir = appdata / "Code" / "User" / "globalStorage" / "RooVeterinaryInc.roo-cline" / "tasks"
+    yield from iter_task_histories(tasks_dir, cutoff_ms, perf, budget, ordered)
+
+
+# メモリ・ログファイルから取り出す先頭の文字数と、1回に読むバイト数
+HEAD_CHARS = 500
+HEAD_READ_BYTES = 4096
+
+
+def read_text_head(path: Path, chars: int = HEAD_CHARS) -> str:
+    """path.read_text().strip()[:chars] と同じ文字列を、ファイルの先頭だけ読んで返す
+
+    HEAD_READ_BYTES ずつ読み、空白を除いた先頭 chars 文字とその後ろに空白以外の文字が見つかった時点でやめる。
+    UTF-8 の途中で切れたバイトは次の読み込みまで持ち越し、改行は read_text と同じく \n にそろえる。
+    読んだ範囲に不正な UTF-8 があれば UnicodeDecodeError（読んでいない後半は検査しない）。
+    """
+    decoder = io.IncrementalNewlineDecoder(codecs.getincrementaldecoder("utf-8")(), translate=True)
+    text = ""
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(HEAD_READ_BYTES)
+            text += decoder.decode(chunk, final=not chunk)
+            if not chunk:
+                return text.strip()[:chars]
+            text = text.lstrip()
+            if text[chars:].strip():
+                return text[:chars]
+
+
+def read_head_cached(entry: FileEntry, checkpoints: CheckpointStore | None, perf: SourceProfile | None = None) -> str:
+    """read_text_head をサイズ・mtime が同じ間はチェックポイントから返す"""
+    text = checkpoints.head(entry) if checkpoints else None
+    if text is not None:
+        if perf:
+            perf.file(entry.path, 0.0, 0)
+        return text
+    started = time.perf_counter()
+    text = read_text_head(entry.path)
+    if perf:
+        perf.file(entry.path, time.perf_counter() - started, min(entry.size, HEAD_READ_BYTES))
+    if checkpoints:
+        checkpoints.set_head(entry, text)
+    return text
+
+
+def iter_windsurf(cutoff_ms: int | None, prune_dirs: bool = False, perf: SourceProfile | None = None, budget: SourceBudget | None = None, checkpoints: CheckpointStore | None = None, ordered: bool = False) -> Iterator[Message]:
+    """Windsurf のメモリファイルを収集（各ファイルの先頭500文字）。ordered なら更新日時の古い順に返す"""
 
     memories_dir = Path.home() / ".codeium" / "windsurf" / "memories"
     if not memories_dir.exists():
-        return result
-
-    all_entries = []
-    for mem_file in sorted(memories_dir.rglob("*"), key=lambda p: p.stat().st_mtime, reverse=True)[:20]:
-        if not mem_file.is_file():
+        return
+
+    memories = newest_first(walk_files(memories_dir, prune_before_ms=cutoff_ms if prune_dirs else None), None if budget else 20)
+    if ordered:
+        memories.reverse()
+    for mem in memories:
+        if budget and budget.exhausted():
+            return
+        mem_file = mem.path
+        file_mtime_ms = mem.mtime_ms
+        if cutoff_ms and file_mtime_ms < cutoff_ms:
+            if perf:
+                perf.skip_file("mtime")
             continue
-        if cutoff_ms:
-            file_mtime_ms = int(mem_file.stat().st_mtime * 1000)
-            if file_mtime_ms < cutoff_ms:
-                continue
         try:
-            text = mem_file.read_text(encoding="utf-8").strip()
+            text = read_head_cached(mem, checkpoints, perf)
             if text:
-                file_mtime_ms = int(mem_file.stat().st_mtime * 1000)
-                all_entries.append({
-                    "text": text[:500],
-                    "timestamp": ts_to_iso(file_mtime_ms),
-                    "timestamp_ms": file_mtime_ms,
-                    "project": mem_file.parent.name,
-                    "note": "Cascadeの自動要約メモリ（元のプロンプトではない）",
-                })
+                yield Message(text, file_mtime_ms, mem_file.parent.name, "Cascadeの自動要約メモリ（元のプロンプトではない）", container=("", str(mem_file)))
         except (OSError, UnicodeDecodeError):
+            if perf:
+                perf.skip_file("unreadable")
             continue
 
-    if all_entries:
-        result["status"] = "検出"
-        result["messages"] = all_entries
-        timestamps = [m["timestamp"] for m in all_entries if m["timestamp"] != "unknown"]
-        if timestamps:
-            result["period"] = f"{min(timestamps)} 〜 {max(timestamps)}"
-
-    return result
 
+def iter_antigravity(cutoff_ms: int | None, prune_dirs: bool = False, perf: SourceProfile | None = None, budget: SourceBudget | None = None, checkpoints: CheckpointStore | None = None, ordered: bool = False) -> Iterator[Message]:
+    """Google Antigravity のログを収集（各ファイルの先頭500文字）
 
-def collect_antigravity(cutoff_ms: int | None) -> dict:
-    """Google Antigravity のログを収集"""
-    result = {"tool": "Google Antigravity", "status": "未検出", "messages": [], "period": ""}
+    会話ごとに新しい10件まで。budget を渡すと上限をなくし、会話をまたいで新しい順に読む。
+    ordered なら会話をまたいで更新日時の古い順に返す。
+    """
 
     brain_dir = Path.home() / ".gemini" / "antigravity" / "brain"
     if not brain_dir.exists():
-        return result
-
-    all_entries = []
-    for log_dir in brain_dir.glob("*/.system_generated/logs"):
-        for log_file in sorted(log_dir.rglob("*"), key=lambda p: p.stat().st_mtime, reverse=True)[:10]:
-            if not log_file.is_file() or log_file.suffix == ".pb":
-                continue
-            if cutoff_ms:
-                file_mtime_ms = int(log_file.stat().st_mtime * 1000)
-                if file_mtime_ms < cutoff_ms:
-                    continue
-            try:
-                text = log_file.read_text(encoding="utf-8").strip()
-                if text:
-                    file_mtime_ms = int(log_file.stat().st_mtime * 1000)
-                    all_entries.append({
-                        "text": text[:500],
-                        "timestamp": ts_to_iso(file_mtime_ms),
-                        "timestamp_ms": file_mtime_ms,
-                        "project": log_file.parent.parent.parent.name[:12],
-                    })
-            except (OSError, UnicodeDecodeError):
-                continue
-
-    if all_entries:
-        result["status"] = "検出"
-        result["messages"] = all_entries
-        timestamps = [m["timestamp"] for m in all_entries if m["timestamp"] != "unknown"]
-        if timestamps:
-            result["period"] = f"{min(timestamps)} 〜 {max(timestamps)}"
-
-    return result
+        return
+
+    prune_before_ms = cutoff_ms if prune_dirs else None
+    logs = []
+    for conversation in scan_dir(brain_dir, dirs=True):
+        log_dir = conversation.path / ".system_generated" / "logs"
+        logs.extend(newest_first(walk_files(log_dir, prune_before_ms=prune_before_ms), None if budget else 10))
+    if budget:
+        logs = newest_first(logs)
+    elif ordered:
+        logs.sort(key=lambda log: log.mtime)
+
+    for log in logs:
+        if budget and budget.exhausted():
+            return
+        log_file = log.path
+        if log_file.suffix == ".pb":
+            if perf:
+                perf.skip_file("pb")
+            continue
+        file_mtime_ms = log.mtime_ms
+        if cutoff_ms and file_mtime_ms < cutoff_ms:
+            if perf:
+                perf.skip_file("mtime")
+            continue
+        try:
+            text = read_head_cached(log, checkpoints, perf)
+            if text:
+                container = (log_file.relative_to(brain_dir).parts[0], str(log_file))
+                yield Message(text, file_mtime_ms, log_file.parent.parent.parent.name[:12], container=container)
+        except (OSError, UnicodeDecodeError):
+            if perf:
+                perf.skip_file("unreadable")
+            continue
 
 
-def collect_codex(cutoff_ms: int | None, project_filter: str | None) -> dict:
-    """OpenAI Codex CLI の rollout JSONL からユーザープロンプトを収集"""
-    result = {"tool": "OpenAI Codex", "status": "未検出", "messages": [], "period": ""}
+def iter_codex(cutoff_ms: int | None, project_filter: str | None, checkpoints: CheckpointStore | None = None, stats: ScanStats | None = None, prune_dirs: bool = False, perf: SourceProfile | None = None, budget: SourceBudget | None = None, partition_prune: bool = True, ordered: bool = False) -> Iterator[Message]:
+    """OpenAI Codex CLI の rollout JSONL からユーザープロンプトを収集
 
+    新しい50ファイル、1ファイル100件まで。budget を渡すと上限をなくし、締め切りまで新しい順に読む。
+    partition_prune なら sessions/YYYY/MM/DD のうちカットオフより前の日付のディレクトリには降りない。
+    ordered なら時刻の古い順に返す（rollout ごとの列を merge_by_time でマージし、メッセージは取り出すときに作る）。
+    """
     codex_home = Path(os.environ.get("CODEX_HOME", Path.home() / ".codex"))
     sessions_dir = codex_home / "sessions"
     if not sessions_dir.exists():
-        return result
-
-    messages = []
+        return
 
     # sessions/YYYY/MM/DD/rollout-*.jsonl を走査
-    rollout_files = sorted(
-        sessions_dir.rglob("rollout-*.jsonl"),
-        key=lambda p: p.stat().st_mtime,
-        reverse=True,
-    )[:50]
+    prune_before_ms = cutoff_ms if prune_dirs else None
+    if partition_prune:
+        rollouts = iter_partitioned_files(sessions_dir, "rollout-*.jsonl", cutoff_ms, prune_before_ms)
+        # 締め切りのある走査では、日付ディレクトリの新しい順のまま列挙しながら読む
+        if budget is None:
+            rollouts = newest_first(list(rollouts), 50)
+    else:
+        rollouts = newest_first(walk_files(sessions_dir, "rollout-*.jsonl", prune_before_ms), None if budget else 50)
+
+    def rollout_messages(kept, project_name, container):
+        for ts_ms, text in kept:
+            yield Message(text[:500], ts_ms, project_name, container=container)
 
-    for rollout_path in rollout_files:
+    runs = []
+    for rollout in rollouts:
+        if budget and budget.exhausted():
+            return
+        rollout_path = rollout.path
         # カットオフフィルタ: ファイル更新日時で粗くフィルタ
-        if cutoff_ms:
-            file_mtime_ms = int(rollout_path.stat().st_mtime * 1000)
-            if file_mtime_ms < cutoff_ms:
-                continue
+        if cutoff_ms and rollout.mtime_ms < cutoff_ms:
+            if perf:
+                perf.skip_file("mtime")
+            continue
 
         try:
-            cwd = ""
-            session_messages = []
-            msg_count = 0
-
-            with open(rollout_path, "r", encoding="utf-8") as f:
-                for line in f:
-                    line = line.strip()
-                    if not line:
-                        continue
-                    try:
-                        entry = json.loads(line)
-                    except json.JSONDecodeError:
-                        continue
-
-                    timestamp_str = entry.get("timestamp", "")
-
-                    # SessionMeta からプロジェクト情報を取得
-                    session_meta = entry.get("SessionMeta") or entry.get("session_meta")
-                    if session_meta:
-                        cwd = session_meta.get("cwd", "") or session_meta.get("working_directory", "")
-                        continue
-
-                    # ResponseItem からユーザーメッセージを抽出
-                    response_item = entry.get("ResponseItem") or entry.get("response_item")
-                    if not response_item:
-                        continue
-
-                    item_type = response_item.get("type", "")
-                    role = response_item.get("role", "")
-                    if item_type != "message" or role != "user":
-                        continue
-
-                    # コンテンツからテキストを抽出
-                    content = response_item.get("content", [])
-                    texts = []
-                    if isinstance(content, list):
-                        for part in content:
-                            if isinstance(part, dict):
-                                part_type = part.get("type", "")
-                                if part_type in ("input_text", "text"):
-                                    text = part.get("text", "").strip()
-                                    if text:
-                                        texts.append(text)
-                    elif isinstance(content, str):
-                        texts.append(content.strip())
-
-                    text = sanitize_text(" ".join(texts).strip())
-                    if not text:
-                        continue
-
-                    # タイムスタンプ処理
-                    ts_ms = iso_to_ms(timestamp_str) if timestamp_str else None
-                    if cutoff_ms and ts_ms and ts_ms < cutoff_ms:
-                        continue
-
-                    ts_display = ts_to_iso(ts_ms) if ts_ms else "unknown"
-
-                    session_messages.append({
-                        "text": text[:500],
-                        "timestamp": ts_display,
-                        "timestamp_ms": ts_ms or 0,
-                        "_cwd_placeholder": True,  # cwdは後で設定
-                    })
-                    msg_count += 1
-                    if msg_count >= 100:
-                        break
-
-            # プロジェクト名を設定
-            project_name = Path(cwd).name if cwd else "unknown"
-
-            # プロジェクトフィルタ
-            if project_filter:
-                filter_lower = project_filter.lower()
-                if filter_lower not in project_name.lower() and (not cwd or filter_lower not in cwd.lower()):
-                    continue
-
-            for msg in session_messages:
-                del msg["_cwd_placeholder"]
-                msg["project"] = project_name
-                messages.append(msg)
-
-        except (OSError, UnicodeDecodeError):
+            records, state = read_jsonl_records(rollout_path, ROLLOUT_FORMAT, checkpoints, stats, perf=perf)
+        except OSError:
             continue
 
-    if messages:
-        result["status"] = "検出"
-        result["messages"] = messages
-        timestamps = [m["timestamp"] for m in messages if m["timestamp"] != "unknown"]
-        if timestamps:
-            result["period"] = f"{min(timestamps)} 〜 {max(timestamps)}"
+        cwd = state.get("cwd", "")
+        session_messages = []
+        for i, record in enumerate(records):
+            # タイムスタンプ処理
+            if cutoff_ms and record[0] and record[0] < cutoff_ms:
+                if perf:
+                    perf.skip("cutoff")
+                continue
 
-    return result
+            session_messages.append(record)
+            if len(session_messages) >= 100 and budget is None:
+                if perf:
+                    perf.skip("session_cap", len(records) - i - 1)
+                break
+
+        # プロジェクト名を設定
+        project_name = Path(cwd).name if cwd else "unknown"
+
+        # プロジェクトフィルタ
+        if project_filter:
+            filter_lower = project_filter.lower()
+            if filter_lower not in project_name.lower() and (not cwd or filter_lower not in cwd.lower()):
+                if perf:
+                    perf.skip("project", len(session_messages))
+                continue
+
+        container = ("", str(rollout_path))
+        if ordered:
+            runs.append(rollout_messages(time_sorted_records(session_messages), project_name, container))
+        else:
+            yield from rollout_messages(session_messages, project_name, container)
+
+    if ordered:
+        yield from merge_by_time(runs)
+
+
+# OpenCode の収集クエリが使うインデックス（テーブル → 先頭列）
+OPENCODE_INDEXES = [("part", "message_id"), ("session", "id"), ("project", "id"), ("message", "time_created")]
+
+OPENCODE_QUERY = """
+    SELECT
+        m.id AS message_id,
+        m.time_created AS message_time_created,
+        p.worktree AS project_worktree,
+        s.directory AS session_directory,
+        json_extract(pt.data, '$.text') AS part_text
+    FROM message m
+    JOIN session s ON s.id = m.session_id
+    JOIN project p ON p.id = s.project_id
+    JOIN part pt ON pt.message_id = m.id
+    WHERE s.parent_id IS NULL
+      AND CASE WHEN json_valid(m.data) THEN json_extract(m.data, '$.role') END = 'user'
+      AND CASE WHEN json_valid(pt.data) THEN
+            json_extract(pt.data, '$.type') = 'text'
+            AND coalesce(json_type(pt.data, '$.synthetic'), '') != 'true'
+            AND coalesce(json_type(pt.data, '$.ignored'), '') != 'true'
+          END
+      {cutoff}
+    ORDER BY m.time_created {order}, m.id {order}, pt.time_created ASC, pt.id ASC
+"""
 
 
-def collect_opencode(cutoff_ms: int | None, project_filter: str | None) -> dict:
-    """OpenCode の SQLite DB からユーザープロンプトを収集"""
-    result = {"tool": "OpenCode", "status": "未検出", "messages": [], "period": ""}
+def sqlite_index_report(conn: sqlite3.Connection, wanted: list[tuple[str, str]]) -> dict:
+    """(テーブル, 列) ごとに、その列を先頭に持つインデックス（主キーを含む）があるかを返す"""
+    report = {}
+    for table, column in wanted:
+        leading = set()
+        for index in conn.execute("SELECT name FROM pragma_index_list(?)", (table,)).fetchall():
+            first = conn.execute("SELECT name FROM pragma_index_info(?) WHERE seqno = 0", (index[0],)).fetchone()
+            if first:
+                leading.add(first[0])
+        # INTEGER PRIMARY KEY は rowid の別名なのでインデックス一覧には現れない
+        for info in conn.execute("SELECT name, type, pk FROM pragma_table_info(?)", (table,)).fetchall():
+            if info[2] == 1 and info[1].upper() == "INTEGER":
+                leading.add(info[0])
+        report[f"{table}({column})"] = column in leading
+    return report
+
+
+def iter_opencode(cutoff_ms: int | None, project_filter: str | None, stats: ScanStats | None = None, perf: SourceProfile | None = None, budget: SourceBudget | None = None, ordered: bool = False) -> Iterator[Message]:
+    """OpenCode の SQLite DB からユーザープロンプトを収集
+
+    子セッション・ユーザー以外・テキスト以外/synthetic/ignored のパートとカットオフはSQL側で除外し、
+    カーソルからメッセージ単位にまとめながら返す（DB全体を読み込まない）。
+    budget を渡すとメッセージを新しい順に読み、締め切りを過ぎたらカーソルを閉じる。
+    DBごとには ORDER BY で時刻の古い順に返る。ordered で DB が複数あれば、DBごとのカーソルを merge_by_time でマージする。
+    stats を渡した場合だけ、DBごとにインデックスの有無と読んだ行数を記録する。
+    """
 
     xdg_data_home = Path(os.environ.get("XDG_DATA_HOME", Path.home() / ".local" / "share"))
     opencode_dir = xdg_data_home / "opencode"
     if not opencode_dir.exists():
-        return result
+        return
 
     db_paths = []
     primary_db = opencode_dir / "opencode.db"
     if primary_db.exists():
         db_paths.append(primary_db)
 
-    for db_path in sorted(opencode_dir.glob("opencode-*.db")):
+    for db_path in sorted(entry.path for entry in scan_dir(opencode_dir, "opencode-*.db")):
         if db_path not in db_paths:
             db_paths.append(db_path)
 
     if not db_paths:
-        return result
+        return
 
-    messages = []
     seen_message_ids = set()
+    order = "DESC" if budget else "ASC"
+    if cutoff_ms:
+        # 時刻不明（NULL / 0）のメッセージはカットオフで落とさない
+        sql = OPENCODE_QUERY.format(cutoff="AND (m.time_created IS NULL OR m.time_created = 0 OR m.time_created >= ?)", order=order)
+        params = (cutoff_ms,)
+    else:
+        sql = OPENCODE_QUERY.format(cutoff="", order=order)
+        params = ()
 
-    for db_path in db_paths:
+    def read_db(db_path: Path) -> Iterator[Message]:
         conn = None
+        db_stats = {}
+        rows_read = 0
+        started = time.perf_counter()
         try:
             conn = sqlite3.connect(str(db_path))
             conn.row_factory = sqlite3.Row
-            cursor = conn.cursor()
-            cursor.execute(
-                """
-                SELECT
-                    m.id AS message_id,
-                    m.time_created AS message_time_created,
-                    m.data AS message_data,
-                    p.worktree AS project_worktree,
-                    s.directory AS session_directory,
-                    s.parent_id AS session_parent_id,
-                    pt.id AS part_id,
-                    pt.time_created AS part_time_created,
-                    pt.data AS part_data
-                FROM message m
-                JOIN session s ON s.id = m.session_id
-                JOIN project p ON p.id = s.project_id
-                JOIN part pt ON pt.message_id = m.id
-                ORDER BY m.time_created ASC, pt.time_created ASC, pt.id ASC
-                """
-            )
-
-            grouped = {}
-            for row in cursor.fetchall():
-                message_id = row["message_id"]
+            if stats is not None:
+                db_stats["indexes"] = sqlite_index_report(conn, OPENCODE_INDEXES)
+
+            # ORDER BY で同じメッセージのパートは連続するので、メッセージIDが変わるたびに確定できる
+            for message_id, rows in groupby(conn.execute(sql, params), key=lambda row: row["message_id"]):
+                if budget and budget.exhausted():
+                    break
+                texts = []
+                for row in rows:
+                    rows_read += 1
+                    part_text = row["part_text"]
+                    text = sanitize_text(str(part_text if part_text is not None else "").strip())
+                    if text:
+                        texts.append(text)
                 if message_id in seen_message_ids:
+                    if perf:
+                        perf.skip("duplicate")
                     continue
 
-                if message_id not in grouped:
-                    try:
-                        message_data = json.loads(row["message_data"])
-                    except (TypeError, json.JSONDecodeError):
-                        grouped[message_id] = None
-                        continue
-
-                    if row["session_parent_id"] is not None:
-                        grouped[message_id] = None
-                        continue
-
-                    if message_data.get("role") != "user":
-                        grouped[message_id] = None
-                        continue
-
-                    grouped[message_id] = {
-                        "timestamp_ms": row["message_time_created"] or 0,
-                        "worktree": row["project_worktree"] or "",
-                        "session_directory": row["session_directory"] or "",
-                        "texts": [],
-                    }
-
-                entry = grouped.get(message_id)
-                if entry is None:
-                    continue
-
-                try:
-                    part_data = json.loads(row["part_data"])
-                except (TypeError, json.JSONDecodeError):
-                    continue
-
-                if part_data.get("type") != "text":
-                    continue
-                if part_data.get("synthetic") is True:
-                    continue
-                if part_data.get("ignored") is True:
-                    continue
-
-                text = sanitize_text(str(part_data.get("text", "")).strip())
+                text = " ".join(texts).strip()
                 if not text:
+                    if perf:
+                        perf.skip("empty")
                     continue
-                entry["texts"].append(text)
 
-            for message_id, entry in grouped.items():
-                if entry is None:
-                    continue
-
-                text = " ".join(entry["texts"]).strip()
-                if not text:
-                    continue
-
-                timestamp_ms = entry["timestamp_ms"]
-                if cutoff_ms and timestamp_ms and timestamp_ms < cutoff_ms:
-                    continue
-
-                project_source = entry["worktree"] or entry["session_directory"]
+                timestamp_ms = row["message_time_created"] or 0
+                worktree = row["project_worktree"] or ""
+                session_directory = row["session_directory"] or ""
+                project_source = worktree or session_directory
                 project_name = Path(project_source).name if project_source else "unknown"
 
                 if project_filter:
                     filter_value = project_filter.lower()
                     haystacks = [project_name.lower()]
-                    if entry["worktree"]:
-                        haystacks.append(entry["worktree"].lower())
-                    if entry["session_directory"]:
-                        haystacks.append(entry["session_directory"].lower())
+                    if worktree:
+                        haystacks.append(worktree.lower())
+                    if session_directory:
+                        haystacks.append(session_directory.lower())
                     if not any(filter_value in item for item in haystacks):
+                        if perf:
+                            perf.skip("project")
                         continue
 
-                messages.append({
-                    "text": text[:500],
-                    "timestamp": ts_to_iso(timestamp_ms) if timestamp_ms else "unknown",
-                    "timestamp_ms": timestamp_ms,
-                    "project": project_name or "unknown",
-                })
+                # マージ中はほかのDBの列が先に読み進むので、返す前に記録する
                 seen_message_ids.add(message_id)
+                yield Message(text[:500], timestamp_ms, project_name or "unknown")
         except sqlite3.Error:
-            continue
+            return
         finally:
             if conn:
                 conn.close()
+            if db_stats:
+                db_stats["rows"] = rows_read
+                stats.note("opencode", db_path.name, db_stats)
+            if perf:
+                perf.lines += rows_read
+                try:
+                    db_size = db_path.stat().st_size
+                except OSError:
+                    db_size = 0
+                perf.file(db_path, time.perf_counter() - started, db_size)
+
+    if ordered and len(db_paths) > 1:
+        yield from merge_by_time([read_db(db_path) for db_path in db_paths])
+        return
+    for db_path in db_paths:
+        if budget and budget.exhausted():
+            return
+        yield from read_db(db_path)
+
+
+# 出力JSONのソース順
+SOURCE_TOOLS = [
+    "Claude Code",
+    "GitHub Copilot Chat",
+    "Cline",
+    "Roo Code",
+    "Windsurf",
+    "Google Antigravity",
+    "OpenAI Codex",
+    "OpenCode",
+]
 
+
+# Copilot Chat / Cline / Roo Code / Windsurf / Antigravity はファイルの更新日時をタイムスタンプに使うため、
+# インデックスの同一性判定には時刻を含めない（再収集で時刻だけ変わっても重複させない）
+MTIME_TIMESTAMP_TOOLS = {"GitHub Copilot Chat", "Cline", "Roo Code", "Windsurf", "Google Antigravity"}
+# collect.py 本体で --project フィルタが効くソース（インデックスからの再出力で同じ挙動にするため）
+PROJECT_FILTERED_TOOLS = {"Claude Code", "OpenAI Codex", "OpenCode"}
+# 収集関数の件数の上限: ツール → (グループ（Message.container）ごとの取り込み元の数, 取り込み元ごとのメッセージ数)
+# watch デーモンは上限なしで取り込むので、インデックスから答えるときに同じ上限をかける
+SOURCE_CAPS = {
+    "Claude Code": (50, 100),
+    "Cline": (20, None),
+    "Roo Code": (20, None),
+    "Windsurf": (20, None),
+    "Google Antigravity": (10, None),
+    "OpenAI Codex": (50, 100),
+}
+
+
+def make_source_result(tool: str, messages: list[Message], complete: bool | None = None) -> dict:
+    """メッセージ一覧から1ソース分の結果（status, period 付き）を作る
+
+    complete は --budget-ms のときだけ渡す（締め切りまでに読み終えたかどうか）。
+    """
+    result = {"tool": tool, "status": "未検出", "messages": [], "period": ""}
     if messages:
         result["status"] = "検出"
         result["messages"] = messages
-        timestamps = [m["timestamp"] for m in messages if m["timestamp"] != "unknown"]
+        timestamps = [m.timestamp_ms for m in messages if m.timestamp_ms]
         if timestamps:
-            result["period"] = f"{min(timestamps)} 〜 {max(timestamps)}"
-
+            result["period"] = f"{ts_to_iso(min(timestamps))} 〜 {ts_to_iso(max(timestamps))}"
+    if complete is not None:
+        result["complete"] = complete
     return result
 
 
-def main():
-    parser = argparse.ArgumentParser(description="AI対話履歴を収集・整形して出力する")
-    parser.add_argument("--days", type=int, default=7, help="過去N日分に限定（デフォルト: 7日）")
-    parser.add_argument("--project", type=str, default=None, help="プロジェクト名でフィルタ（部分一致）")
-    args = parser.parse_args()
+def message_fingerprints(messages, occurrences: dict | None = None) -> Iterator[tuple[str, str, Message]]:
+    """(tool, msg) 列に同一性判定用のキーを付ける。同じ内容のメッセージが複数ある場合は出現順の番号で区別する
+
+    更新日時を時刻に使うソースは時刻を含めない（再収集で時刻だけ進んでも同じメッセージとみなす）。
+    1回の収集を分けて渡すときは、同じ occurrences を渡して出現順の番号を引き継ぐ。
+    """
+    if occurrences is None:
+        occurrences = {}
+    for tool, msg in messages:
+        ts_part = "" if tool in MTIME_TIMESTAMP_TOOLS else str(msg.timestamp_ms)
+        base = "\0".join([tool, msg.project, ts_part, msg.text])
+        n = occurrences.get(base, 0)
+        occurrences[base] = n + 1
+        yield tool, hashlib.blake2b(f"{base}\0{n}".encode("utf-8"), digest_size=16).hexdigest(), msg
+
+
+class PromptIndex:
+    """収集したメッセージの永続インデックス（SQLite、FTS5 trigram による全文検索）
+
+    日本語は単語境界がないため trigram トークナイザで部分一致検索する。
+    FTS5/trigram が使えない SQLite、または3文字未満の検索語では LIKE にフォールバックする。
+    (日付, プロジェクト, ツール) ごとの件数・文字数・シークレット検出数（rollups）を、新規のメッセージを追加するたびに積み上げる。
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS messages (
+            id INTEGER PRIMARY KEY,
+            fingerprint TEXT NOT NULL UNIQUE,
+            tool TEXT NOT NULL,
+            project TEXT NOT NULL,
+            timestamp_ms INTEGER NOT NULL,
+            text TEXT NOT NULL,
+            note TEXT,
+            container_group TEXT,
+            container TEXT
+        );
+        CREATE INDEX IF NOT EXISTS messages_timestamp_idx ON messages(timestamp_ms);
+        CREATE INDEX IF NOT EXISTS messages_tool_timestamp_idx ON messages(tool, timestamp_ms);
+        CREATE INDEX IF NOT EXISTS messages_project_idx ON messages(project);
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS rollups (
+            day TEXT NOT NULL,
+            project TEXT NOT NULL,
+            tool TEXT NOT NULL,
+            messages INTEGER NOT NULL,
+            chars INTEGER NOT NULL,
+            secret_hits INTEGER NOT NULL,
+            PRIMARY KEY (day, project, tool)
+        ) WITHOUT ROWID;
+    """
+    # rollups の集計方法を変えたら上げる（インデックスを開いたときに messages から作り直す）
+    ROLLUPS_VERSION = "1"
+    FTS_SCHEMA = """
+        CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+            text, content='messages', content_rowid='id', tokenize='trigram'
+        );
+        CREATE TRIGGER IF NOT EXISTS messages_ai AFTER INSERT ON messages BEGIN
+            INSERT INTO messages_fts(rowid, text) VALUES (new.id, new.text);
+        END;
+        CREATE TRIGGER IF NOT EXISTS messages_ad AFTER DELETE ON messages BEGIN
+            INSERT INTO messages_fts(messages_fts, rowid, text) VALUES ('delete', old.id, old.text);
+        END;
+    """
+
+    def __init__(self, path: Path):
+        path.parent.mkdir(parents=True, exist_ok=True, mode=0o700)
+        self.conn = sqlite3.connect(str(path))
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(messages)")}
+        if columns and "container" not in columns:
+            # 取り込み元の列がない古いインデックス（既存の行は件数の上限の対象外になる）
+            self.conn.execute("ALTER TABLE messages ADD COLUMN container_group TEXT")
+            self.conn.execute("ALTER TABLE messages ADD COLUMN container TEXT")
+        self.conn.executescript(self.SCHEMA)
+        try:
+            self.conn.executescript(self.FTS_SCHEMA)
+            self.has_fts = True
+        except sqlite3.OperationalError:
+            self.has_fts = False
+        self.conn.commit()
+        if self.get_meta("rollups_version") != self.ROLLUPS_VERSION:
+            self.rebuild_rollups()
+
+    def close(self):
+        self.conn.close()
+
+    def get_meta(self, key: str) -> str | None:
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, key: str, value: str | None):
+        """value が None ならキーを削除する"""
+        with self.conn:
+            if value is None:
+                self.conn.execute("DELETE FROM meta WHERE key = ?", (key,))
+            else:
+                self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    @staticmethod
+    def rollup_day(timestamp_ms: int) -> str:
+        """rollups の日付（UTC の YYYY-MM-DD、時刻不明なら unknown）"""
+        if not timestamp_ms:
+            return "unknown"
+        return datetime.fromtimestamp(timestamp_ms / 1000, tz=timezone.utc).strftime("%Y-%m-%d")
+
+    def _add_rollup(self, timestamp_ms: int, project: str, tool: str, text: str, sign: int = 1):
+        """1メッセージ分を rollups に加える（sign=-1 で取り消す）"""
+        self.conn.execute(
+            """INSERT INTO rollups (day, project, tool, messages, chars, secret_hits) VALUES (?, ?, ?, ?, ?, ?)
+               ON CONFLICT (day, project, tool) DO UPDATE SET
+                   messages = messages + excluded.messages,
+                   chars = chars + excluded.chars,
+                   secret_hits = secret_hits + excluded.secret_hits""",
+            (self.rollup_day(timestamp_ms), project, tool, sign, sign * len(text), sign * len(scan_secrets(text))),
+        )
+
+    def rebuild_rollups(self):
+        """rollups を messages から作り直す（既存のインデックスに rollups がない場合の移行用）"""
+        with self.conn:
+            self.conn.execute("DELETE FROM rollups")
+            for row in self.conn.execute("SELECT tool, project, timestamp_ms, text FROM messages").fetchall():
+                self._add_rollup(row["timestamp_ms"], row["project"], row["tool"], row["text"])
+            self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('rollups_version', ?)", (self.ROLLUPS_VERSION,))
+
+    def ingest(self, sources: list[dict]) -> int:
+        """収集結果を追加し、新規に追加した件数を返す"""
+        return self.ingest_messages((source["tool"], msg) for source in sources for msg in source["messages"])
+
+    def ingest_messages(self, messages, occurrences: dict | None = None) -> int:
+        """(tool, msg) 列を追加し、新規に追加した件数を返す（既存のメッセージは更新日時由来の時刻だけ進める）
+
+        1回の収集を何回かに分けて追加するときは、同じ occurrences を渡す（message_fingerprints を参照）。
+        """
+        added = 0
+        with self.conn:
+            for tool, fingerprint, msg in message_fingerprints(messages, occurrences):
+                timestamp_ms = msg.timestamp_ms
+                project = msg.project
+                container_group, container = msg.container or (None, None)
+                cursor = self.conn.execute(
+                    "INSERT OR IGNORE INTO messages (fingerprint, tool, project, timestamp_ms, text, note, container_group, container) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (fingerprint, tool, project, timestamp_ms, msg.text, msg.note, container_group, container),
+                )
+                if cursor.rowcount > 0:
+                    added += 1
+                    self._add_rollup(timestamp_ms, project, tool, msg.text)
+                elif tool in MTIME_TIMESTAMP_TOOLS:
+                    row = self.conn.execute("SELECT timestamp_ms FROM messages WHERE fingerprint = ?", (fingerprint,)).fetchone()
+                    if row["timestamp_ms"] < timestamp_ms:
+                        self.conn.execute("UPDATE messages SET timestamp_ms = ? WHERE fingerprint = ?", (timestamp_ms, fingerprint))
+                        # 時刻が進んだら集計も新しい日付へ移す
+                        if self.rollup_day(row["timestamp_ms"]) != self.rollup_day(timestamp_ms):
+                            self._add_rollup(row["timestamp_ms"], project, tool, msg.text, -1)
+                            self._add_rollup(timestamp_ms, project, tool, msg.text)
+        return added
+
+    def _select(self, text: str | None, since_ms: int | None, until_ms: int | None, tool: str | None, project: str | None, keep_unknown_time: bool = False) -> tuple[str, list]:
+        """検索条件から FROM 句以降のSQLとパラメータを組み立てる"""
+        sql = "FROM messages m"
+        clauses, params = [], []
+        if text:
+            if self.has_fts and len(text) >= 3:
+                # フレーズとして渡し、trigram で部分一致させる
+                sql += " JOIN messages_fts f ON f.rowid = m.id"
+                clauses.append("messages_fts MATCH ?")
+                params.append('"' + text.replace('"', '""') + '"')
+            else:
+                escaped = text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+                clauses.append("m.text LIKE ? ESCAPE '\\'")
+                params.append(f"%{escaped}%")
+        if since_ms:
+            # collect.py 本体と同様、時刻不明（0）のメッセージはカットオフで落とさない
+            clauses.append("(m.timestamp_ms >= ? OR m.timestamp_ms = 0)" if keep_unknown_time else "m.timestamp_ms >= ?")
+            params.append(since_ms)
+        if until_ms:
+            clauses.append("m.timestamp_ms < ?")
+            params.append(until_ms)
+        if tool:
+            clauses.append("m.tool = ?")
+            params.append(tool)
+        if project:
+            clauses.append("instr(lower(m.project), lower(?)) > 0")
+            params.append(project)
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        return sql, params
+
+    @staticmethod
+    def _to_message(row) -> Message:
+        return Message(row["text"], row["timestamp_ms"], row["project"], row["note"] or None)
+
+    def search(self, text: str | None, since_ms: int | None, until_ms: int | None, tool: str | None, project: str | None, limit: int) -> list[dict]:
+        """全文・期間・ツール・プロジェクトで検索し、新しい順に返す"""
+        sql, params = self._select(text, since_ms, until_ms, tool, project)
+        rows = self.conn.execute(f"SELECT m.* {sql} ORDER BY m.timestamp_ms DESC LIMIT ?", params + [limit])
+        return [{"tool": row["tool"], **self._to_message(row).to_dict()} for row in rows]
+
+    def rollups(self, unit: str, since_ms: int | None, until_ms: int | None, tool: str | None, project: str | None) -> list[dict]:
+        """rollups を日（day）または週（week、月曜始まり）ごとに返す。時刻不明の分は period=unknown"""
+        period = "day" if unit == "day" else "CASE WHEN day = 'unknown' THEN day ELSE date(day, 'weekday 0', '-6 days') END"
+        clauses, params = [], []
+        if since_ms:
+            clauses.append("day >= ? AND day != 'unknown'")
+            params.append(self.rollup_day(since_ms))
+        if until_ms:
+            # until は「この日時より前」なので、その日を含むかどうかは時刻で決まる
+            clauses.append("day <= ? AND day != 'unknown'")
+            params.append(self.rollup_day(until_ms - 1))
+        if tool:
+            clauses.append("tool = ?")
+            params.append(tool)
+        if project:
+            clauses.append("instr(lower(project), lower(?)) > 0")
+            params.append(project)
+        where = " WHERE " + " AND ".join(clauses) if clauses else ""
+        rows = self.conn.execute(
+            f"""SELECT {period} AS period, project, tool,
+                       sum(messages) AS messages, sum(chars) AS chars, sum(secret_hits) AS secret_hits
+                FROM rollups{where}
+                GROUP BY 1, 2, 3
+                HAVING sum(messages) > 0
+                ORDER BY 1, 2, 3""",
+            params,
+        )
+        return [dict(row) for row in rows]
+
+    def emit_sources(self, since_ms: int | None, until_ms: int | None, project: str | None, text: str | None = None, ordered: bool = False, capped: bool = False) -> list[dict]:
+        """collect.py 本体の sources と同じ形の結果をインデックスから組み立てる（ordered ならソースごとに時刻順）
+
+        capped なら収集関数と同じ件数の上限（SOURCE_CAPS）をかける。
+        """
+        sources = []
+        order = "m.timestamp_ms, m.id" if ordered else "m.id"
+        for tool in SOURCE_TOOLS:
+            sql, params = self._select(text, since_ms, until_ms, tool, project if tool in PROJECT_FILTERED_TOOLS else None, keep_unknown_time=True)
+            rows = self.conn.execute(f"SELECT m.* {sql} ORDER BY {order}", params)
+            if capped and tool in SOURCE_CAPS:
+                kept = self._capped_ids(tool, since_ms, until_ms)
+                rows = [row for row in rows if row["container"] is None or row["id"] in kept]
+            sources.append(make_source_result(tool, [self._to_message(row) for row in rows]))
+        return sources
+
+    def _capped_ids(self, tool: str, since_ms: int | None, until_ms: int | None) -> set[int]:
+        """取り込み元のあるメッセージのうち、収集関数の件数の上限に収まるものの id
+
+        取り込み元はグループごとに新しい順に選ぶ。新しさはファイルの更新日時の代わりに、取り込み元の最新のメッセージの時刻で比べる。
+        取り込み元ごとのメッセージは、収集関数と同じく期間内の古い順に数える（プロジェクトで絞る前に数える）。
+        """
+        per_group, per_container = SOURCE_CAPS[tool]
+        groups = {}
+        for group, container, latest_ms in self.conn.execute(
+            "SELECT container_group, container, MAX(timestamp_ms) FROM messages WHERE tool = ? AND container IS NOT NULL GROUP BY container_group, container",
+            (tool,),
+        ):
+            groups.setdefault(group, []).append((latest_ms, container))
+        containers = {container for candidates in groups.values() for _, container in heapq.nlargest(per_group, candidates)}
+
+        sql, params = self._select(None, since_ms, until_ms, tool, None, keep_unknown_time=True)
+        counts = {}
+        kept = set()
+        for row in self.conn.execute(f"SELECT m.id, m.container {sql} AND m.container IS NOT NULL ORDER BY m.timestamp_ms, m.id", params):
+            container = row["container"]
+            if container not in containers:
+                continue
+            n = counts.get(container, 0)
+            if per_container is None or n < per_container:
+                counts[container] = n + 1
+                kept.add(row["id"])
+        return kept
 
-    # カットオフ算出
-    cutoff_ms = None
-    if args.days and args.days > 0:
-        cutoff_dt = datetime.now(tz=timezone.utc) - timedelta(days=args.days)
-        cutoff_ms = int(cutoff_dt.timestamp() * 1000)
-
-    # 各ソースから収集
-    sources = [
-        collect_claude_code(cutoff_ms, args.project),
-        collect_copilot_chat(cutoff_ms, args.project),
-        collect_cline(cutoff_ms),
-        collect_roo_code(cutoff_ms),
-        collect_windsurf(cutoff_ms),
-        collect_antigravity(cutoff_ms),
-        collect_codex(cutoff_ms, args.project),
-        collect_opencode(cutoff_ms, args.project),
-    ]
 
-    # サマリー生成
-    total_messages = sum(len(s["messages"]) for s in sources)
-    detected = [s["tool"] for s in sources if s["status"] == "検出"]
+def iter_source_events(tool: str, stream, budget: SourceBudget | None = None) -> Iterator[tuple]:
+    """1ソース分の収集をイベント列にする。例外は他のソースに波及させず、エラー終了イベントとして返す
 
-    output = {
-        "summary": {
-            "total_messages": total_messages,
-            "detected_tools": detected,
-            "filter_days": args.days,
-            "filter_project": args.project,
-            "collected_at": datetime.now(tz=timezone.utc).strftime("%Y-%m-%d %H:%M UTC"),
-        },
-        "sources": sources,
-    }
+    イベントは ("message", tool, msg) と、最後に1つの ("end", tool, failure)。
+    failure は正常終了なら None、失敗時は {"status": ..., "error": ...}。
+    budget を渡すと、正常終了の直前に ("budget", tool, {"complete": 締め切りまでに読み終えたか}) を返す。
+    """
+    try:
+        for msg in stream():
+            yield "message", tool, msg
+    except Exception as e:
+        yield "end", tool, {"status": "エラー", "error": f"{type(e).__name__}: {e}"}
+        return
+    if budget is not None:
+        yield "budget", tool, {"complete": not budget.truncated}
+    yield "end", tool, None
+
+
+# 並行収集でワーカーが溜めておけるイベント数（出力が詰まったら収集側を待たせる）
+EVENT_QUEUE_SIZE = 1024
+
+
+def iter_events_concurrently(collectors: list, workers: int, timeout: float | None, budget: Budget | None = None) -> Iterator[tuple]:
+    """(tool, stream) のリストをスレッドで並行実行し、イベントを届いた順に返す
+
+    timeout は各収集関数の開始からの秒数。超過したものはタイムアウトで終了させ（以降のイベントは捨てる）、
+    残りのソースを待たせないよう代わりのワーカーを補充する。
+    ワーカーはデーモンスレッドなので、タイムアウトした収集関数が終了を妨げることはない。
+    """
+    pending = queue.Queue()
+    for i, (tool, stream) in enumerate(collectors):
+        pending.put((i, tool, stream))
+    events = queue.Queue(maxsize=EVENT_QUEUE_SIZE)
+
+    def worker():
+        while True:
+            try:
+                i, tool, stream = pending.get_nowait()
+            except queue.Empty:
+                return
+            events.put(("start", i, time.monotonic()))
+            for kind, _, payload in iter_source_events(tool, stream, budget.source(tool) if budget else None):
+                events.put((kind, i, payload))
+
+    def spawn_worker():
+        threading.Thread(target=worker, daemon=True).start()
+
+    for _ in range(max(1, min(workers, len(collectors)))):
+        spawn_worker()
+
+    started = {}
+    finished = set()
+    while len(finished) < len(collectors):
+        wait = None
+        if timeout:
+            now = time.monotonic()
+            for i, started_at in list(started.items()):
+                if i in finished:
+                    continue
+                remaining = started_at + timeout - now
+                if remaining <= 0:
+                    finished.add(i)
+                    yield "end", collectors[i][0], {"status": "タイムアウト", "error": f"{timeout}秒以内に完了しませんでした"}
+                    spawn_worker()
+                elif wait is None or remaining < wait:
+                    wait = remaining
+            if len(finished) == len(collectors):
+                break
+        try:
+            kind, i, payload = events.get(timeout=wait)
+        except queue.Empty:
+            continue
+        if i in finished:
+            continue
+        if kind == "start":
+            started[i] = payload
+            continue
+        if kind == "end":
+            finished.add(i)
+        yield kind, collectors[i][0], payload
+
+
+def iter_events_timeline(event_streams: list) -> Iterator[tuple]:
+    """ソースごとのイベント列（メッセージは時刻の古い順）を heapq.merge で時刻順の1本にまとめる
 
-    # シークレット検出
-    secret_warnings = []
+    各ソースは次に返すメッセージの分だけ読み進めるので、ソースをまたいだ並べ替えのためにメッセージを溜めない。
+    終了イベント（budget, end）は、すべてのメッセージのあとにソースの順で返す。
+    """
+    tails = [[] for _ in event_streams]
+
+    def messages(i, events):
+        for event in events:
+            if event[0] == "message":
+                yield event
+            else:
+                tails[i].append(event)
+
+    yield from heapq.merge(*(messages(i, events) for i, events in enumerate(event_streams)), key=lambda event: event[2].timestamp_ms)
+    for tail in tails:
+        yield from tail
+
+
+def iter_events_budgeted(collectors: list, budget: Budget) -> Iterator[tuple]:
+    """(tool, stream) のリストを1スレッドで時分割し、締め切りまでイベントを返す（--budget-ms の逐次収集）
+
+    それまでに使った時間が最も少ないソースを1イベントずつ進めるので、遅いソースが他のソースを待たせない。
+    締め切りを過ぎたら、開始済みのソースは読みかけのファイルの分だけ返させ（次のファイルの前で収集関数が止まる）、
+    まだ始まっていないソースは complete=False で終了させる。
+    """
+    # (使った秒数, collectors 内の順序, tool, イベント列) のヒープ
+    runnable = [(0.0, order, tool, iter_source_events(tool, stream, budget.source(tool))) for order, (tool, stream) in enumerate(collectors)]
+    heapq.heapify(runnable)
+    started_tools = set()
+    while runnable:
+        if budget.expired():
+            for _, _, tool, events in sorted(runnable, key=lambda item: item[1]):
+                if tool in started_tools:
+                    yield from events
+                    continue
+                events.close()
+                budget.source(tool).truncated = True
+                yield "budget", tool, {"complete": False}
+                yield "end", tool, None
+            return
+        used, order, tool, events = runnable[0]
+        started_tools.add(tool)
+        started = time.perf_counter()
+        event = next(events)
+        used += time.perf_counter() - started
+        if event[0] == "end":
+            heapq.heappop(runnable)
+        else:
+            heapq.heapreplace(runnable, (used, order, tool, events))
+        yield event
+
+
+def compute_cutoff_ms(days: int | None) -> int | None:
+    """過去N日のカットオフ（epochミリ秒）。0以下・未指定なら None（全期間）"""
+    if days and days > 0:
+        cutoff_dt = datetime.now(tz=timezone.utc) - timedelta(days=days)
+        return int(cutoff_dt.timestamp() * 1000)
+    return None
+
+
+def iter_collected_events(args, cutoff_ms: int | None, project_filter: str | None, profiler: Profiler | None = None) -> Iterator[tuple]:
+    """全ソースから収集し、メッセージ単位のイベントを返す（--jobs 1 なら SOURCE_TOOLS の順）
+
+    profiler を渡すと、ソースごとの計測値を profiler.sources に記録する。
+    --budget-ms を指定すると件数の上限をなくし、締め切りまで各ソースを新しい順に読む。
+    ソースごとに、終了イベントの直前で読み終えたかどうかを ("budget", tool, {"complete": ...}) で返す。
+    --timeline ならメッセージをソースをまたいで時刻の古い順に返し、終了イベントは最後にまとめて返す。
+    """
+    # 追記型ログ（history.jsonl, セッションJSONL, rollout）は前回の解析位置から再開する
+    checkpoints = CheckpointStore(None if args.no_cache else (args.cache_dir or get_cache_dir()) / "checkpoints.sqlite3")
+
+    stats = ScanStats()
+
+    budget = Budget(args.budget_ms) if args.budget_ms is not None else None
+    collectors = build_collectors(args, cutoff_ms, project_filter, checkpoints, stats, profiler, budget)
+    if args.timeline:
+        # 各ソースを1スレッドで少しずつ読み進めながらマージする（--jobs は使わない）
+        yield from iter_events_timeline([iter_source_events(tool, stream) for tool, stream in collectors])
+    elif args.jobs > 1:
+        yield from iter_events_concurrently(collectors, args.jobs, args.timeout, budget)
+    elif budget:
+        yield from iter_events_budgeted(collectors, budget)
+    else:
+        for tool, stream in collectors:
+            yield from iter_source_events(tool, stream)
+    checkpoints.save()
+    if args.scan_stats:
+        print(json.dumps({"scan_stats": stats.counts}, ensure_ascii=False), file=sys.stderr)
+
+
+def build_collectors(args, cutoff_ms: int | None, project_filter: str | None, checkpoints: CheckpointStore, stats: ScanStats, profiler: Profiler | None = None, budget: Budget | None = None) -> list:
+    """(tool, 収集関数) のリストを SOURCE_TOOLS の順に返す"""
+
+    def perf(tool: str) -> SourceProfile | None:
+        return profiler.source(tool) if profiler else None
+
+    def limit(tool: str) -> SourceBudget | None:
+        return budget.source(tool) if budget else None
+
+    collectors = [
+        ("Claude Code", partial(iter_claude_code, cutoff_ms, project_filter, checkpoints, args.parse_workers, stats, not args.no_seek, args.prune_dirs, perf("Claude Code"), limit("Claude Code"), args.timeline)),
+        ("GitHub Copilot Chat", partial(iter_copilot_chat, cutoff_ms, project_filter, perf("GitHub Copilot Chat"), limit("GitHub Copilot Chat"), args.timeline)),
+        ("Cline", partial(iter_cline, cutoff_ms, perf("Cline"), limit("Cline"), args.timeline)),
+        ("Roo Code", partial(iter_roo_code, cutoff_ms, perf("Roo Code"), limit("Roo Code"), args.timeline)),
+        ("Windsurf", partial(iter_windsurf, cutoff_ms, args.prune_dirs, perf("Windsurf"), limit("Windsurf"), checkpoints, args.timeline)),
+        ("Google Antigravity", partial(iter_antigravity, cutoff_ms, args.prune_dirs, perf("Google Antigravity"), limit("Google Antigravity"), checkpoints, args.timeline)),
+        ("OpenAI Codex", partial(iter_codex, cutoff_ms, project_filter, checkpoints, stats, args.prune_dirs, perf("OpenAI Codex"), limit("OpenAI Codex"), not args.no_partition_prune, args.timeline)),
+        # インデックスの有無の確認は --scan-stats のときだけ（出力しないのに毎回 PRAGMA を発行しない）
+        ("OpenCode", partial(iter_opencode, cutoff_ms, project_filter, stats if args.scan_stats else None, perf("OpenCode"), limit("OpenCode"), args.timeline)),
+    ]
+    if profiler:
+        collectors = [(tool, profiler.source(tool).wrap(stream)) for tool, stream in collectors]
+    return collectors
+
+
+def failed_source_result(tool: str, failure: dict) -> dict:
+    return {"tool": tool, "status": failure["status"], "messages": [], "period": "", "error": failure["error"]}
+
+
+def collect_sources(args, cutoff_ms: int | None, project_filter: str | None, profiler: Profiler | None = None) -> list[dict]:
+    """全ソースから収集し、SOURCE_TOOLS の順に結果を返す"""
+    messages = {tool: [] for tool in SOURCE_TOOLS}
+    complete = {}
+    results = {}
+    for kind, tool, payload in iter_collected_events(args, cutoff_ms, project_filter, profiler):
+        if kind == "message":
+            messages[tool].append(payload)
+        elif kind == "budget":
+            complete[tool] = payload["complete"]
+        elif payload is None:
+            results[tool] = make_source_result(tool, messages.pop(tool), complete.get(tool))
+        else:
+            # エラー・タイムアウトしたソースは途中までのメッセージも出さない
+            del messages[tool]
+            results[tool] = failed_source_result(tool, payload)
+    return [results[tool] for tool in SOURCE_TOOLS]
+
+
+def _collect_root(args, root: Path, cutoff_ms: int | None, project_filter: str | None) -> tuple[list[dict], dict | None]:
+    """--root の1つ分を収集する（ワーカープロセスで実行）
+
+    ホームと各ツールの保存先を指す環境変数を root に差し替えてから collect_sources を呼び、
+    ソースごとにメッセージを時刻順に並べて返す。--profile なら計測結果も返す。
+    """
+    os.environ["HOME"] = os.environ["USERPROFILE"] = str(root)
+    os.environ["APPDATA"] = str(root / "AppData" / "Roaming")
+    os.environ["CODEX_HOME"] = str(root / ".codex")
+    os.environ["XDG_DATA_HOME"] = str(root / ".local" / "share")
+    profiler = Profiler(args.profile) if args.profile is not None else None
+    sources = collect_sources(args, cutoff_ms, project_filter, profiler)
     for source in sources:
-        for msg in source["messages"]:
-            findings = scan_secrets(msg["text"])
-            if findings:
-                for f in findings:
-                    secret_warnings.append({
-                        "tool": source["tool"],
-                        "project": msg.get("project", "unknown"),
-                        "timestamp": msg.get("timestamp", "unknown"),
-                        "type": f["type"],
-                        "masked_value": f["masked_value"],
-                        "prompt_excerpt": msg["text"][:80].replace("\n", " "),
-                    })
-    output["secret_warnings"] = secret_warnings
-
-    # プロジェクト別集計
-    project_stats = {}
+        source["messages"].sort(key=lambda msg: msg.timestamp_ms)
+    return sources, profiler.report() if profiler else None
+
+
+def collect_roots(args, cutoff_ms: int | None, project_filter: str | None, profiler: Profiler | None = None) -> list[dict]:
+    """--root ごとに別プロセスで全ソースを収集し、SOURCE_TOOLS の順に結果を返す
+
+    ルートの数（CPUコア数まで）のプロセスで並行して収集し、ソースごとに各ルートの時刻順の列を k-way マージする。
+    同じメッセージ（同一性はインデックスと同じ）が複数のルートにあれば1件にまとめる（同じルート内の繰り返しは残す）。
+    チェックポイントはルートごとに分け、ルートの中には書き込まない。
+    """
+    roots = args.root
+    cache_dir = (args.cache_dir or get_cache_dir()) / "roots"
+    if not args.no_cache:
+        # ルートごとのディレクトリの親も、通常のキャッシュと同じくほかのユーザーから読めないようにする
+        cache_dir.parent.mkdir(parents=True, exist_ok=True, mode=0o700)
+        cache_dir.mkdir(exist_ok=True, mode=0o700)
+    workers = max(1, min(len(roots), os.cpu_count() or 1))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = []
+        for root in roots:
+            root_key = hashlib.blake2b(str(root.resolve()).encode("utf-8"), digest_size=8).hexdigest()
+            # セッションJSONLの解析プロセスはルートのワーカーで分け合う
+            root_args = argparse.Namespace(**{**vars(args), "cache_dir": cache_dir / root_key,
+                                              "parse_workers": max(1, args.parse_workers // workers)})
+            futures.append(pool.submit(_collect_root, root_args, root, cutoff_ms, project_filter))
+        results = [future.result() for future in futures]
+
+    if profiler is not None:
+        profiler.roots = {str(root): report for root, (_, report) in zip(roots, results)}
+
+    merged = []
+    for i, tool in enumerate(SOURCE_TOOLS):
+        collected = [(root, sources[i]) for root, (sources, _) in zip(roots, results)]
+        succeeded = [source for _, source in collected if "error" not in source]
+        errors = {str(root): source["error"] for root, source in collected if "error" in source}
+        if not succeeded:
+            failed = collected[0][1]
+            merged.append(failed_source_result(tool, {"status": failed["status"], "error": "; ".join(f"{root}: {error}" for root, error in errors.items())}))
+            continue
+
+        streams = [message_fingerprints((tool, msg) for msg in source["messages"]) for source in succeeded]
+        seen = set()
+        messages = []
+        for _, fingerprint, msg in heapq.merge(*streams, key=lambda item: item[2].timestamp_ms):
+            if fingerprint in seen:
+                continue
+            seen.add(fingerprint)
+            messages.append(msg)
+        complete = [source["complete"] for source in succeeded if "complete" in source]
+        result = make_source_result(tool, messages, all(complete) if complete else None)
+        if errors:
+            result["errors"] = errors
+        merged.append(result)
+    return merged
+
+
+class NearDuplicateIndex:
+    """MinHash/LSH によるメッセージの近似重複判定（ソースをまたいで、出力順に1件ずつ追加する）
+
+    シグネチャは one permutation hashing（文字 n-gram の crc32 を BUCKETS 個のバケットに振り分け、
+    バケットごとの最小値を取る）で、n-gram ごとのハッシュ計算は1回だけ。
+    BANDS 個のバンドのいずれかが一致した既存クラスタの代表と、シグネチャの一致率が THRESHOLD 以上なら重複とする。
+    代表とだけ比較するので、処理時間はメッセージ数にほぼ比例する。
+    """
+
+    SHINGLE_CHARS = 5
+    BUCKETS = 32
+    BANDS = 4
+    THRESHOLD = 0.8
+    # これより短い（正規化後の文字数）メッセージは「y」「続けて」のような定型入力なので対象にしない
+    MIN_CHARS = 20
+
+    def __init__(self, mode: str):
+        self.mode = mode
+        self.position = 0
+        self.clusters = 0
+        self.duplicates = 0
+        self._exact = {}
+        self._bands = [{} for _ in range(self.BANDS)]
+        self._signatures = {}
+        self._clustered = set()
+
+    @classmethod
+    def signature(cls, text: str) -> tuple[int, ...]:
+        # n-gram の切り出しとハッシュは zip / map で回す（1文字ずつの Python ループより速い）
+        shingles = set(map("".join, zip(*(text[i:] for i in range(cls.SHINGLE_CHARS))))) or {text}
+        hashes = sorted(map(zlib.crc32, map(str.encode, shingles)))
+        buckets = cls.BUCKETS
+        mins = [None] * buckets
+        filled = 0
+        # 昇順に見て、各バケットで最初に現れた値がそのバケットの最小値
+        for h in hashes:
+            b = h % buckets
+            if mins[b] is None:
+                mins[b] = h
+                filled += 1
+                if filled == buckets:
+                    break
+        if filled < buckets:
+            # 空のバケットは右隣（循環）の値で埋める（densification）
+            for b in range(buckets):
+                if mins[b] is None:
+                    k = 1
+                    while mins[(b + k) % buckets] is None:
+                        k += 1
+                    mins[b] = mins[(b + k) % buckets] ^ (k * 0x9E3779B1 & 0xFFFFFFFF)
+        return tuple(mins)
+
+    def add(self, text: str) -> int | None:
+        """メッセージを追加する。既存クラスタの重複ならその代表の位置（追加順の通し番号）を返す"""
+        position = self.position
+        self.position += 1
+        normalized = " ".join(text.casefold().split())
+        if len(normalized) < self.MIN_CHARS:
+            return None
+
+        digest = hashlib.blake2b(normalized.encode("utf-8"), digest_size=16).digest()
+        if digest in self._exact:
+            return self._duplicate_of(self._exact[digest])
+
+        sig = self.signature(normalized)
+        rows = self.BUCKETS // self.BANDS
+        keys = [hash(sig[i * rows:(i + 1) * rows]) for i in range(self.BANDS)]
+        for band, key in zip(self._bands, keys):
+            leader = band.get(key)
+            if leader is None:
+                continue
+            leader_sig = self._signatures[leader]
+            same = sum(1 for a, b in zip(sig, leader_sig) if a == b)
+            if same >= self.THRESHOLD * self.BUCKETS:
+                self._exact[digest] = leader
+                return self._duplicate_of(leader)
+
+        self._exact[digest] = position
+        self._signatures[position] = sig
+        for band, key in zip(self._bands, keys):
+            band.setdefault(key, position)
+        return None
+
+    def _duplicate_of(self, leader: int) -> int:
+        if leader not in self._clustered:
+            self._clustered.add(leader)
+            self.clusters += 1
+        self.duplicates += 1
+        return leader
+
+    def summary(self) -> dict:
+        return {"mode": self.mode, "clusters": self.clusters, "duplicates": self.duplicates}
+
+
+class OutputSummary:
+    """シークレット検出とプロジェクト別集計をメッセージ単位で積み上げる
+
+    keep_warnings=False なら検出結果を溜めずに add の戻り値で返すだけにする（標本にするときは呼び出し側が選ぶ）。
+    """
+
+    def __init__(self, keep_warnings: bool = True):
+        self.total_messages = 0
+        self.secret_warnings = []
+        self.keep_warnings = keep_warnings
+        self._project_stats = {}
+
+    def add(self, tool: str, msg: Message) -> list[dict]:
+        """msg を集計に足し、msg から検出したシークレットの警告を返す"""
+        self.total_messages += 1
+        warnings = [{
+            "tool": tool,
+            "project": msg.project,
+            "timestamp": msg.timestamp,
+            "type": f["type"],
+            "masked_value": f["masked_value"],
+            "prompt_excerpt": msg.text[:80].replace("\n", " "),
+        } for f in scan_secrets(msg.text)]
+        if self.keep_warnings:
+            self.secret_warnings.extend(warnings)
+
+        proj = msg.project
+        if proj not in self._project_stats:
+            self._project_stats[proj] = {"count": 0, "tools": set()}
+        self._project_stats[proj]["count"] += 1
+        self._project_stats[proj]["tools"].add(tool)
+        return warnings
+
+    def project_stats(self) -> dict:
+        # setはJSON化できないのでlistに変換
+        return {
+            k: {"count": v["count"], "tools": list(v["tools"])}
+            for k, v in sorted(self._project_stats.items(), key=lambda x: -x[1]["count"])
+        }
+
+
+class StratifiedSampler:
+    """--max-messages / --max-bytes: (ツール, プロジェクト) を層とする層別リザーバサンプリング
+
+    メッセージごとに一様乱数のキーを振り、層ごとにキーの小さいものを残す（bottom-k なので、残った分は層の中の一様な標本）。
+    件数・バイト数が上限を超えたら、その時点で最も多く残している層からキーが最大のものを捨てる。
+    これで各層の残り件数は max-min 公平になる（小さい層は全部残り、大きい層は同じ件数にそろう）。
+    上限は全体で一定なので層の取り分は減る一方で、捨てたメッセージが後から必要になることはない。
+    保持するのは残っている分だけなので、メモリ使用量は上限で決まる。
+    バイト数にはメッセージ自身の secret_warnings も含め、出力に残す警告は残ったメッセージの分だけにする。
+    """
+
+    def __init__(self, max_messages: int | None, max_bytes: int | None, seed: int = 0):
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes
+        self.rnd = random.Random(seed)
+        self.strata = {}  # (tool, project) -> [(-key, 通し番号, バイト数, msg, 警告)]（キーの最大が先頭のヒープ）
+        self._sizes = []  # (-残り件数, 層)。古くなったエントリは取り出すときに読み飛ばす
+        self.seen = {}  # tool -> 受け取った件数
+        self.count = 0
+        self.kept = 0
+        self.kept_bytes = 0
+        self.reserved_bytes = 0  # メッセージ以外の出力（project_stats）に取っておくバイト数
+        self.warning_types = {}  # type -> 受け取った警告の件数
+
+    @staticmethod
+    def message_bytes(msg: Message, warnings: list[dict] = ()) -> int:
+        """出力JSONでのおおよそのバイト数（メッセージと、その secret_warnings）"""
+        return len(json.dumps([msg.to_dict(), *warnings], ensure_ascii=False).encode("utf-8"))
+
+    def add(self, tool: str, msg: Message, warnings: list[dict] = ()):
+        self.count += 1
+        self.seen[tool] = self.seen.get(tool, 0) + 1
+        for warning in warnings:
+            self.warning_types[warning["type"]] = self.warning_types.get(warning["type"], 0) + 1
+        nbytes = self.message_bytes(msg, warnings)
+        stratum = (tool, msg.project)
+        heap = self.strata.setdefault(stratum, [])
+        heapq.heappush(heap, (-self.rnd.random(), self.count, nbytes, msg, list(warnings)))
+        self.kept += 1
+        self.kept_bytes += nbytes
+        self._push_size(stratum)
+        while self.kept and self._over():
+            self._evict()
+
+    def _over(self) -> bool:
+        return ((self.max_messages is not None and self.kept > self.max_messages)
+                or (self.max_bytes is not None and self.kept_bytes + self.reserved_bytes > self.max_bytes))
+
+    def reserve(self, nbytes: int):
+        """--max-bytes のうち nbytes をメッセージ以外の出力に回し、超えた分を間引く"""
+        self.reserved_bytes += nbytes
+        while self.kept and self._over():
+            self._evict()
+
+    def _push_size(self, stratum: tuple):
+        heapq.heappush(self._sizes, (-len(self.strata[stratum]), stratum))
+        # 古いエントリが溜まったら作り直す（層の数に比例する大きさに保つ）
+        if len(self._sizes) > 2 * len(self.strata) + 64:
+            self._sizes = [(-len(heap), stratum) for stratum, heap in self.strata.items() if heap]
+            heapq.heapify(self._sizes)
+
+    def _evict(self):
+        while True:
+            size, stratum = heapq.heappop(self._sizes)
+            heap = self.strata[stratum]
+            if heap and -size == len(heap):
+                break
+        nbytes = heapq.heappop(heap)[2]
+        self.kept -= 1
+        self.kept_bytes -= nbytes
+        if heap:
+            self._push_size(stratum)
+
+    def discard(self, tool: str):
+        """エラー・タイムアウトしたソースの分を捨てる"""
+        for stratum in [stratum for stratum in self.strata if stratum[0] == tool]:
+            heap = self.strata.pop(stratum)
+            self.kept -= len(heap)
+            self.kept_bytes -= sum(item[2] for item in heap)
+        self.seen.pop(tool, None)
+        self._sizes = [(-len(heap), stratum) for stratum, heap in self.strata.items() if heap]
+        heapq.heapify(self._sizes)
+
+    def messages(self, tool: str) -> list[Message]:
+        """tool の残ったメッセージを受け取った順に返す"""
+        items = [item for stratum, heap in self.strata.items() if stratum[0] == tool for item in heap]
+        items.sort(key=lambda item: item[1])
+        return [item[3] for item in items]
+
+    def secret_warnings(self) -> list[dict]:
+        """残ったメッセージの secret_warnings を受け取った順に返す"""
+        items = sorted((item for heap in self.strata.values() for item in heap), key=lambda item: item[1])
+        return [warning for item in items for warning in item[4]]
+
+    def summary(self) -> dict:
+        return {
+            "max_messages": self.max_messages,
+            "max_bytes": self.max_bytes,
+            "seen": self.count,
+            "kept": self.kept,
+            "kept_bytes": self.kept_bytes + self.reserved_bytes,
+            "strata": sum(1 for heap in self.strata.values() if heap),
+            "secret_warnings": dict(sorted(self.warning_types.items())),
+        }
+
+
+def collect_sampled(events, sampler: StratifiedSampler, summary: OutputSummary, index: "PromptIndex | None" = None) -> list[dict]:
+    """イベント列を1回だけ読み、メッセージを summary（シークレット検出・プロジェクト別集計）と sampler に通す
+
+    全件を保持せずに、SOURCE_TOOLS の順で標本だけの結果を返す。各ソースに sampled（受け取った件数・残した件数）を付ける。
+    summary.secret_warnings には残ったメッセージの分だけを入れる（全件の種類別の件数は sampler.summary() に出る）。
+    project_stats の分のバイト数は、最後に --max-bytes から差し引いて間引き直す。
+    index を渡すと、標本ではなく全件を追加する。
+    """
+    complete = {}
+    failures = {}
+    pending_index = []
+    occurrences = {}
+    for kind, tool, payload in events:
+        if kind == "message":
+            sampler.add(tool, payload, summary.add(tool, payload))
+            if index is not None:
+                pending_index.append((tool, payload))
+                if len(pending_index) >= NDJSON_FLUSH_EVERY:
+                    index.ingest_messages(pending_index, occurrences)
+                    pending_index.clear()
+        elif kind == "budget":
+            complete[tool] = payload["complete"]
+        elif payload is not None:
+            sampler.discard(tool)
+            failures[tool] = payload
+    if index is not None and pending_index:
+        index.ingest_messages(pending_index, occurrences)
+
+    sampler.reserve(len(json.dumps(summary.project_stats(), ensure_ascii=False).encode("utf-8")))
+    summary.secret_warnings = sampler.secret_warnings()
+
+    # 後から来たメッセージで先に終わったソースの分も間引かれるので、結果は最後に組み立てる
+    results = []
+    for tool in SOURCE_TOOLS:
+        if tool in failures:
+            results.append(failed_source_result(tool, failures[tool]))
+            continue
+        messages = sampler.messages(tool)
+        result = make_source_result(tool, messages, complete.get(tool))
+        seen = sampler.seen.get(tool, 0)
+        if seen:
+            result["status"] = "検出"
+            result["sampled"] = {"seen": seen, "kept": len(messages)}
+        results.append(result)
+    return results
+
+
+def apply_near_duplicates(sources: list[dict], near_dup: NearDuplicateIndex) -> list[dict]:
+    """出力順にメッセージを near_dup に追加し、重複には代表の通し番号（near_dup_of）を付ける。collapse なら重複を除く"""
+    result = []
     for source in sources:
+        if source["status"] != "検出":
+            result.append(source)
+            continue
+        kept = []
         for msg in source["messages"]:
-            proj = msg.get("project", "unknown")
-            if proj not in project_stats:
-                project_stats[proj] = {"count": 0, "tools": set()}
-            project_stats[proj]["count"] += 1
-            project_stats[proj]["tools"].add(source["tool"])
-    # setはJSON化できないのでlistに変換
-    output["project_stats"] = {
-        k: {"count": v["count"], "tools": list(v["tools"])}
-        for k, v in sorted(project_stats.items(), key=lambda x: -x[1]["count"])
+            dup_of = near_dup.add(msg.text)
+            if dup_of is None:
+                kept.append(msg)
+            elif near_dup.mode == "annotate":
+                kept.append(msg.annotated(dup_of))
+        deduped = make_source_result(source["tool"], kept, source.get("complete"))
+        if "sampled" in source:
+            deduped["status"] = source["status"]
+            deduped["sampled"] = source["sampled"]
+        result.append(deduped)
+    return result
+
+
+def build_summary(total_messages: int, detected: list[str], filter_days: int | None, filter_project: str | None) -> dict:
+    return {
+        "total_messages": total_messages,
+        "detected_tools": detected,
+        "filter_days": filter_days,
+        "filter_project": filter_project,
+        "collected_at": datetime.now(tz=timezone.utc).strftime("%Y-%m-%d %H:%M UTC"),
+    }
+
+
+def build_output(sources: list[dict], filter_days: int | None, filter_project: str | None, summary: OutputSummary | None = None) -> dict:
+    """収集結果から出力JSON（summary, sources, secret_warnings, project_stats）を組み立てる
+
+    summary を渡すと、sources のメッセージではなく積み上げ済みの summary を使う（--max-messages などで標本にしたとき）。
+    """
+    if summary is None:
+        summary = OutputSummary()
+        for source in sources:
+            for msg in source["messages"]:
+                summary.add(source["tool"], msg)
+    detected = [s["tool"] for s in sources if s["status"] == "検出"]
+
+    return {
+        "summary": build_summary(summary.total_messages, detected, filter_days, filter_project),
+        "sources": sources,
+        "secret_warnings": summary.secret_warnings,
+        "project_stats": summary.project_stats(),
     }
 
+
+# --export で1つのレコードバッチ（Parquet では行グループ）にまとめる件数
+EXPORT_BATCH_ROWS = 8192
+
+
+class ArrowExporter:
+    """メッセージを Parquet（拡張子 .parquet）または Arrow IPC ファイルに EXPORT_BATCH_ROWS 件ずつ書き出す
+
+    pyarrow は --export を使うときだけ必要（なければ ImportError）。
+    tool / project は辞書エンコードし、辞書はファイル全体で共有する（Arrow IPC ではバッチごとに差分だけを書く）。
+    """
+
+    def __init__(self, path: Path):
+        import pyarrow as pa
+
+        self.pa = pa
+        self.path = path
+        self.format = "parquet" if path.suffix.lower() == ".parquet" else "arrow"
+        self.schema = pa.schema([
+            ("tool", pa.dictionary(pa.int32(), pa.string())),
+            ("project", pa.dictionary(pa.int32(), pa.string())),
+            ("timestamp_ms", pa.int64()),
+            ("text", pa.string()),
+            ("note", pa.string()),
+            ("near_dup_of", pa.int64()),
+        ])
+        if self.format == "parquet":
+            import pyarrow.parquet as pq
+
+            self.writer = pq.ParquetWriter(str(path), self.schema, compression="zstd")
+        else:
+            self.writer = pa.ipc.new_file(str(path), self.schema, options=pa.ipc.IpcWriteOptions(emit_dictionary_deltas=True))
+        self.rows = 0
+        self._dictionaries = {"tool": {}, "project": {}}  # 値 -> 辞書内の位置（追加順）
+        self._columns = {name: [] for name in self.schema.names}
+
+    def _code(self, column: str, value: str) -> int:
+        codes = self._dictionaries[column]
+        code = codes.get(value)
+        if code is None:
+            code = codes[value] = len(codes)
+        return code
+
+    def add(self, tool: str, msg: Message):
+        columns = self._columns
+        columns["tool"].append(self._code("tool", tool))
+        columns["project"].append(self._code("project", msg.project))
+        columns["timestamp_ms"].append(msg.timestamp_ms)
+        columns["text"].append(msg.text)
+        columns["note"].append(msg.note)
+        columns["near_dup_of"].append(msg.near_dup_of)
+        if len(columns["text"]) >= EXPORT_BATCH_ROWS:
+            self.flush()
+
+    def flush(self):
+        columns = self._columns
+        if not columns["text"]:
+            return
+        pa = self.pa
+        arrays = []
+        for field in self.schema:
+            if field.name in self._dictionaries:
+                # 辞書はそれまでの値を含めて前方一致で伸ばしていくので、既存の符号は変わらない
+                dictionary = pa.array(list(self._dictionaries[field.name]), pa.string())
+                arrays.append(pa.DictionaryArray.from_arrays(pa.array(columns[field.name], pa.int32()), dictionary))
+            else:
+                arrays.append(pa.array(columns[field.name], field.type))
+        self.writer.write_batch(pa.RecordBatch.from_arrays(arrays, schema=self.schema))
+        self.rows += len(columns["text"])
+        for values in columns.values():
+            values.clear()
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+
+    def summary(self) -> dict:
+        return {"path": str(self.path), "format": self.format, "rows": self.rows}
+
+
+# --format ndjson で何レコードごとに標準出力をフラッシュするか
+NDJSON_FLUSH_EVERY = 256
+
+
+def write_ndjson(events, filter_days: int | None, filter_project: str | None, index: "PromptIndex | None" = None, near_dup: NearDuplicateIndex | None = None, profiler: Profiler | None = None, exporter: ArrowExporter | None = None):
+    """イベントを1行1レコードのJSONで逐次出力する
+
+    メッセージは {"type": "message", "tool": ...} として届いた順に出し、ソースごとの終了時に
+    {"type": "source"} を、最後に secret_warnings, project_stats, summary の各レコードを出す。
+    メッセージ本体は保持しないので、メモリ使用量は件数によらずほぼ一定。
+    near_dup を渡すと、インデックスへの追加後に近似重複の注記・除外を行う。
+    profiler を渡すと、summary レコードに perf を付ける。
+    exporter を渡すと、メッセージは標準出力に出さずに exporter に書き出す（閉じるのは呼び出し側）。
+    """
+    if sys.platform == "win32":
+        sys.stdout.reconfigure(encoding="utf-8")
+    out = sys.stdout
+    summary = OutputSummary()
+    counts = {}
+    periods = {}
+    complete = {}
+    detected = set()
+    pending_index = []
+    occurrences = {}
+
+    def emit(record):
+        out.write(json.dumps(record, ensure_ascii=False))
+        out.write("\n")
+
+    written = 0
+    for kind, tool, payload in events:
+        if kind == "message":
+            if index is not None:
+                pending_index.append((tool, payload))
+                if len(pending_index) >= NDJSON_FLUSH_EVERY:
+                    index.ingest_messages(pending_index, occurrences)
+                    pending_index.clear()
+            if near_dup is not None:
+                dup_of = near_dup.add(payload.text)
+                if dup_of is not None:
+                    if near_dup.mode == "collapse":
+                        continue
+                    payload = payload.annotated(dup_of)
+            summary.add(tool, payload)
+            counts[tool] = counts.get(tool, 0) + 1
+            ts = payload.timestamp_ms
+            if ts:
+                lo, hi = periods.get(tool, (ts, ts))
+                periods[tool] = (min(lo, ts), max(hi, ts))
+            if exporter is not None:
+                exporter.add(tool, payload)
+                continue
+            emit({"type": "message", "tool": tool, **payload.to_dict()})
+            written += 1
+            if written % NDJSON_FLUSH_EVERY == 0:
+                out.flush()
+            continue
+        if kind == "budget":
+            complete[tool] = payload["complete"]
+            continue
+
+        record = {"type": "source", "tool": tool, "status": "検出" if counts.get(tool) else "未検出", "period": "", "count": counts.get(tool, 0)}
+        if tool in periods:
+            record["period"] = f"{ts_to_iso(periods[tool][0])} 〜 {ts_to_iso(periods[tool][1])}"
+        if payload is not None:
+            record["status"] = payload["status"]
+            record["error"] = payload["error"]
+        else:
+            if tool in complete:
+                record["complete"] = complete[tool]
+            if counts.get(tool):
+                detected.add(tool)
+        emit(record)
+        out.flush()
+
+    if index is not None and pending_index:
+        index.ingest_messages(pending_index, occurrences)
+    emit({"type": "secret_warnings", "secret_warnings": summary.secret_warnings})
+    emit({"type": "project_stats", "project_stats": summary.project_stats()})
+    detected_tools = [tool for tool in SOURCE_TOOLS if tool in detected]
+    record = {"type": "summary", **build_summary(summary.total_messages, detected_tools, filter_days, filter_project)}
+    if near_dup is not None:
+        record["near_duplicates"] = near_dup.summary()
+    if profiler is not None:
+        record["perf"] = profiler.report()
+    if exporter is not None:
+        exporter.flush()
+        record["export"] = exporter.summary()
+    emit(record)
+    out.flush()
+
+
+def write_json(output):
     # Windows環境でのUTF-8出力を保証
     if sys.platform == "win32":
         sys.stdout.reconfigure(encoding="utf-8")
-    json.dump(output, sys.stdout, ensure_ascii=False, indent=2)
+    json.dump(output, sys.stdout, ensure_ascii=False, indent=2, default=_json_default)
+
+
+# watch デーモンがハートビートを書く間隔と、通常の実行がデーモンを生きているとみなす期限
+WATCH_HEARTBEAT_SECONDS = 5
+WATCH_STALE_MS = 30 * 1000
+# 変更を検知してから取り込むまで待つ時間（書き込みが続く間の取り込みをまとめる）
+WATCH_DEBOUNCE_SECONDS = 0.5
+# 追記を監視して取り込むソース。それ以外のソースは --rescan 秒ごとにまとめて取り込む
+WATCHED_TOOLS = {"Claude Code", "OpenAI Codex"}
+
+_IN_MODIFY = 0x00000002
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_Q_OVERFLOW = 0x00004000
+_IN_ISDIR = 0x40000000
+_INOTIFY_EVENT = struct.Struct("iIII")
+
+
+def watch_roots() -> list[tuple[Path, bool]]:
+    """監視する (ディレクトリ, 再帰するか)。history.jsonl・Claude Code のプロジェクト・Codex の sessions"""
+    claude_dir = get_claude_dir()
+    codex_home = Path(os.environ.get("CODEX_HOME", Path.home() / ".codex"))
+    return [(claude_dir, False), (claude_dir / "projects", True), (codex_home / "sessions", True)]
+
+
+class InotifyWatcher:
+    """Linux の inotify でディレクトリ内のファイルの変更を待つ（ctypes を使い、追加の依存はない）"""
+
+    MASK = _IN_MODIFY | _IN_CLOSE_WRITE | _IN_MOVED_TO | _IN_CREATE
+
+    def __init__(self, roots: list[tuple[Path, bool]]):
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.watches = {}  # wd -> (ディレクトリ, 再帰するか)
+        self.add_roots(roots)
+
+    def _add(self, directory: Path, recursive: bool):
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(directory), self.MASK)
+        if wd >= 0:
+            self.watches[wd] = (directory, recursive)
+        if recursive:
+            for sub in scan_dir(directory, dirs=True):
+                self._add(sub.path, True)
+
+    def add_roots(self, roots: list[tuple[Path, bool]]):
+        """まだ監視していない（後から作られた）ディレクトリを監視に加える"""
+        watched = {directory for directory, _ in self.watches.values()}
+        for directory, recursive in roots:
+            if directory not in watched and directory.is_dir():
+                self._add(directory, recursive)
+
+    def wait(self, timeout: float) -> bool:
+        """変更があれば True。timeout 秒で何もなければ False"""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return False
+        time.sleep(WATCH_DEBOUNCE_SECONDS)
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                return True
+            pos = 0
+            while pos < len(data):
+                wd, mask, _, length = _INOTIFY_EVENT.unpack_from(data, pos)
+                name = data[pos + _INOTIFY_EVENT.size:pos + _INOTIFY_EVENT.size + length].rstrip(b"\0")
+                pos += _INOTIFY_EVENT.size + length
+                if mask & _IN_Q_OVERFLOW:
+                    continue
+                # 再帰監視の下に作られたディレクトリ（Codex の日付ディレクトリなど）も監視する
+                parent = self.watches.get(wd)
+                if parent and parent[1] and mask & _IN_ISDIR and mask & (_IN_CREATE | _IN_MOVED_TO):
+                    self._add(parent[0] / os.fsdecode(name), True)
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollingWatcher:
+    """inotify が使えない環境向け: interval 秒ごとにファイルの更新日時とサイズを比べる"""
+
+    def __init__(self, roots: list[tuple[Path, bool]], interval: float):
+        self.roots = roots
+        self.interval = interval
+        self.snapshot = self._scan()
+
+    def _scan(self) -> dict:
+        files = {}
+        for directory, recursive in self.roots:
+            entries = walk_files(directory) if recursive else scan_dir(directory)
+            for entry in entries:
+                files[entry.path] = (entry.mtime, entry.size)
+        return files
+
+    def add_roots(self, roots: list[tuple[Path, bool]]):
+        pass  # 毎回すべての監視対象を走査し直すので何もしない
+
+    def wait(self, timeout: float) -> bool:
+        deadline = time.monotonic() + timeout
+        while True:
+            time.sleep(max(0.0, min(self.interval, deadline - time.monotonic())))
+            current = self._scan()
+            if current != self.snapshot:
+                self.snapshot = current
+                return True
+            if time.monotonic() >= deadline:
+                return False
+
+    def close(self):
+        pass
+
+
+def make_watcher(roots: list[tuple[Path, bool]], interval: float, poll: bool = False):
+    """Linux では inotify、使えなければポーリングの監視を返す"""
+    if not poll and sys.platform.startswith("linux"):
+        try:
+            return InotifyWatcher(roots)
+        except (OSError, AttributeError):
+            pass
+    return PollingWatcher(roots, interval)
+
+
+def ingest_collectors(index: PromptIndex, collectors: list) -> dict:
+    """収集関数ごとにインデックスへ取り込み、{tool: 追加件数} を返す（失敗したソースは標準エラーに出して飛ばす）"""
+    added = {}
+    for tool, stream in collectors:
+        try:
+            added[tool] = index.ingest_messages((tool, msg) for msg in stream())
+        except Exception as e:
+            print(json.dumps({"watch": {"tool": tool, "error": f"{type(e).__name__}: {e}"}}, ensure_ascii=False), file=sys.stderr)
+    return added
+
+
+def run_watch(args):
+    """watch サブコマンド: 履歴を監視してインデックスに取り込み続ける
+
+    起動時と --rescan 秒ごとに全ソースを、それ以外は変更を検知するたびに WATCHED_TOOLS だけを取り込む。
+    追記型ログはチェックポイントから再開するので、取り込みのたびに解析するのは追記分だけ。
+    ハートビートを WATCH_HEARTBEAT_SECONDS ごとにインデックスに書き、終了時に消す。
+    """
+    index = PromptIndex(get_index_path(args))
+    checkpoints = CheckpointStore(None if args.no_cache else (args.cache_dir or get_cache_dir()) / "checkpoints.sqlite3")
+    # 期間・件数で絞らずに取り込み、件数の上限はインデックスから答えるとき（emit_sources）にかける
+    collectors = build_collectors(args, None, None, checkpoints, ScanStats(), budget=Budget(None))
+    watched = [(tool, stream) for tool, stream in collectors if tool in WATCHED_TOOLS]
+    roots = watch_roots()
+    watcher = make_watcher(roots, args.interval, args.poll)
+
+    def log(**record):
+        print(json.dumps({"watch": record}, ensure_ascii=False), file=sys.stderr, flush=True)
+
+    # SIGTERM でも finally でハートビートを消してから終了する
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        log(event="start", watcher=type(watcher).__name__, index=str(get_index_path(args)))
+        next_rescan = 0.0
+        changed = True
+        while True:
+            if time.monotonic() >= next_rescan:
+                log(event="rescan", added=ingest_collectors(index, collectors))
+                watcher.add_roots(roots)
+                next_rescan = time.monotonic() + args.rescan
+            elif changed:
+                added = ingest_collectors(index, watched)
+                if any(added.values()):
+                    log(event="ingest", added=added)
+            checkpoints.save()
+            index.set_meta("watch_heartbeat_ms", str(int(time.time() * 1000)))
+            index.set_meta("watch_pid", str(os.getpid()))
+            changed = watcher.wait(min(WATCH_HEARTBEAT_SECONDS, max(0.0, next_rescan - time.monotonic())))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
+        index.set_meta("watch_heartbeat_ms", None)
+        index.set_meta("watch_pid", None)
+        index.close()
+        log(event="stop")
+
+
+def open_watch_index(args) -> PromptIndex | None:
+    """watch デーモンのハートビートが新しければインデックスを開いて返す（なければ None）"""
+    path = get_index_path(args)
+    if args.live or args.no_cache or args.root or not path.exists():
+        return None
+    index = PromptIndex(path)
+    heartbeat = index.get_meta("watch_heartbeat_ms")
+    if heartbeat is None or time.time() * 1000 - int(heartbeat) > WATCH_STALE_MS:
+        index.close()
+        return None
+    return index
+
+
+def iter_result_events(sources: list[dict]) -> Iterator[tuple]:
+    """収集結果（sources）を iter_collected_events と同じ形のイベント列にする"""
+    for source in sources:
+        for msg in source["messages"]:
+            yield "message", source["tool"], msg
+        if "complete" in source:
+            yield "budget", source["tool"], {"complete": source["complete"]}
+        failure = {"status": source["status"], "error": source["error"]} if "error" in source else None
+        yield "end", source["tool"], failure
+
+
+def parse_date_ms(value: str) -> int:
+    """YYYY-MM-DD（UTC）または epochミリ秒をepochミリ秒に変換する（argparse用）"""
+    if value.isdigit():
+        return int(value)
+    try:
+        dt = datetime.fromisoformat(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"日付の形式が不正です: {value}")
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return int(dt.timestamp() * 1000)
+
+
+def run_query(args):
+    """query サブコマンド: インデックスから全文検索・期間検索する"""
+    index = PromptIndex(get_index_path(args))
+    try:
+        if args.refresh:
+            index.ingest(collect_sources(args, None, None))
+
+        since_ms = args.since
+        if args.query_days and args.query_days > 0:
+            since_ms = max(since_ms or 0, compute_cutoff_ms(args.query_days))
+
+        if args.rollup:
+            # メッセージ本体を読まずに、積み上げ済みの集計だけで推移を返す
+            rows = index.rollups(args.rollup, since_ms, args.until, args.tool, args.query_project)
+            write_json({
+                "rollup": {"unit": args.rollup, "since": ts_to_iso(since_ms) if since_ms else None,
+                           "until": ts_to_iso(args.until) if args.until else None,
+                           "tool": args.tool, "project": args.query_project},
+                "count": len(rows),
+                "rows": rows,
+            })
+            return
+
+        if args.emit_json:
+            # collect.py 本体と同じ形のJSONをソースファイルに触れずに再出力する
+            sources = index.emit_sources(since_ms, args.until, args.query_project, args.text)
+            write_json(build_output(sources, args.query_days, args.query_project))
+            return
+
+        rows = index.search(args.text, since_ms, args.until, args.tool, args.query_project, args.limit)
+        write_json({
+            "query": {"text": args.text, "since": ts_to_iso(since_ms) if since_ms else None,
+                      "until": ts_to_iso(args.until) if args.until else None,
+                      "tool": args.tool, "project": args.query_project},
+            "count": len(rows),
+            "messages": rows,
+        })
+    finally:
+        index.close()
+
+
+def get_index_path(args) -> Path:
+    return (args.cache_dir or get_cache_dir()) / "index.sqlite3"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="AI対話履歴を収集・整形して出力する")
+    parser.add_argument("--days", type=int, default=7, help="過去N日分に限定（デフォルト: 7日）")
+    parser.add_argument("--project", type=str, default=None, help="プロジェクト名でフィルタ（部分一致）")
+    parser.add_argument("--cache-dir", type=Path, default=None, help="チェックポイント・インデックスの保存先（デフォルト: $XDG_CACHE_HOME/prompt-review）")
+    parser.add_argument("--no-cache", action="store_true", help="チェックポイントを使わず毎回全量を解析する")
+    parser.add_argument("--jobs", type=int, default=1, help="ソースを並行収集するワーカー数（デフォルト: 1 = 逐次）")
+    parser.add_argument("--timeout", type=float, default=None, help="並行収集時の各ソースのタイムアウト秒数")
+    parser.add_argument("--scan-stats", action="store_true", help="JSONLの解析行数（プレフィルタで除外した行数・デコードした行数）を標準エラーに出力する")
+    parser.add_argument("--no-seek", action="store_true", help="history.jsonl をカットオフ位置へシークせず先頭から読む")
+    parser.add_argument("--prune-dirs", action="store_true", help="更新日時が --days より古いディレクトリには降りない（古いディレクトリ内のファイルへの追記は見落とす）")
+    parser.add_argument("--no-partition-prune", action="store_true", help="Codex の sessions/YYYY/MM/DD をカットオフより前の日付も含めて走査する（古いセッションを再開して追記した分も拾う）")
+    parser.add_argument("--parse-workers", type=int, default=os.cpu_count() or 1, help="セッションJSONLを解析するプロセス数（デフォルト: CPUコア数、1で無効）")
+    parser.add_argument("--index", action="store_true", help="収集したメッセージをSQLiteインデックスにも追加する")
+    parser.add_argument("--near-dup", choices=["annotate", "collapse"], default=None, help="ソースをまたいだ近似重複（MinHash/LSH）に near_dup_of を付ける（annotate）か、最初の1件以外を除く（collapse）")
+    parser.add_argument("--format", choices=["json", "ndjson"], default="json", help="出力形式（ndjson: 収集しながら1行1レコードで出力。集計は末尾のレコード）")
+    parser.add_argument("--budget-ms", type=int, default=None, help="収集の締め切り（ミリ秒）。ファイル数・メッセージ数の上限をなくし、全ソースを交互に新しい順に読んで締め切りで打ち切る。各ソースに complete（読み終えたか）を付ける")
+    parser.add_argument("--export", type=Path, default=None, metavar="PATH", help="メッセージを Parquet（拡張子 .parquet）または Arrow IPC ファイルに書き出し、標準出力にはメッセージ以外のNDJSONレコードを出す（pyarrow が必要）")
+    parser.add_argument("--live", action="store_true", help="watch デーモンが動いていてもインデックスを使わず、各ソースから収集する")
+    parser.add_argument("--max-messages", type=int, default=None, metavar="N", help="出力するメッセージを (ツール, プロジェクト) ごとの層別サンプリングで N 件以下にする（集計は全件、secret_warnings は残したメッセージの分だけ）")
+    parser.add_argument("--max-bytes", type=int, default=None, metavar="B", help="出力するメッセージ・secret_warnings・project_stats の合計をおおよそ B バイト以下にする（--max-messages と併用可）")
+    parser.add_argument("--timeline", action="store_true", help="全ソースのメッセージを時刻の古い順に1本にマージして NDJSON で出力する（--jobs は使わない）")
+    parser.add_argument("--root", type=Path, action="append", default=None, metavar="DIR", help="DIR をホームとみなして収集する（複数指定可。ルートごとに別プロセスで収集し、時刻順にマージして重複を除く）")
+    parser.add_argument("--profile", type=int, nargs="?", const=10, default=None, metavar="N", help="summary.perf にソース別の所要時間・読んだファイル数/バイト数・行数・フィルタ別の除外数と、遅いファイル上位N件（デフォルト: 10）を出す")
+
+    subparsers = parser.add_subparsers(dest="command")
+    query_parser = subparsers.add_parser("query", help="SQLiteインデックスを全文検索・期間検索する")
+    query_parser.add_argument("text", nargs="?", default=None, help="検索文字列（部分一致。3文字以上はFTS5 trigramで検索）")
+    query_parser.add_argument("--days", dest="query_days", type=int, default=None, help="過去N日分に限定（デフォルト: 全期間）")
+    query_parser.add_argument("--project", dest="query_project", type=str, default=None, help="プロジェクト名でフィルタ（部分一致）")
+    query_parser.add_argument("--since", type=parse_date_ms, default=None, help="この日時以降（YYYY-MM-DD または epochミリ秒）")
+    query_parser.add_argument("--until", type=parse_date_ms, default=None, help="この日時より前（YYYY-MM-DD または epochミリ秒）")
+    query_parser.add_argument("--tool", type=str, default=None, help="ツール名で絞り込み（例: \"Claude Code\"）")
+    query_parser.add_argument("--limit", type=int, default=100, help="最大件数（デフォルト: 100）")
+    query_parser.add_argument("--refresh", action="store_true", help="検索前に全ソースから収集してインデックスを更新する")
+    query_parser.add_argument("--emit-json", action="store_true", help="collect.py と同じ形のJSONをインデックスから出力する")
+    query_parser.add_argument("--rollup", choices=["day", "week"], default=None, help="日・週×プロジェクト×ツールごとの件数・文字数・シークレット検出数を出力する（メッセージ本体は読まない。検索文字列は使えない）")
+    watch_parser = subparsers.add_parser("watch", help="履歴を監視してSQLiteインデックスを更新し続ける（通常の実行はインデックスから答える）")
+    watch_parser.add_argument("--poll", action="store_true", help="inotify を使わずポーリングで監視する")
+    watch_parser.add_argument("--interval", type=float, default=2.0, help="ポーリングの間隔（秒、デフォルト: 2）")
+    watch_parser.add_argument("--rescan", type=float, default=300.0, help="全ソースを取り込み直す間隔（秒、デフォルト: 300）")
+    args = parser.parse_args()
+
+    if args.command == "query":
+        if args.rollup and args.text:
+            parser.error("--rollup と検索文字列は同時に指定できません")
+        run_query(args)
+        return
+    if args.command == "watch":
+        run_watch(args)
+        return
+
+    for root in args.root or []:
+        if not root.is_dir():
+            parser.error(f"--root のディレクトリがありません: {root}")
+    if args.timeline and args.budget_ms is not None:
+        parser.error("--timeline と --budget-ms は同時に指定できません（--budget-ms は新しい順に読むため）")
+    sampler = None
+    if args.max_messages is not None or args.max_bytes is not None:
+        if (args.max_messages is not None and args.max_messages <= 0) or (args.max_bytes is not None and args.max_bytes <= 0):
+            parser.error("--max-messages / --max-bytes には正の数を指定してください")
+        if args.format == "ndjson" or args.export or args.timeline:
+            parser.error("--max-messages / --max-bytes は JSON 出力でのみ使えます")
+        sampler = StratifiedSampler(args.max_messages, args.max_bytes)
+
+    cutoff_ms = compute_cutoff_ms(args.days)
+    near_dup = NearDuplicateIndex(args.near_dup) if args.near_dup else None
+    profiler = Profiler(args.profile) if args.profile is not None else None
+
+    # watch デーモンが動いていれば、各ソースを読まずにインデックスから答える
+    watch_index = open_watch_index(args)
+    watch_sources = None
+    if watch_index is not None:
+        try:
+            watch_sources = watch_index.emit_sources(cutoff_ms, None, args.project, ordered=args.timeline, capped=True)
+        finally:
+            watch_index.close()
+
+    exporter = None
+    if args.export:
+        try:
+            exporter = ArrowExporter(args.export)
+        except ImportError:
+            parser.error("--export には pyarrow が必要です（pip install pyarrow）")
+
+    # --export はメッセージをファイルに書き、残りのレコードを NDJSON で出す。--timeline は時刻順の NDJSON で出す
+    if args.format == "ndjson" or exporter is not None or args.timeline:
+        index = PromptIndex(get_index_path(args)) if args.index and watch_sources is None else None
+        try:
+            if watch_sources is not None or args.root:
+                sources = watch_sources if watch_sources is not None else collect_roots(args, cutoff_ms, args.project, profiler)
+                if args.timeline:
+                    events = iter_events_timeline([iter_result_events([source]) for source in sources])
+                else:
+                    events = iter_result_events(sources)
+            else:
+                events = iter_collected_events(args, cutoff_ms, args.project, profiler)
+            write_ndjson(events, args.days, args.project, index, near_dup, profiler, exporter)
+        finally:
+            if index is not None:
+                index.close()
+            if exporter is not None:
+                exporter.close()
+        return
+
+    summary = None
+    if sampler is not None:
+        # 全件を溜めずに標本だけを残す。プロジェクト別集計・インデックスは全件が対象
+        summary = OutputSummary(keep_warnings=False)
+        index = PromptIndex(get_index_path(args)) if args.index and watch_sources is None else None
+        try:
+            if watch_sources is not None:
+                events = iter_result_events(watch_sources)
+            elif args.root:
+                events = iter_result_events(collect_roots(args, cutoff_ms, args.project, profiler))
+            else:
+                events = iter_collected_events(args, cutoff_ms, args.project, profiler)
+            sources = collect_sampled(events, sampler, summary, index)
+        finally:
+            if index is not None:
+                index.close()
+    else:
+        if watch_sources is not None:
+            sources = watch_sources
+        elif args.root:
+            sources = collect_roots(args, cutoff_ms, args.project, profiler)
+        else:
+            sources = collect_sources(args, cutoff_ms, args.project, profiler)
+
+        if args.index and watch_sources is None:
+            index = PromptIndex(get_index_path(args))
+            try:
+                index.ingest(sources)
+            finally:
+                index.close()
+
+    if near_dup is not None:
+        sources = apply_near_duplicates(sources, near_dup)
+    output = build_output(sources, args.days, args.project, summary)
+    if sampler is not None:
+        output["summary"]["sampling"] = sampler.summary()
+    if near_dup is not None:
+        output["summary"]["near_duplicates"] = near_dup.summary()
+    if profiler is not None:
+        output["summary"]["perf"] = profiler.report()
+    write_json(output)
 
 
 if __name__ == "__main__":
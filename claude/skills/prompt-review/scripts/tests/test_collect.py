@@ -0,0 +1,544 @@
+#!/usr/bin/env python3
+"""
+collect.py の出力の一貫性テストと部品の単体テスト
+
+bench/fixtures.py の合成フィクスチャをホームディレクトリとして collect.py を実行し、
+同じ結果になるべきオプションの組み合わせで出力を比べる。
+単体テストは collect を import し、一時ディレクトリの小さな入力で確かめる。
+
+使い方:
+    python -m unittest discover -s tests
+"""
+
+import json
+import os
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+SCRIPTS_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(SCRIPTS_DIR))
+sys.path.insert(0, str(SCRIPTS_DIR / "bench"))
+
+import collect  # noqa: E402
+from fixtures import fixture_env, generate  # noqa: E402
+from secret_scan import SECRETS, WORDS, scan_secrets_per_pattern  # noqa: E402
+
+COLLECT = SCRIPTS_DIR / "collect.py"
+
+
+def sorted_records(records: list[dict]) -> list[dict]:
+    """順序を比べないよう、内容で並べ替えたレコード"""
+    return sorted(records, key=lambda record: json.dumps(record, ensure_ascii=False, sort_keys=True))
+
+
+def normalized(output: dict) -> dict:
+    """実行ごとに変わる値を除き、ソース内のメッセージと警告を並べ替えた出力"""
+    output["summary"].pop("collected_at", None)
+    output["summary"].pop("perf", None)
+    for source in output["sources"]:
+        source["messages"] = sorted_records(source.get("messages", []))
+    output["secret_warnings"] = sorted_records(output["secret_warnings"])
+    return output
+
+
+class CollectTestCase(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp = tempfile.TemporaryDirectory()
+        cls.home = Path(cls.tmp.name) / "home"
+        generate(cls.home)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp.cleanup()
+
+    def run_collect(self, *args: str) -> str:
+        env = {**os.environ, **fixture_env(self.home), "PYTHONHASHSEED": "0"}
+        result = subprocess.run([sys.executable, str(COLLECT), *args], env=env, capture_output=True, text=True, timeout=300)
+        self.assertEqual(result.returncode, 0, result.stderr)
+        return result.stdout
+
+    def collect_json(self, *args: str) -> dict:
+        return normalized(json.loads(self.run_collect(*args)))
+
+
+class RootTest(CollectTestCase):
+    def test_root_home_matches_default(self):
+        """--root にホーム自身を渡した結果は、通常の実行と同じ（ルートのキャッシュが冷えていても温まっていても）"""
+        for days in ("7", "30"):
+            with self.subTest(days=days):
+                expected = self.collect_json("--days", days)
+                self.assertEqual(self.collect_json("--days", days, "--root", str(self.home)), expected)
+                self.assertEqual(self.collect_json("--days", days, "--root", str(self.home)), expected)
+
+    def test_roots_cache_dir_is_private(self):
+        self.run_collect("--days", "7", "--root", str(self.home))
+        roots_dir = Path(fixture_env(self.home)["XDG_CACHE_HOME"]) / "prompt-review" / "roots"
+        self.assertEqual(roots_dir.stat().st_mode & 0o777, 0o700)
+
+
+class IndexTest(CollectTestCase):
+    def index_counts(self, *args: str) -> dict:
+        """キャッシュを空にして --index 付きで実行し、インデックスのツール別の行数を返す"""
+        with tempfile.TemporaryDirectory() as cache_dir:
+            self.run_collect("--days", "0", "--index", "--cache-dir", cache_dir, *args)
+            conn = sqlite3.connect(str(Path(cache_dir) / "index.sqlite3"))
+            try:
+                return dict(conn.execute("SELECT tool, COUNT(*) FROM messages GROUP BY tool").fetchall())
+            finally:
+                conn.close()
+
+    def test_ndjson_indexes_same_rows_as_json(self):
+        """NDJSON はインデックスへ分けて追加するが、同じ内容の繰り返しも含めて JSON と同じ行数になる"""
+        expected = self.index_counts("--format", "json")
+        self.assertEqual(sum(expected.values()), json.loads(self.run_collect("--days", "0"))["summary"]["total_messages"])
+        self.assertEqual(self.index_counts("--format", "ndjson"), expected)
+        self.assertEqual(self.index_counts("--max-messages", "100"), expected)
+
+
+class TimelineTest(CollectTestCase):
+    def test_timeline_is_sorted_and_complete(self):
+        """--timeline は時刻順で、通常の実行と同じメッセージを出す"""
+        records = [json.loads(line) for line in self.run_collect("--days", "30", "--timeline").splitlines()]
+        messages = [record for record in records if record["type"] == "message"]
+        times = [msg["timestamp_ms"] for msg in messages]
+        self.assertEqual(times, sorted(times))
+
+        expected = self.collect_json("--days", "30")
+        for source in expected["sources"]:
+            timeline = [{k: v for k, v in msg.items() if k not in ("type", "tool")} for msg in messages if msg["tool"] == source["tool"]]
+            self.assertEqual(sorted_records(timeline), source["messages"], source["tool"])
+
+
+
+class StratifiedSamplerTest(unittest.TestCase):
+    def messages(self) -> list[tuple[str, collect.Message]]:
+        """(ツール, プロジェクト) の層ごとに件数が大きく偏ったメッセージ列"""
+        result = []
+        for tool, project, count in (("a", "big", 400), ("a", "small", 3), ("b", "big", 50), ("b", "one", 1), ("c", "mid", 20)):
+            for i in range(count):
+                text = f"{tool} {project} prompt {i} " + "x" * (i % 7 * 10)
+                result.append((tool, collect.Message(text, 1_700_000_000_000 + i, project)))
+        return result
+
+    def sample(self, max_messages=None, max_bytes=None, seed=0) -> collect.StratifiedSampler:
+        sampler = collect.StratifiedSampler(max_messages, max_bytes, seed)
+        for tool, msg in self.messages():
+            sampler.add(tool, msg)
+        return sampler
+
+    def kept(self, sampler: collect.StratifiedSampler) -> list[collect.Message]:
+        return [msg for tool in ("a", "b", "c") for msg in sampler.messages(tool)]
+
+    def test_max_bytes_is_bound(self):
+        for max_bytes in (300, 2000, 5000):
+            with self.subTest(max_bytes=max_bytes):
+                sampler = self.sample(max_bytes=max_bytes)
+                kept = self.kept(sampler)
+                self.assertTrue(kept)
+                self.assertEqual(sum(sampler.message_bytes(msg) for msg in kept), sampler.kept_bytes)
+                self.assertLessEqual(sampler.kept_bytes, max_bytes)
+
+    def test_every_stratum_is_represented(self):
+        """上限が層の数以上なら、どの層も1件以上残り、小さい層は全部残る"""
+        sampler = self.sample(max_messages=20)
+        kept = self.kept(sampler)
+        self.assertEqual(len(kept), 20)
+        counts = {}
+        for tool in ("a", "b", "c"):
+            for msg in sampler.messages(tool):
+                counts[(tool, msg.project)] = counts.get((tool, msg.project), 0) + 1
+        self.assertEqual(set(counts), {("a", "big"), ("a", "small"), ("b", "big"), ("b", "one"), ("c", "mid")})
+        self.assertEqual(counts[("a", "small")], 3)
+        self.assertEqual(counts[("b", "one")], 1)
+        self.assertEqual(sampler.summary()["strata"], 5)
+
+    def test_same_seed_gives_same_sample(self):
+        def texts(sampler):
+            return [msg.text for msg in self.kept(sampler)]
+
+        self.assertEqual(texts(self.sample(max_messages=30, max_bytes=3000)), texts(self.sample(max_messages=30, max_bytes=3000)))
+        self.assertNotEqual(texts(self.sample(max_messages=30, seed=0)), texts(self.sample(max_messages=30, seed=1)))
+
+    def test_secret_warnings_follow_sampled_messages(self):
+        summary = collect.OutputSummary(keep_warnings=False)
+        sampler = collect.StratifiedSampler(5, None)
+        for i in range(50):
+            msg = collect.Message(f"prompt {i} token=secret{i:04d}", 1_700_000_000_000 + i, "p")
+            sampler.add("a", msg, summary.add("a", msg))
+        self.assertEqual(summary.secret_warnings, [])
+        excerpts = [warning["prompt_excerpt"] for warning in sampler.secret_warnings()]
+        self.assertEqual(excerpts, [msg.text for msg in sampler.messages("a")])
+        self.assertEqual(sum(sampler.summary()["secret_warnings"].values()), 50)
+
+
+
+class ScanSecretsTest(unittest.TestCase):
+    """アンカーで絞り込む scan_secrets が、全パターンを順に finditer する従来の方式と同じ結果になる"""
+
+    CASES = [
+        # 検出されるもの
+        *SECRETS,
+        "API-KEY: x1 と Token=abc を両方 password=p",
+        "export AWS_ACCESS_KEY_ID_X=AKIA1234 secret_key=zz",
+        "Bearer abc.def-ghi~jkl+mno/pqr==",
+        "mongodb://admin:pw@db1 mongodb://admin:pw@db2",
+        # 近いが検出されないもの
+        "api key を確認して", "token の有効期限", "sk-short", "ghp_" + "c" * 35, "AIza" + "e" * 34,
+        "aiza" + "e" * 35, "xoxz-1234567890", "-----BEGIN PUBLIC KEY-----", "postgres://host/db", "secretary",
+        "",
+        # マルチバイト・casefold で文字数や位置が変わるもの
+        "トークンは token=秘密の値 です", "パスワード：password＝全角", "ſecret=long-s", "Straße token=ß値",
+        "İstanbul api_key=x1 ıapi_key=y2", "K\u212a access_key=Kelvin", "🔑 sk-" + "a" * 24 + " 🔑",
+        "ＡＰＩ_ＫＥＹ=fullwidth", "ﬁle secret=ﬂag",
+    ]
+
+    def test_matches_per_pattern_scan(self):
+        for text in self.CASES:
+            with self.subTest(text=text):
+                self.assertEqual(collect.scan_secrets(text), scan_secrets_per_pattern(text))
+
+    def test_matches_per_pattern_scan_on_mixed_messages(self):
+        rnd = random.Random(0)
+        for _ in range(2000):
+            text = " ".join(rnd.choice(WORDS + SECRETS + self.CASES) for _ in range(rnd.randint(1, 6)))
+            self.assertEqual(collect.scan_secrets(text), scan_secrets_per_pattern(text), text)
+
+
+
+class TaskHistoryTest(unittest.TestCase):
+    """JsonScanner で読む read_task_history が、json.load で読んだ場合と同じテキストを返す"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.dir = Path(self.tmp.name)
+
+    def write(self, name: str, data) -> Path:
+        path = self.dir / name
+        path.write_bytes(data if isinstance(data, bytes) else json.dumps(data).encode("utf-8"))
+        return path
+
+    @staticmethod
+    def expected(data: list) -> list[str]:
+        """比較用: json.load した履歴から取り出す従来の方法（辞書でない要素・ブロックは飛ばす）"""
+        texts = []
+        for msg in data:
+            if not isinstance(msg, dict) or msg.get("role") != "user":
+                continue
+            content = msg.get("content", "")
+            if isinstance(content, list):
+                text = " ".join(c.get("text", "") for c in content if isinstance(c, dict) and c.get("type") == "text")
+            else:
+                text = str(content)
+            if text.strip():
+                texts.append(text.strip())
+        return texts
+
+    def test_matches_json_load(self):
+        cases = {
+            "escapes": [{"role": "user", "content": 'say \\"hi\\" in C:\\dir\\ and \\\\"'}],
+            "surrogate_pair": [{"role": "user", "content": "絵文字 😀 と 𠮷"}],
+            "role_after_content": [{"content": "後ろに role", "role": "user"}, {"content": '"role": "user"', "role": "assistant"}],
+            "string_and_list": [
+                {"role": "user", "content": "  文字列  "},
+                {"role": "user", "content": [{"type": "text", "text": "一つ目"}, {"type": "image", "source": {"data": "QUJD"}},
+                                             {"text": "二つ目", "type": "text"}, {"type": "text"}, "raw", 3]},
+                {"role": "user", "content": 42},
+                {"role": "user", "content": None},
+                {"role": "user"},
+            ],
+            "non_dict_items": [1, "user", None, [{"role": "user", "content": "入れ子"}], {"role": "user", "content": "残る"}],
+            "empty_array": [],
+            "nested_values": [{"role": "assistant", "content": [{"type": "tool_use", "input": {"a": [1, {"b": "}]"}]}}]},
+                              {"role": "user", "content": [{"type": "text", "text": "[{\"x\": 1}]"}], "ts": 1.5e3}],
+        }
+        for name, data in cases.items():
+            for ensure_ascii in (True, False):
+                with self.subTest(name=name, ensure_ascii=ensure_ascii):
+                    path = self.write(f"{name}.json", json.dumps(data, ensure_ascii=ensure_ascii, indent=1).encode("utf-8"))
+                    self.assertEqual(collect.read_task_history(path), self.expected(data))
+
+    def test_broken_files_raise(self):
+        good = json.dumps([{"role": "user", "content": "途中まで"}, {"role": "user", "content": "最後"}], ensure_ascii=False).encode("utf-8")
+        cases = {
+            "empty": b"",
+            "truncated": good[:-5],
+            "unterminated_string": good[:good.index(b"\xe6") + 3],
+            "extra_data": good + b" []",
+            "not_an_array": b'{"role": "user", "content": "x"}',
+            "missing_comma": good.replace(b"}, {", b"} {"),
+        }
+        for name, data in cases.items():
+            with self.subTest(name=name):
+                with self.assertRaises(ValueError):
+                    collect.read_task_history(self.write(f"{name}.json", data))
+
+    def test_broken_tasks_are_skipped(self):
+        tasks_dir = self.dir / "tasks"
+        for name, data in (("good", json.dumps([{"role": "user", "content": "読める"}]).encode("utf-8")),
+                           ("empty", b""), ("truncated", '[{"role": "user", "content": "読め'.encode("utf-8"))):
+            (tasks_dir / name).mkdir(parents=True)
+            (tasks_dir / name / "api_conversation_history.json").write_bytes(data)
+        self.assertEqual([msg.text for msg in collect.iter_task_histories(tasks_dir, None)], ["読める"])
+
+
+
+def history_lines(start: int, count: int, prefix: str = "prompt") -> bytes:
+    """1分おきの timestamp を持つ history.jsonl の行"""
+    return "".join(
+        json.dumps({"display": f"{prefix} {i}", "timestamp": 1_700_000_000_000 + i * 60_000, "project": "/src/p", "sessionId": f"s{i // 10}"}) + "\n"
+        for i in range(start, start + count)
+    ).encode("utf-8")
+
+
+class CheckpointTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.dir = Path(self.tmp.name)
+        self.path = self.dir / "history.jsonl"
+        self.db = self.dir / "checkpoints.sqlite3"
+
+    def read(self, cutoff_ms: int | None = None) -> list:
+        """保存済みのチェックポイントを開き直して読み、保存する（実行1回分）"""
+        checkpoints = collect.CheckpointStore(self.db)
+        try:
+            records, _ = collect.read_jsonl_records(self.path, collect.HISTORY_FORMAT, checkpoints, cutoff_ms=cutoff_ms)
+            checkpoints.save()
+        finally:
+            checkpoints.conn.close()
+        return records
+
+    def uncached(self, cutoff_ms: int | None = None) -> list:
+        records, _ = collect.read_jsonl_records(self.path, collect.HISTORY_FORMAT, collect.CheckpointStore(None), cutoff_ms=cutoff_ms)
+        return records
+
+    def test_append_parses_only_new_bytes(self):
+        self.path.write_bytes(history_lines(0, 50))
+        self.assertEqual(self.read(), self.uncached())
+        with open(self.path, "ab") as f:
+            f.write(history_lines(50, 5))
+        with mock.patch.object(collect, "_parse_jsonl_tail", wraps=collect._parse_jsonl_tail) as parse:
+            records = self.read()
+        self.assertEqual(records, self.uncached())
+        self.assertEqual(len(records), 55)
+        self.assertEqual([call.args[1] for call in parse.call_args_list], [len(history_lines(0, 50))])
+
+    def test_truncate_invalidates(self):
+        self.path.write_bytes(history_lines(0, 50))
+        self.read()
+        self.path.write_bytes(history_lines(0, 3, "new"))
+        self.assertEqual([record[1] for record in self.read()], ["new 0", "new 1", "new 2"])
+
+    def test_same_size_rewrite_invalidates(self):
+        """末尾の署名が変わらない先頭だけの書き換えでも、サイズが同じで mtime が変われば読み直す"""
+        data = history_lines(0, 50)
+        self.path.write_bytes(data)
+        st = self.path.stat()
+        self.read()
+        rewritten = data.replace(b"prompt 0", b"edited 0", 1)
+        self.assertEqual(len(rewritten), len(data))
+        with open(self.path, "r+b") as f:
+            f.write(rewritten)
+        os.utime(self.path, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000_000))
+        records = self.read()
+        self.assertEqual(records[0][1], "edited 0")
+        self.assertEqual(records, self.uncached())
+
+    def test_resume_reads_only_chunks_in_window(self):
+        self.path.write_bytes(history_lines(0, 200))
+        with mock.patch.object(collect, "CHECKPOINT_CHUNK_BYTES", 1024):
+            self.read()
+            cutoff_ms = 1_700_000_000_000 + 150 * 60_000 + collect.SEEK_SLACK_MS
+            # シーク位置より前で終わるチャンクは読まない
+            checkpoints = collect.CheckpointStore(self.db)
+            head = collect.seek_jsonl_timestamp(self.path, cutoff_ms - collect.SEEK_SLACK_MS, collect.HISTORY_FORMAT.timestamp_of, self.path.stat().st_size)
+            stored = checkpoints.records(self.path, head)
+            checkpoints.conn.close()
+            self.assertLess(len(stored), 200)
+            self.assertEqual(stored[-1][1], "prompt 199")
+            self.assertEqual([r for r in self.read(cutoff_ms) if r[0] >= cutoff_ms - collect.SEEK_SLACK_MS],
+                             [r for r in self.uncached(cutoff_ms) if r[0] >= cutoff_ms - collect.SEEK_SLACK_MS])
+
+
+
+class HistorySeekTest(unittest.TestCase):
+    T0 = 1_700_000_000_000
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.path = Path(self.tmp.name) / "history.jsonl"
+
+    def write_timestamps(self, timestamps: list, tail: bytes = b"") -> list[int]:
+        """timestamp ごとに1行書き、各行の先頭オフセットを返す（None は timestamp のない行）"""
+        offsets, data = [], b""
+        for i, timestamp in enumerate(timestamps):
+            offsets.append(len(data))
+            entry = {"display": f"p{i}", "project": "/src/p", "sessionId": f"s{i}"}
+            if timestamp is not None:
+                entry["timestamp"] = timestamp
+            data += json.dumps(entry).encode("utf-8") + b"\n"
+        self.path.write_bytes(data + tail)
+        return offsets
+
+    def seek(self, cutoff_ms: int) -> int:
+        return collect.seek_jsonl_timestamp(self.path, cutoff_ms, collect.HISTORY_FORMAT.timestamp_of, self.path.stat().st_size)
+
+    def test_boundaries(self):
+        timestamps = [self.T0 + i * 1000 for i in range(100)]
+        offsets = self.write_timestamps(timestamps)
+        size = self.path.stat().st_size
+        self.assertEqual(self.seek(self.T0 - 1), 0)
+        self.assertEqual(self.seek(self.T0), 0)
+        self.assertEqual(self.seek(self.T0 + 1), offsets[1])
+        self.assertEqual(self.seek(self.T0 + 57_000), offsets[57])
+        self.assertEqual(self.seek(self.T0 + 57_001), offsets[58])
+        self.assertEqual(self.seek(timestamps[-1]), offsets[-1])
+        self.assertEqual(self.seek(timestamps[-1] + 1), size)
+
+    def test_empty_and_unterminated_files(self):
+        self.write_timestamps([])
+        self.assertEqual(self.seek(self.T0), 0)
+        # 書き込み途中の末尾行より前で止まる
+        offsets = self.write_timestamps([self.T0, self.T0 + 1000], tail=b'{"display": "p2", "timesta')
+        self.assertEqual(self.seek(self.T0 + 1000), offsets[1])
+        self.assertLessEqual(self.seek(self.T0 + 5000), self.path.stat().st_size)
+
+    def test_unreadable_timestamps_lean_early(self):
+        """timestamp を読めない行はカットオフ以降とみなすので、その行より後ろへは進まない"""
+        timestamps = [self.T0 + i * 1000 for i in range(50)]
+        timestamps[20] = None
+        offsets = self.write_timestamps(timestamps)
+        self.assertLessEqual(self.seek(self.T0 + 40_000), offsets[40])
+        self.assertLessEqual(self.seek(self.T0 + 10_000), offsets[10])
+
+    def test_out_of_order_lines_within_slack(self):
+        """前後に揺れた timestamp でも、カットオフ以降の行はシーク位置（SEEK_SLACK_MS 手前）より後ろにある"""
+        rnd = random.Random(0)
+        half_slack = collect.SEEK_SLACK_MS // 2
+        timestamps = [self.T0 + i * 600_000 + rnd.randint(-half_slack, half_slack) for i in range(2000)]
+        offsets = self.write_timestamps(timestamps)
+        for cutoff_ms in (self.T0, self.T0 + 300 * 600_000, self.T0 + 1500 * 600_000, self.T0 + 2100 * 600_000):
+            with self.subTest(cutoff_ms=cutoff_ms):
+                head = self.seek(cutoff_ms - collect.SEEK_SLACK_MS)
+                self.assertTrue(all(offset >= head for offset, ts in zip(offsets, timestamps) if ts >= cutoff_ms))
+                records, _ = collect.read_jsonl_records(self.path, collect.HISTORY_FORMAT, None, cutoff_ms=cutoff_ms)
+                self.assertEqual(sorted(r[1] for r in records if r[0] >= cutoff_ms),
+                                 sorted(f"p{i}" for i, ts in enumerate(timestamps) if ts >= cutoff_ms))
+
+    def test_session_ids_in_window_match_with_and_without_cache(self):
+        """前回より広い・狭い窓や追記のあとでも、キャッシュを使った結果はシーク位置以降の行の sessionId と同じ"""
+        timestamps = [self.T0 + i * 3_600_000 for i in range(24 * 10)]
+        db = Path(self.tmp.name) / "checkpoints.sqlite3"
+        for days_back in (2, 5, 1, 8, 3):
+            if days_back == 3:
+                timestamps += [timestamps[-1] + i * 3_600_000 for i in range(1, 25)]
+            self.write_timestamps(timestamps)
+            cutoff_ms = timestamps[-1] - days_back * 86_400_000
+            head = self.seek(cutoff_ms - collect.SEEK_SLACK_MS)
+            expected = {f"s{i}" for i, ts in enumerate(timestamps) if ts >= cutoff_ms - collect.SEEK_SLACK_MS}
+            with self.subTest(days_back=days_back):
+                self.assertEqual(collect.history_session_ids(self.path, None, cutoff_ms), expected)
+                checkpoints = collect.CheckpointStore(db)
+                self.assertEqual(collect.history_session_ids(self.path, checkpoints, cutoff_ms), expected)
+                checkpoints.save()
+                checkpoints.conn.close()
+                self.assertGreater(head, 0)
+        self.assertEqual(len(collect.history_session_ids(self.path, None)), len(timestamps))
+
+
+
+class NearDuplicateIndexTest(unittest.TestCase):
+    BASE = ("collect.py の history.jsonl 読み込みでシーク位置より前のセッションIDが取りこぼされる問題を調べて、"
+            "再現するテストを書いてから修正してください。修正後は --days 7 と --days 30 の両方で出力を比べること。")
+    UNRELATED = [
+        "まったく別の依頼です。README の日本語を見直して、誤字脱字を直し、表の列幅をそろえてください。",
+        "Refactor the OpenCode collector to stream rows from SQLite with a cursor instead of fetchall.",
+        "collect.py の --export で Parquet を書き出すときに、辞書エンコードが効いているか確認してください。",
+    ]
+
+    def test_marks_near_duplicates_of_the_first(self):
+        index = collect.NearDuplicateIndex("annotate")
+        self.assertIsNone(index.add(self.BASE))
+        variants = [
+            self.BASE,
+            self.BASE.upper().replace("。", "。 "),
+            self.BASE + " よろしく",
+            self.BASE.replace("修正してください", "直してください"),
+        ]
+        for text in variants:
+            with self.subTest(text=text):
+                self.assertEqual(index.add(text), 0)
+        self.assertEqual(index.summary(), {"mode": "annotate", "clusters": 1, "duplicates": len(variants)})
+
+    def test_leaves_unrelated_and_short_texts(self):
+        index = collect.NearDuplicateIndex("collapse")
+        index.add(self.BASE)
+        for text in self.UNRELATED:
+            with self.subTest(text=text):
+                self.assertIsNone(index.add(text))
+        # 短い定型入力は同じ内容でも重複にしない
+        for _ in range(3):
+            self.assertIsNone(index.add("続けて"))
+        self.assertEqual(index.summary(), {"mode": "collapse", "clusters": 0, "duplicates": 0})
+
+    def test_apply_near_duplicates(self):
+        messages = [collect.Message(text, 1_700_000_000_000 + i, "p") for i, text in enumerate([self.BASE, self.UNRELATED[0], self.BASE + " よろしく"])]
+        sources = [collect.make_source_result("Claude Code", messages)]
+        annotated = collect.apply_near_duplicates(sources, collect.NearDuplicateIndex("annotate"))[0]["messages"]
+        self.assertEqual([msg.near_dup_of for msg in annotated], [None, None, 0])
+        collapsed = collect.apply_near_duplicates(sources, collect.NearDuplicateIndex("collapse"))[0]["messages"]
+        self.assertEqual([msg.text for msg in collapsed], [self.BASE, self.UNRELATED[0]])
+
+
+
+class BudgetedEventsTest(unittest.TestCase):
+    def test_reports_sources_cut_off_by_the_deadline(self):
+        """締め切りで読み終えられなかったソースと、始まらなかったソースは complete=False になる"""
+        budget = collect.Budget(None)
+
+        def done():
+            yield collect.Message("a の1件目", 1, "p")
+
+        def cut_off():
+            source_budget = budget.source("b")
+            for i in range(3):
+                # 収集関数と同じく、ファイルの区切りごとに締め切りを確認する
+                if source_budget.exhausted():
+                    return
+                if i == 0:
+                    budget.deadline = 0
+                yield collect.Message(f"b のファイル{i}", 1, "p")
+
+        def not_started():
+            self.fail("締め切り後に始まった")
+            yield
+
+        collectors = [("a", done), ("b", cut_off), ("c", not_started)]
+        events = list(collect.iter_events_budgeted(collectors, budget))
+        complete = {tool: payload["complete"] for kind, tool, payload in events if kind == "budget"}
+        self.assertEqual(complete, {"a": True, "b": False, "c": False})
+        messages = [payload.text for kind, _, payload in events if kind == "message"]
+        self.assertEqual(messages, ["a の1件目", "b のファイル0"])
+        self.assertEqual([tool for kind, tool, payload in events if kind == "end"], ["a", "b", "c"])
+        self.assertTrue(all(payload is None for kind, _, payload in events if kind == "end"))
+
+    def test_all_complete_without_deadline(self):
+        def stream(tool):
+            return lambda: iter([collect.Message(f"{tool} {i}", i, "p") for i in range(3)])
+
+        events = list(collect.iter_events_budgeted([(tool, stream(tool)) for tool in ("a", "b")], collect.Budget(None)))
+        self.assertEqual(sorted(payload["complete"] for kind, _, payload in events if kind == "budget"), [True, True])
+        self.assertEqual(sum(1 for kind, _, _ in events if kind == "message"), 6)
+
+
+if __name__ == "__main__":
+    unittest.main()